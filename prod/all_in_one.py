@@ -0,0 +1,132 @@
+"""
+All-in-one entry point.
+
+Runs the stream processor, face detection, face recognition and result
+aggregation services in a single process, connected by in-process queues.
+Frames, face crops and results are handed between the stages by reference,
+so nothing is encoded, serialized or sent over the network between them.
+Redis is still used for the known faces and the results store.
+"""
+
+import time
+import logging
+import signal
+import threading
+from typing import List
+
+from prod.config import (
+    MODEL_PATH,
+    DETECTION_BATCH_SIZE,
+    DETECTION_MAX_WAIT_MS,
+    RECOGNITION_BATCH_SIZE,
+    RECOGNITION_MAX_WAIT_MS
+)
+from prod.stream_processor.stream_processor import RTSPStreamProcessor
+from prod.face_detection.face_detection import FaceDetector
+from prod.face_recognition.face_recognition import FaceRecognizer
+from prod.result_aggregator.result_aggregator import ResultAggregator
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('all_in_one')
+
+
+class Pipeline:
+    """Runs every pipeline service in one process."""
+
+    def __init__(self, services: List):
+        """
+        Initialize the pipeline.
+
+        Args:
+            services: Services to run, consumers before producers
+        """
+        self.services = services
+        self.stop_event = threading.Event()
+        self.service_threads = []
+
+        # One stop event for everyone, so any service stopping stops them all
+        for service in services:
+            service.stop_event = self.stop_event
+
+        # Register signal handlers (replacing the ones each service installed)
+        signal.signal(signal.SIGINT, self._signal_handler)
+        signal.signal(signal.SIGTERM, self._signal_handler)
+
+    def _signal_handler(self, sig, frame):
+        """Handle termination signals gracefully."""
+        logger.info(f"Received signal {sig}, shutting down...")
+        self.stop_event.set()
+
+    def start(self):
+        """Start all services and wait until they are stopped."""
+        for service in self.services:
+            thread = threading.Thread(
+                target=service.start,
+                name=type(service).__name__,
+                daemon=True
+            )
+            self.service_threads.append(thread)
+            thread.start()
+            logger.info(f"Started {type(service).__name__}")
+
+        try:
+            while not self.stop_event.is_set():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logger.info("Keyboard interrupt received, shutting down...")
+        finally:
+            self.stop_event.set()
+            for thread in self.service_threads:
+                thread.join(timeout=10)
+            logger.info("Pipeline shutdown complete")
+
+
+def main():
+    """Main entry point for the all-in-one pipeline."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='All-in-one Face Recognition Pipeline')
+    parser.add_argument('--urls', nargs='+', required=True, help='RTSP stream URLs')
+    parser.add_argument('--model', default=MODEL_PATH, help='Path to the YOLO model weights')
+    parser.add_argument('--detection-workers', type=int, default=1, help='Number of face detection threads')
+    parser.add_argument('--detection-batch-size', type=int, default=DETECTION_BATCH_SIZE,
+                        help='Maximum number of frames per detection batch')
+    parser.add_argument('--recognition-workers', type=int, default=1, help='Number of face recognition threads')
+    parser.add_argument('--recognition-batch-size', type=int, default=RECOGNITION_BATCH_SIZE,
+                        help='Maximum number of faces per recognition batch')
+    parser.add_argument('--threshold', type=float, default=0.7, help='Similarity threshold')
+    parser.add_argument('--ttl', type=int, default=3600, help='Time-to-live for results in seconds')
+
+    args = parser.parse_args()
+
+    services = [
+        ResultAggregator(workers=1, result_ttl=args.ttl, queue_backend="inprocess"),
+        FaceRecognizer(
+            workers=args.recognition_workers,
+            similarity_threshold=args.threshold,
+            batch_size=args.recognition_batch_size,
+            max_wait_ms=RECOGNITION_MAX_WAIT_MS,
+            queue_backend="inprocess"
+        ),
+        FaceDetector(
+            model_path=args.model,
+            workers=args.detection_workers,
+            batch_size=args.detection_batch_size,
+            max_wait_ms=DETECTION_MAX_WAIT_MS,
+            # Torch threads are per process, the recognizer's setting applies
+            torch_threads=0,
+            queue_backend="inprocess"
+        ),
+        RTSPStreamProcessor(args.urls, queue_backend="inprocess"),
+    ]
+
+    pipeline = Pipeline(services)
+    pipeline.start()
+
+
+if __name__ == "__main__":
+    main()
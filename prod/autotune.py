@@ -0,0 +1,469 @@
+"""
+CPU autotuner for the face detection and face recognition services.
+
+Runs a short synthetic load through FaceDetector._detect_faces_batch and
+FaceRecognizer._extract_features_batch for every combination of workers,
+torch threads and batch size that fits the CPUs this process may use,
+measures throughput and p95 batch latency, and writes the best
+combination of each service to AUTOTUNE_FILE. The services read that file
+at startup (see config.py); environment variables and command line flags
+still take precedence over it.
+
+Detection workers are threads sharing one model, as in the detection
+service. Recognition workers are processes forked from one loaded model,
+as with RECOGNITION_WORKER_MODE=process. Every combination runs in freshly
+forked processes, so thread pool settings do not carry over between them.
+
+The CPU budget is the smaller of the CPUs in this process's affinity mask
+and the container's CPU quota, counting one CPU per physical core unless
+--smt is given: hyperthreads share a core's vector units, so the matrix
+multiplications of both models rarely gain from them. Run it on the host
+and under the limits the service will run with, e.g.
+
+    python -m prod.autotune detection --max-p95-ms 200
+    python -m prod.autotune recognition
+"""
+
+import os
+import json
+import time
+import queue
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from prod.config import (
+    AUTOTUNE_FILE,
+    MODEL_PATH,
+    DETECTOR_BACKEND,
+    EMBEDDING_MODEL
+)
+from prod.benchmarks.codec_benchmark import make_frame, RESOLUTIONS
+from prod.face_detection.backends import OnnxBackend
+from prod.face_detection.face_detection import FaceDetector
+from prod.face_recognition.embeddings import load_face_crops
+from prod.face_recognition.face_recognition import FaceRecognizer
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('autotune')
+
+# Reported by the processes of a trial released from the barrier by a failed one
+BARRIER_ABORTED = "aborted by another process of the trial"
+
+# Combinations within this fraction of the best throughput count as ties,
+# which go to the one using the fewest CPUs
+TIE_MARGIN = 0.05
+
+
+def _read_sysfs(path: str) -> Optional[str]:
+    """Contents of a sysfs or cgroup file, None when it cannot be read."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota() -> Optional[float]:
+    """
+    CPU limit of the container.
+
+    Returns:
+        CPUs allowed by the cgroup (v2 cpu.max or v1 CFS quota), None when unlimited
+    """
+    cpu_max = _read_sysfs("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, period = cpu_max.split()
+        return None if quota == "max" else int(quota) / int(period)
+
+    quota = _read_sysfs("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read_sysfs("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def cpu_topology() -> Dict[str, Any]:
+    """
+    CPUs this process can use.
+
+    Returns:
+        Dict with the logical CPUs of the affinity mask, the physical cores
+        they belong to, and the cgroup CPU quota (None when unlimited)
+    """
+    cpus = sorted(os.sched_getaffinity(0))
+    cores = set()
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        core = (_read_sysfs(f"{topology}/physical_package_id"), _read_sysfs(f"{topology}/core_id"))
+        # Without topology information every CPU counts as a core
+        cores.add(core if None not in core else ("cpu", str(cpu)))
+    return {"logical": len(cpus), "physical": len(cores), "quota": cgroup_cpu_quota()}
+
+
+def cpu_budget(topology: Dict[str, Any], smt: bool = False) -> int:
+    """Number of CPUs the workers may keep busy."""
+    budget = topology["logical"] if smt else topology["physical"]
+    if topology["quota"]:
+        budget = min(budget, int(topology["quota"]))
+    return max(1, budget)
+
+
+def powers_of_two(limit: int) -> List[int]:
+    """1, 2, 4, ... up to limit, and limit itself."""
+    return sorted({2 ** i for i in range(limit.bit_length())} | {limit})
+
+
+def _trial_process(setup: Callable[[], Callable[[], int]], threads: int, duration: float,
+                   barrier, results):
+    """
+    Body of one trial process: warm up, then call the step in threads until the time is up.
+
+    Puts (items processed, batch latencies in seconds, elapsed seconds,
+    error message or None) on the results queue.
+    """
+    try:
+        step = setup()
+        step()  # warm up
+        barrier.wait()
+
+        lock = threading.Lock()
+        latencies: List[float] = []
+        items = [0]
+        start = time.perf_counter()
+        deadline = start + duration
+
+        def run():
+            local, count = [], 0
+            while time.perf_counter() < deadline:
+                batch_start = time.perf_counter()
+                count += step()
+                local.append(time.perf_counter() - batch_start)
+            with lock:
+                latencies.extend(local)
+                items[0] += count
+
+        workers = [threading.Thread(target=run, daemon=True) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        results.put((items[0], latencies, time.perf_counter() - start, None))
+    except threading.BrokenBarrierError:
+        results.put((0, [], 0.0, BARRIER_ABORTED))
+    except Exception as e:
+        # Release the other processes of the trial waiting at the barrier
+        barrier.abort()
+        results.put((0, [], 0.0, str(e) or type(e).__name__))
+
+
+def run_trial(setup: Callable[[], Callable[[], int]], processes: int, threads: int,
+              duration: float) -> Dict[str, float]:
+    """
+    Run a synthetic load in forked processes.
+
+    Args:
+        setup: Called in each process; returns the step, which processes
+            one batch and returns the number of items in it
+        processes: Number of processes
+        threads: Threads calling the step in each process
+        duration: Seconds to measure for, after a warm-up step
+
+    Returns:
+        Dict with the throughput in items per second and the mean and
+        p95 batch latency in milliseconds
+    """
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    children = [
+        context.Process(target=_trial_process, args=(setup, threads, duration, barrier, results), daemon=True)
+        for _ in range(processes)
+    ]
+    for child in children:
+        child.start()
+
+    outcomes = []
+    try:
+        # Generous timeout: the warm-up may compile or load a model
+        for _ in children:
+            outcomes.append(results.get(timeout=duration + 300))
+    except queue.Empty:
+        raise RuntimeError("trial timed out")
+    finally:
+        for child in children:
+            child.join(timeout=5)
+            if child.is_alive():
+                child.terminate()
+
+    errors = [error for _, _, _, error in outcomes if error]
+    if errors:
+        raise RuntimeError(min(errors, key=lambda error: error == BARRIER_ABORTED))
+    latencies = np.concatenate([np.asarray(latencies) for _, latencies, _, _ in outcomes])
+    if not len(latencies):
+        raise RuntimeError("no batch completed")
+    return {
+        "throughput": sum(items / elapsed for items, _, elapsed, _ in outcomes),
+        "mean_ms": float(latencies.mean() * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+
+
+def pick_best(trials: List[Dict[str, Any]], max_p95_ms: float) -> Optional[Dict[str, Any]]:
+    """
+    Pick the highest throughput combination with a p95 latency under max_p95_ms.
+
+    Args:
+        trials: Measured combinations; failed ones have an "error" key
+        max_p95_ms: p95 latency limit in milliseconds, 0 for none
+
+    Returns:
+        The best trial, the lowest latency one when none is under the
+        limit, or None when every trial failed
+    """
+    measured = [trial for trial in trials if "error" not in trial]
+    if not measured:
+        return None
+    within = [trial for trial in measured if not max_p95_ms or trial["p95_ms"] <= max_p95_ms]
+    if not within:
+        logger.warning(f"No combination has a p95 latency under {max_p95_ms}ms, picking the lowest latency")
+        return min(measured, key=lambda trial: trial["p95_ms"])
+    top = max(trial["throughput"] for trial in within)
+    ties = [trial for trial in within if trial["throughput"] >= top * (1 - TIE_MARGIN)]
+    return min(ties, key=lambda trial: (trial["workers"] * trial["threads"], trial["p95_ms"]))
+
+
+def tune(name: str, make_setup: Callable[[int, int], Callable[[], Callable[[], int]]],
+         worker_processes: bool, grid: List[Dict[str, int]], duration: float,
+         max_p95_ms: float) -> Dict[str, Any]:
+    """
+    Measure every combination of the grid and pick the best.
+
+    Args:
+        name: Service name, for the output
+        make_setup: Returns the trial setup for (torch threads, batch size)
+        worker_processes: Whether workers are processes rather than threads
+        grid: Combinations of workers, threads and batch_size
+        duration: Seconds to measure each combination for
+        max_p95_ms: p95 latency limit in milliseconds, 0 for none
+
+    Returns:
+        Dict with the measured trials and the best one
+    """
+    unit = "processes" if worker_processes else "threads"
+    print(f"\n{name}: {len(grid)} combinations of {duration:.0f}s, workers are {unit}")
+    print(f"{'workers':>8}{'threads':>8}{'batch':>7}{'items/s':>10}{'mean ms':>10}{'p95 ms':>9}")
+
+    trials = []
+    for combination in grid:
+        trial = dict(combination)
+        try:
+            setup = make_setup(combination["threads"], combination["batch_size"])
+            if worker_processes:
+                trial.update(run_trial(setup, combination["workers"], 1, duration))
+            else:
+                trial.update(run_trial(setup, 1, combination["workers"], duration))
+            print(f"{trial['workers']:>8}{trial['threads']:>8}{trial['batch_size']:>7}"
+                  f"{trial['throughput']:>10.1f}{trial['mean_ms']:>10.1f}{trial['p95_ms']:>9.1f}")
+        except Exception as e:
+            trial["error"] = str(e)
+            print(f"{trial['workers']:>8}{trial['threads']:>8}{trial['batch_size']:>7}  failed: {str(e)}")
+        trials.append(trial)
+
+    best = pick_best(trials, max_p95_ms)
+    if best:
+        print(f"Best: {best['workers']} workers x {best['threads']} threads, batch size {best['batch_size']}: "
+              f"{best['throughput']:.1f} items/s, p95 {best['p95_ms']:.1f}ms")
+    return {"trials": trials, "best": best}
+
+
+def _restore_signals():
+    """Let Ctrl-C stop the autotuner; the services install handlers that only set their stop event."""
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def tune_detection(args, grid: List[Dict[str, int]]) -> Optional[Dict[str, Any]]:
+    """Tune the detection workers, torch (or ONNX Runtime) threads and batch size."""
+    detector = FaceDetector(model_path=args.model, detector_backend=args.detector_backend,
+                            torch_threads=0, queue_backend="inprocess")
+    _restore_signals()
+    # Loaded (and for ONNX exported) once, before the trials fork
+    if not detector._load_model():
+        return None
+
+    height, width = RESOLUTIONS[args.resolution]
+    frames = [make_frame(height, width, args.image, seed=seed)
+              for seed in range(max(combination["batch_size"] for combination in grid))]
+
+    def make_setup(threads, batch_size):
+        def setup():
+            if detector.detector_backend == "onnx":
+                detector.model = OnnxBackend(detector.model_path, threads=threads)
+            else:
+                torch.set_num_threads(threads)
+            batch = frames[:batch_size]
+            return lambda: len(detector._detect_faces_batch(batch))
+        return setup
+
+    section = tune("Face detection", make_setup, False, grid, args.duration, args.max_p95_ms)
+    best = section["best"]
+    if best:
+        threads_setting = "ONNX_THREADS" if detector.detector_backend == "onnx" else "DETECTION_TORCH_THREADS"
+        section["settings"] = {
+            "DETECTION_WORKERS": best["workers"],
+            threads_setting: best["threads"],
+            "DETECTION_BATCH_SIZE": best["batch_size"],
+        }
+    section["backend"] = detector.detector_backend
+    return section
+
+
+def tune_recognition(args, grid: List[Dict[str, int]]) -> Optional[Dict[str, Any]]:
+    """Tune the recognition worker processes, torch threads and batch size."""
+    recognizer = FaceRecognizer(embedding_model=args.embedding_model, worker_mode="thread",
+                                torch_threads=0, queue_backend="inprocess")
+    _restore_signals()
+    if recognizer.device.type != "cpu":
+        logger.warning(f"Recognition runs on {recognizer.device}, the autotuner only tunes CPU inference")
+        return None
+    # Loaded once, before the trials fork, as in process worker mode
+    if not recognizer._load_model():
+        return None
+
+    count = max(combination["batch_size"] for combination in grid)
+    if args.faces:
+        faces = load_face_crops(args.faces, limit=count)
+        faces = [faces[i % len(faces)] for i in range(count)] if faces else []
+        if not faces:
+            logger.error(f"No face crops in {args.faces}")
+            return None
+    else:
+        faces = [make_frame(160, 140, seed=seed) for seed in range(count)]
+
+    def make_setup(threads, batch_size):
+        def setup():
+            torch.set_num_threads(threads)
+            batch = faces[:batch_size]
+            return lambda: len(recognizer._extract_features_batch(batch))
+        return setup
+
+    section = tune("Face recognition", make_setup, True, grid, args.duration, args.max_p95_ms)
+    best = section["best"]
+    if best:
+        section["settings"] = {
+            "RECOGNITION_WORKERS": best["workers"],
+            "RECOGNITION_TORCH_THREADS": best["threads"],
+            "RECOGNITION_BATCH_SIZE": best["batch_size"],
+            "RECOGNITION_WORKER_MODE": "process" if best["workers"] > 1 else "thread",
+        }
+    section["embedding_model"] = recognizer.embedding_model
+    return section
+
+
+def write_results(path: str, sections: Dict[str, Dict[str, Any]], topology: Dict[str, Any], budget: int):
+    """
+    Write the measurements and settings, keeping the settings of services not tuned this time.
+
+    The file is replaced atomically, so a service starting meanwhile reads
+    either the old or the new settings.
+    """
+    try:
+        with open(path) as f:
+            results = json.load(f)
+        if not isinstance(results, dict):
+            results = {}
+    except (OSError, ValueError):
+        results = {}
+
+    settings = dict(results.get("settings", {}))
+    for section in sections.values():
+        settings.update(section.get("settings", {}))
+    results.update(sections)
+    results.update(
+        created=datetime.now(timezone.utc).isoformat(),
+        cpu=dict(topology, budget=budget),
+        settings=settings
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(results, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def main():
+    """Main entry point for the autotuner."""
+    parser = argparse.ArgumentParser(description='Tune worker counts, torch threads and batch sizes for this CPU')
+    parser.add_argument('service', nargs='?', choices=['detection', 'recognition', 'all'], default='all',
+                        help='Service to tune')
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help='Worker counts to try (powers of two up to the CPU budget by default)')
+    parser.add_argument('--threads', type=int, nargs='+', default=None,
+                        help='Torch threads per worker to try (powers of two up to the CPU budget by default)')
+    parser.add_argument('--detection-batch-sizes', type=int, nargs='+', default=[1, 4, 8],
+                        help='Detection batch sizes to try')
+    parser.add_argument('--recognition-batch-sizes', type=int, nargs='+', default=[8, 16, 32],
+                        help='Recognition batch sizes to try')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to measure each combination for')
+    parser.add_argument('--max-p95-ms', type=float, default=0,
+                        help='Only pick combinations with a p95 batch latency under this, 0 for no limit')
+    parser.add_argument('--smt', action='store_true',
+                        help='Count hyperthreads as CPUs (one CPU per physical core otherwise)')
+    parser.add_argument('--oversubscribe', action='store_true',
+                        help='Also try combinations with more workers x threads than CPUs')
+    parser.add_argument('--model', default=MODEL_PATH, help='Path to the YOLO model weights')
+    parser.add_argument('--detector-backend', choices=['ultralytics', 'onnx'], default=DETECTOR_BACKEND,
+                        help='Detector backend to tune')
+    parser.add_argument('--resolution', choices=list(RESOLUTIONS), default="1080p",
+                        help='Resolution of the synthetic frames')
+    parser.add_argument('--image', default=None, help='Optional image to detect on instead of a synthetic frame')
+    parser.add_argument('--embedding-model', choices=['resnet50', 'resnet18', 'facenet'], default=EMBEDDING_MODEL,
+                        help='Embedding model to tune')
+    parser.add_argument('--faces', default=None, help='Folder of face crops to embed (synthetic crops otherwise)')
+    parser.add_argument('--output', default=AUTOTUNE_FILE, help='File the services read the settings from')
+
+    args = parser.parse_args()
+
+    topology = cpu_topology()
+    budget = cpu_budget(topology, args.smt)
+    print(f"{topology['logical']} logical CPUs on {topology['physical']} physical cores, "
+          f"CPU quota: {topology['quota'] or 'none'}, tuning for {budget} CPUs")
+
+    workers = args.workers or powers_of_two(budget)
+    threads = args.threads or powers_of_two(budget)
+    pairs = [(w, t) for w in workers for t in threads if args.oversubscribe or w * t <= budget]
+    if not pairs:
+        parser.error(f"No combination of --workers and --threads fits in {budget} CPUs, pass --oversubscribe")
+
+    def grid(batch_sizes):
+        return [{"workers": w, "threads": t, "batch_size": b} for w, t in pairs for b in batch_sizes]
+
+    sections = {}
+    if args.service in ('detection', 'all'):
+        sections["detection"] = tune_detection(args, grid(args.detection_batch_sizes))
+    if args.service in ('recognition', 'all'):
+        sections["recognition"] = tune_recognition(args, grid(args.recognition_batch_sizes))
+    sections = {name: section for name, section in sections.items() if section and section["best"]}
+
+    if not sections:
+        logger.error("Nothing was tuned, keeping the existing settings")
+        raise SystemExit(1)
+    write_results(args.output, sections, topology, budget)
+    logger.info(f"Wrote {', '.join(sections)} settings to {args.output}; services read them at startup")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import logging
+
+from prod.config import (
+    FRAME_SAMPLE_RATE,
+    BACKPRESSURE_HIGH_DEPTH,
+    BACKPRESSURE_LOW_DEPTH,
+    MIN_SAMPLE_RATE
+)
+
+logger = logging.getLogger('backpressure')
+
+
+class AdaptiveSampleRate:
+    """
+    Sample rate that backs off while a queue is backed up.
+
+    The rate is halved each time the queue depth is at or above the high
+    watermark and raised again by a tenth of the target rate each time it is
+    at or below the low watermark (AIMD), so producers shed load quickly and
+    recover gradually once the consumers have caught up.
+    """
+
+    def __init__(self, name: str = "frames", target_rate: float = FRAME_SAMPLE_RATE,
+                 min_rate: float = MIN_SAMPLE_RATE,
+                 high_depth: int = BACKPRESSURE_HIGH_DEPTH,
+                 low_depth: int = BACKPRESSURE_LOW_DEPTH):
+        """
+        Initialize the rate at its target.
+
+        Args:
+            name: Name used in log messages
+            target_rate: Frames per second sampled without backpressure
+            min_rate: Lowest frames per second sampled under backpressure
+            high_depth: Queue depth from which the rate is lowered
+            low_depth: Queue depth below which the rate is raised
+        """
+        self.name = name
+        self.target_rate = target_rate
+        self.min_rate = min(min_rate, target_rate)
+        self.high_depth = high_depth
+        self.low_depth = low_depth
+        self.rate = target_rate
+
+    def update(self, depth: int) -> float:
+        """
+        Adjust the rate to the current queue depth.
+
+        Args:
+            depth: Number of items waiting in the queue
+
+        Returns:
+            The new sample rate
+        """
+        previous = self.rate
+        if depth >= self.high_depth:
+            self.rate = max(self.min_rate, self.rate / 2)
+        elif depth <= self.low_depth:
+            self.rate = min(self.target_rate, self.rate + self.target_rate / 10)
+
+        if self.rate != previous:
+            logger.info(f"{self.name}: queue depth {depth}, sample rate {previous:.2f} -> {self.rate:.2f} frames/sec")
+        return self.rate
@@ -0,0 +1,6 @@
+"""
+Benchmarks
+ 
+Standalone scripts that measure the cost of individual pipeline stages
+so settings can be chosen per deployment.
+"""
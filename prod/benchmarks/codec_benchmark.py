@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the queue image codecs.
+
+This script encodes and decodes frames at 1080p and 4K (and a typical
+face crop) with every available codec and reports the CPU cost, the
+message size and the Redis bandwidth it implies for a deployment.
+"""
+
+import argparse
+import time
+import cv2
+import numpy as np
+
+from prod.config import FRAME_SAMPLE_RATE
+from prod.image_codecs import JpegCodec, PngCodec, WebpCodec, RawCodec
+
+RESOLUTIONS = {
+    "face": (160, 160),
+    "1080p": (1080, 1920),
+    "4k": (2160, 3840),
+}
+
+
+def make_frame(height, width, image_path=None, seed=0):
+    """
+    Create a test frame.
+
+    Uses the given image resized to the target resolution, or a synthetic
+    scene of smooth shapes plus sensor noise, which compresses roughly like
+    real CCTV footage.
+    """
+    if image_path:
+        image = cv2.imread(image_path)
+        if image is None:
+            raise FileNotFoundError(f"Image not found: {image_path}")
+        return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (height // 64 + 1, width // 64 + 1, 3), dtype=np.uint8)
+    frame = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    for _ in range(20):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(height // 40, height // 6))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(frame, center, radius, color, -1)
+    noise = rng.normal(0, 4, frame.shape)
+    return np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+
+def time_codec(codec, frame, repeats):
+    """
+    Measure encode and decode time of a codec on a frame.
+
+    Returns:
+        Tuple of (encode microseconds, decode microseconds, encoded bytes, PSNR)
+    """
+    encoded = codec.encode(frame)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        encoded = codec.encode(frame)
+    encode_us = (time.perf_counter() - start) / repeats * 1e6
+
+    decoded = codec.decode(encoded)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        decoded = codec.decode(encoded)
+    decode_us = (time.perf_counter() - start) / repeats * 1e6
+
+    psnr = cv2.PSNR(frame, np.ascontiguousarray(decoded))
+    return encode_us, decode_us, len(encoded), psnr
+
+
+def benchmark(resolutions, codecs, repeats, streams, sample_rate, image_path):
+    """
+    Run the benchmark and print one table per resolution.
+    """
+    for resolution in resolutions:
+        height, width = RESOLUTIONS[resolution]
+        frame = make_frame(height, width, image_path)
+
+        print(f"\n{resolution} ({width}x{height}), {streams} streams at {sample_rate} frames/sec")
+        print(f"{'codec':<14}{'encode us':>12}{'decode us':>12}{'KB/frame':>11}{'PSNR dB':>9}{'Redis MB/s':>12}")
+
+        for codec in codecs:
+            try:
+                encode_us, decode_us, size, psnr = time_codec(codec, frame, repeats)
+            except (cv2.error, ValueError) as e:
+                print(f"{codec.name:<14}unavailable: {str(e)}")
+                continue
+
+            # Every message is written to and read back from Redis once
+            bandwidth = 2 * size * streams * sample_rate / 1e6
+            label = codec.name
+            if isinstance(codec, (JpegCodec, WebpCodec)):
+                label += f" q{codec.params[1]}"
+            elif isinstance(codec, PngCodec):
+                label += f" level {codec.params[1]}"
+            psnr = "lossless" if psnr >= 100 else f"{psnr:.1f}"
+            print(f"{label:<14}{encode_us:>12.0f}{decode_us:>12.0f}{size / 1024:>11.1f}{psnr:>9}{bandwidth:>12.1f}")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Benchmark queue image codecs')
+    parser.add_argument('--resolutions', nargs='+', default=list(RESOLUTIONS), choices=list(RESOLUTIONS),
+                        help='Resolutions to test')
+    parser.add_argument('--jpeg-quality', type=int, nargs='+', default=[95, 85, 75],
+                        help='JPEG qualities to test')
+    parser.add_argument('--repeats', type=int, default=10, help='Encode/decode repetitions per measurement')
+    parser.add_argument('--streams', type=int, default=30, help='Number of camera streams')
+    parser.add_argument('--sample-rate', type=float, default=FRAME_SAMPLE_RATE,
+                        help='Sampled frames per second per stream')
+    parser.add_argument('--image', default=None, help='Optional image to use instead of a synthetic frame')
+
+    args = parser.parse_args()
+
+    codecs = [JpegCodec(quality) for quality in args.jpeg_quality]
+    codecs += [WebpCodec(), PngCodec(), RawCodec()]
+
+    benchmark(
+        args.resolutions,
+        codecs,
+        args.repeats,
+        args.streams,
+        args.sample_rate,
+        args.image
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the face detector backends.
+
+This script runs the YOLO weights with ultralytics (PyTorch) and with the
+ONNX export on ONNX Runtime on the same frames, checks that both find the
+same faces (every box of one backend matched by a box of the other with
+at least --min-iou overlap and confidences within --conf-tolerance), and
+reports the latency per frame for several batch sizes.
+
+It exits with status 1 when the backends disagree, so it can be run as a
+check after upgrading ultralytics or ONNX Runtime or retraining the model.
+"""
+
+import argparse
+import sys
+import time
+import cv2
+import numpy as np
+
+from prod.benchmarks.codec_benchmark import RESOLUTIONS, make_frame
+from prod.config import MODEL_PATH, FACE_DETECTION_CONFIDENCE, FACE_DETECTION_IOU
+from prod.face_detection.backends import DETECTOR_BACKENDS, get_detector_backend
+from prod.tracking import iou_matrix
+
+
+def load_frames(image_paths, resolution, count):
+    """Read the given images, or make synthetic frames at a resolution."""
+    if image_paths:
+        frames = [cv2.imread(path) for path in image_paths]
+        missing = [path for path, frame in zip(image_paths, frames) if frame is None]
+        if missing:
+            raise FileNotFoundError(f"Images not found: {', '.join(missing)}")
+        return frames
+
+    height, width = RESOLUTIONS[resolution]
+    return [make_frame(height, width, seed=seed) for seed in range(count)]
+
+
+def compare(reference, candidate, min_iou, conf_tolerance):
+    """
+    Count the boxes of two detections of a frame that have no counterpart.
+
+    Returns:
+        Number of unmatched boxes, in either direction
+    """
+    if not len(reference) or not len(candidate):
+        return len(reference) + len(candidate)
+
+    ious = iou_matrix(reference[:, :4], candidate[:, :4])
+    unmatched = 0
+    for ious_a, dets_a, dets_b in ((ious, reference, candidate), (ious.T, candidate, reference)):
+        best = ious_a.argmax(axis=1)
+        matched = (ious_a.max(axis=1) >= min_iou) & (np.abs(dets_a[:, 4] - dets_b[best, 4]) <= conf_tolerance)
+        unmatched += int((~matched).sum())
+    return unmatched
+
+
+def time_backend(backend, frames, batch_size, repeats):
+    """
+    Measure the detection latency of a backend.
+
+    Returns:
+        Milliseconds per frame
+    """
+    batches = [frames[i:i + batch_size] for i in range(0, len(frames), batch_size)]
+    backend.predict(batches[0], FACE_DETECTION_CONFIDENCE, FACE_DETECTION_IOU)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for batch in batches:
+            backend.predict(batch, FACE_DETECTION_CONFIDENCE, FACE_DETECTION_IOU)
+    return (time.perf_counter() - start) / (repeats * len(frames)) * 1000
+
+
+def benchmark(model_path, backend_names, frames, batch_sizes, repeats, min_iou, conf_tolerance):
+    """
+    Run the parity check and the benchmark.
+
+    Returns:
+        True when every backend found the same faces as the first one
+    """
+    backends = {name: get_detector_backend(name, model_path) for name in backend_names}
+
+    reference_name = backend_names[0]
+    reference = backends[reference_name].predict(frames, FACE_DETECTION_CONFIDENCE, FACE_DETECTION_IOU)
+    consistent = True
+    print(f"\nParity against {reference_name} on {len(frames)} frames "
+          f"({sum(len(d) for d in reference)} detections)")
+    for name in backend_names[1:]:
+        detections = backends[name].predict(frames, FACE_DETECTION_CONFIDENCE, FACE_DETECTION_IOU)
+        unmatched = sum(compare(a, b, min_iou, conf_tolerance) for a, b in zip(reference, detections))
+        consistent &= unmatched == 0
+        print(f"{name:>12}: {sum(len(d) for d in detections)} detections, {unmatched} unmatched")
+
+    print(f"\nLatency, milliseconds per frame ({frames[0].shape[1]}x{frames[0].shape[0]})")
+    print(f"{'backend':>12}" + "".join(f"{f'batch {size}':>10}" for size in batch_sizes))
+    for name, backend in backends.items():
+        latencies = [time_backend(backend, frames, size, repeats) for size in batch_sizes]
+        print(f"{name:>12}" + "".join(f"{latency:>10.1f}" for latency in latencies))
+
+    return consistent
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Compare the output and latency of the face detector backends')
+    parser.add_argument('--model', default=MODEL_PATH, help='Path to the YOLO model weights')
+    parser.add_argument('--backends', nargs='+', default=list(DETECTOR_BACKENDS), choices=list(DETECTOR_BACKENDS),
+                        help='Backends to compare, the first one is the reference')
+    parser.add_argument('--images', nargs='+', default=None,
+                        help='Images with faces to use instead of synthetic frames (recommended for the parity check)')
+    parser.add_argument('--resolution', default="1080p", choices=["1080p", "4k"],
+                        help='Resolution of the synthetic frames')
+    parser.add_argument('--frames', type=int, default=8, help='Number of synthetic frames')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8], help='Batch sizes to time')
+    parser.add_argument('--repeats', type=int, default=5, help='Repetitions per measurement')
+    parser.add_argument('--min-iou', type=float, default=0.9, help='Minimum IoU of matching boxes')
+    parser.add_argument('--conf-tolerance', type=float, default=0.05, help='Maximum confidence difference of matching boxes')
+
+    args = parser.parse_args()
+
+    frames = load_frames(args.images, args.resolution, args.frames)
+    consistent = benchmark(
+        args.model,
+        args.backends,
+        frames,
+        args.batch_sizes,
+        args.repeats,
+        args.min_iou,
+        args.conf_tolerance
+    )
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the face embedding models.
+
+This script loads every embedding model of the registry (fp32, eager) in
+a fresh process and reports its startup time, the memory taken by its weights and
+the resident memory of the process after a batch, and the CPU latency per
+face for several batch sizes.
+
+Pass --random-weights to skip downloading the pretrained weights: speed
+and memory do not depend on the values of the weights.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+import torch
+
+from prod.benchmarks.codec_benchmark import make_frame
+from prod.face_recognition.embeddings import EMBEDDING_MODELS, get_embedding_model
+
+
+def rss_mb():
+    """Peak resident memory of this process in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(name, batch_sizes, repeats, threads, pretrained):
+    """
+    Load a model and time it, in the calling process.
+
+    Returns:
+        Tuple of (dimension, startup seconds, weights MB, peak RSS MB,
+        milliseconds per face for each batch size)
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    faces = [make_frame(160, 140, seed=seed) for seed in range(max(batch_sizes))]
+
+    start = time.perf_counter()
+    model = get_embedding_model(name, torch.device('cpu'), weights=None, pretrained=pretrained,
+                                quantization="none", channels_last=False, compile_mode="none")
+    startup = time.perf_counter() - start
+
+    latencies = []
+    for batch_size in batch_sizes:
+        batch = faces[:batch_size]
+        model(batch)  # warm up
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(batch)
+        latencies.append((time.perf_counter() - start) / (repeats * batch_size) * 1000)
+
+    return model.dim, startup, model.parameter_bytes() / 2**20, rss_mb(), latencies
+
+
+def benchmark(names, batch_sizes, repeats, threads, pretrained):
+    """
+    Run the benchmark and print one row per model.
+    """
+    print(f"\nEmbedding models on CPU ({threads or torch.get_num_threads()} threads), "
+          f"milliseconds per face at each batch size")
+    print(f"{'model':>10}{'dim':>6}{'startup s':>11}{'weights MB':>12}{'peak RSS MB':>13}"
+          + "".join(f"{f'batch {size}':>10}" for size in batch_sizes))
+
+    # A fresh process per model, so startup and memory are not shared
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        with context.Pool(1) as pool:
+            try:
+                dim, startup, weights, rss, latencies = pool.apply(
+                    measure, (name, batch_sizes, repeats, threads, pretrained))
+            except Exception as e:
+                print(f"{name:>10}  failed: {str(e)}")
+                continue
+        print(f"{name:>10}{dim:>6}{startup:>11.2f}{weights:>12.0f}{rss:>13.0f}"
+              + "".join(f"{latency:>10.1f}" for latency in latencies))
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Compare the startup, memory and latency of the embedding models')
+    parser.add_argument('--models', nargs='+', default=list(EMBEDDING_MODELS), choices=list(EMBEDDING_MODELS),
+                        help='Embedding models to compare')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 16], help='Batch sizes to time')
+    parser.add_argument('--repeats', type=int, default=5, help='Repetitions per measurement')
+    parser.add_argument('--threads', type=int, default=0, help='Torch threads, 0 for the default')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Do not download the pretrained weights (same speed and memory)')
+
+    args = parser.parse_args()
+
+    benchmark(
+        args.models,
+        args.batch_sizes,
+        args.repeats,
+        args.threads,
+        not args.random_weights
+    )
+
+
+if __name__ == "__main__":
+    main()
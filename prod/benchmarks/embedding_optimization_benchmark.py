@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the embedding model inference optimizations.
+
+This script loads an embedding model in several optimization modes (INT8
+quantization, channels_last, TorchScript or torch.compile, and their
+combinations), checks each against the fp32 eager model on the same face
+crops, and reports latency and throughput per batch size.
+
+Accuracy is checked two ways: the cosine similarity between each face's
+optimized and fp32 embeddings, and the largest change in the similarity
+between any two faces, which is what matching against the gallery
+compares to the threshold. The script exits with status 1 when a mode's
+lowest cosine similarity is below --min-cosine.
+
+Use real face crops (--faces), e.g. saved from the faces queue, and a
+different set for --calibration-dir: calibrating static quantization on
+the evaluation faces overstates its accuracy.
+"""
+
+import argparse
+import sys
+import time
+import numpy as np
+import torch
+
+from prod.benchmarks.codec_benchmark import make_frame
+from prod.face_recognition.embeddings import EMBEDDING_MODELS, get_embedding_model, load_face_crops
+
+MODES = [
+    "fp32",
+    "channels_last",
+    "dynamic",
+    "static",
+    "static+channels_last",
+    "torchscript",
+    "static+channels_last+torchscript",
+    "inductor",
+]
+
+
+def parse_mode(mode):
+    """Split a mode like static+channels_last+torchscript into get_embedding_model options."""
+    options = set(mode.split("+")) - {"fp32"}
+    quantization = next((q for q in ("dynamic", "static") if q in options), "none")
+    compile_mode = next((c for c in ("torchscript", "inductor") if c in options), "none")
+    unknown = options - {quantization, compile_mode, "channels_last"}
+    if unknown:
+        raise ValueError(f"Unknown options in mode '{mode}': {', '.join(sorted(unknown))}")
+    return {"quantization": quantization, "channels_last": "channels_last" in options, "compile_mode": compile_mode}
+
+
+def embed(model, faces, batch_size):
+    """Embeddings of all faces, in batches."""
+    return np.concatenate([model(faces[i:i + batch_size])[0] for i in range(0, len(faces), batch_size)])
+
+
+def time_model(model, faces, batch_size, repeats):
+    """
+    Measure a model at one batch size.
+
+    Returns:
+        Tuple of (milliseconds per batch, faces per second)
+    """
+    batch = faces[:batch_size]
+    model(batch)  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model(batch)
+    elapsed = (time.perf_counter() - start) / repeats
+    return elapsed * 1000, len(batch) / elapsed
+
+
+def benchmark(name, modes, faces, calibration_dir, batch_sizes, repeats, pretrained, cache_dir, min_cosine):
+    """
+    Run the accuracy check and the benchmark.
+
+    Returns:
+        True when every mode is above min_cosine
+    """
+    def load(mode):
+        # Same random weights in every mode with --random-weights
+        torch.manual_seed(0)
+        return get_embedding_model(name, torch.device('cpu'), pretrained=pretrained,
+                                   calibration_dir=calibration_dir, cache_dir=cache_dir, **parse_mode(mode))
+
+    reference = embed(load("fp32"), faces, max(batch_sizes))
+    reference_similarities = reference @ reference.T
+
+    print(f"\n{name} on {len(faces)} faces, {torch.get_num_threads()} threads: "
+          f"ms per batch / faces per second at each batch size")
+    print(f"{'mode':>34}{'load s':>8}{'min cos':>9}{'max sim diff':>14}"
+          + "".join(f"{f'batch {size}':>16}" for size in batch_sizes))
+
+    consistent = True
+    for mode in modes:
+        try:
+            start = time.perf_counter()
+            model = load(mode)
+            load_time = time.perf_counter() - start
+        except Exception as e:
+            print(f"{mode:>34}  failed: {str(e)}")
+            continue
+
+        embeddings = embed(model, faces, max(batch_sizes))
+        cosine = (embeddings * reference).sum(axis=1).min()
+        similarity_diff = np.abs(embeddings @ embeddings.T - reference_similarities).max()
+        consistent &= bool(cosine >= min_cosine)
+
+        timings = [time_model(model, faces, size, repeats) for size in batch_sizes]
+        print(f"{mode:>34}{load_time:>8.1f}{cosine:>9.4f}{similarity_diff:>14.4f}"
+              + "".join(f"{f'{ms:.0f} / {fps:.0f}':>16}" for ms, fps in timings))
+
+    print("\nLoad times of torchscript modes include compiling on the first run; run again to time loading from the cache")
+    return consistent
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Compare the accuracy and speed of the embedding optimizations')
+    parser.add_argument('--model', default="resnet50", choices=list(EMBEDDING_MODELS), help='Embedding model')
+    parser.add_argument('--modes', nargs='+', default=MODES,
+                        help='Modes to compare, options joined by +: dynamic|static, channels_last, torchscript|inductor')
+    parser.add_argument('--faces', default=None, help='Folder of face crops to evaluate on (synthetic crops otherwise)')
+    parser.add_argument('--calibration-dir', default=None,
+                        help='Folder of face crops calibrating static quantization (defaults to --faces)')
+    parser.add_argument('--num-faces', type=int, default=64, help='Number of synthetic face crops')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16], help='Batch sizes to time')
+    parser.add_argument('--repeats', type=int, default=5, help='Repetitions per measurement')
+    parser.add_argument('--threads', type=int, default=0, help='Torch threads, 0 for the default')
+    parser.add_argument('--cache-dir', default="", help='Folder of compiled models, empty to compile every time')
+    parser.add_argument('--min-cosine', type=float, default=0.98,
+                        help='Lowest acceptable cosine similarity to the fp32 embeddings')
+    parser.add_argument('--random-weights', action='store_true',
+                        help='Do not download the pretrained weights (same speed, accuracy only indicative)')
+
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.faces:
+        faces = load_face_crops(args.faces)
+    else:
+        faces = [make_frame(160, 140, seed=seed) for seed in range(args.num_faces)]
+    calibration_dir = args.calibration_dir or args.faces or ""
+    if not calibration_dir:
+        args.modes = [mode for mode in args.modes if "static" not in mode]
+        print("No face crops to calibrate on, skipping static quantization (pass --faces or --calibration-dir)")
+
+    consistent = benchmark(
+        args.model,
+        args.modes,
+        faces,
+        calibration_dir,
+        args.batch_sizes,
+        args.repeats,
+        not args.random_weights,
+        args.cache_dir,
+        args.min_cosine
+    )
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
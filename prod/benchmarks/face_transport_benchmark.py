@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the face transports.
+
+This script compares the CPU spent per face between the detector and the
+recognizer with FACE_TRANSPORT=crop (every face crop encoded on the faces
+queue and decoded by the recognizer) and FACE_TRANSPORT=reference (faces
+sent as a frame store key and bbox, each frame decoded once by the
+recognizer), for frames with a varying number of faces. Decoding the frame
+for detection costs the same in both modes and is left out.
+
+The frame store uses FRAME_CODEC, so run it with FRAME_CODEC=raw as well:
+decoding a whole JPEG frame for a few faces costs more than the crops it
+replaces.
+"""
+
+import argparse
+import time
+import numpy as np
+
+from prod.benchmarks.codec_benchmark import RESOLUTIONS, make_frame
+from prod.queues import FaceSerializer
+from prod.utils import encode_frame_data, decode_frame_data, frame_codec, face_codec
+
+
+def make_bboxes(height, width, faces, face_size, seed=0):
+    """Random face bounding boxes inside a frame."""
+    rng = np.random.default_rng(seed)
+    bboxes = []
+    for _ in range(faces):
+        x1 = int(rng.integers(0, width - face_size))
+        y1 = int(rng.integers(0, height - face_size))
+        bboxes.append([x1, y1, x1 + face_size, y1 + face_size])
+    return bboxes
+
+
+def time_crop(frame, bboxes, repeats):
+    """
+    Measure the crop transport: the detector encodes every crop, the
+    recognizer decodes every crop.
+
+    Returns:
+        Tuple of (CPU microseconds per face, queued bytes per face)
+    """
+    serializer = FaceSerializer()
+    size = 0
+    start = time.process_time()
+    for _ in range(repeats):
+        messages = [serializer.dumps((frame[y1:y2, x1:x2], {"stream_id": "stream_0", "bbox": [x1, y1, x2, y2]}))
+                    for x1, y1, x2, y2 in bboxes]
+        for message in messages:
+            serializer.loads(message)
+        size = sum(len(message) for message in messages)
+    elapsed = time.process_time() - start
+    return elapsed / (repeats * len(bboxes)) * 1e6, size / len(bboxes)
+
+
+def time_reference(frame, bboxes, repeats, stored_by_detector):
+    """
+    Measure the reference transport: the recognizer decodes the stored frame
+    once and crops every face from it. When the frame reached the detector
+    through shared memory, the detector also encodes it once for the store.
+
+    Returns:
+        Tuple of (CPU microseconds per face, queued bytes per face)
+    """
+    serializer = FaceSerializer()
+    stored = encode_frame_data(frame, 0.0, "stream_0")
+    size = 0
+    start = time.process_time()
+    for _ in range(repeats):
+        if stored_by_detector:
+            stored = encode_frame_data(frame, 0.0, "stream_0")
+        messages = [serializer.dumps((None, {"stream_id": "stream_0", "bbox": bbox, "frame_key": "frame_store:stream_0:0"}))
+                    for bbox in bboxes]
+        full_frame, _ = decode_frame_data(stored)
+        for message in messages:
+            _, metadata = serializer.loads(message)
+            x1, y1, x2, y2 = metadata["bbox"]
+            full_frame[y1:y2, x1:x2]
+        size = sum(len(message) for message in messages)
+    elapsed = time.process_time() - start
+    return elapsed / (repeats * len(bboxes)) * 1e6, size / len(bboxes)
+
+
+def benchmark(resolutions, face_counts, face_size, repeats, image_path):
+    """
+    Run the benchmark and print one table per resolution.
+    """
+    for resolution in resolutions:
+        height, width = RESOLUTIONS[resolution]
+        frame = make_frame(height, width, image_path)
+
+        print(f"\n{resolution} ({width}x{height}), {face_size}px faces, frame codec {frame_codec.name}, "
+              f"face codec {face_codec.name}: CPU microseconds and queued bytes per face")
+        print(f"{'faces':>6}{'crop us':>10}{'ref us':>10}{'ref+store us':>14}{'crop KB':>10}{'ref KB':>9}")
+
+        for faces in face_counts:
+            bboxes = make_bboxes(height, width, faces, face_size)
+            crop_us, crop_size = time_crop(frame, bboxes, repeats)
+            reference_us, reference_size = time_reference(frame, bboxes, repeats, stored_by_detector=False)
+            stored_us, _ = time_reference(frame, bboxes, repeats, stored_by_detector=True)
+            print(f"{faces:>6}{crop_us:>10.0f}{reference_us:>10.0f}{stored_us:>14.0f}"
+                  f"{crop_size / 1024:>10.1f}{reference_size / 1024:>9.2f}")
+
+    print("\nref: frame stored by the stream processor (FRAME_TRANSPORT=queue), "
+          "ref+store: frame stored by the detector (FRAME_TRANSPORT=shm)")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Benchmark face crop and face reference transports')
+    parser.add_argument('--resolutions', nargs='+', default=["1080p", "4k"], choices=["1080p", "4k"],
+                        help='Frame resolutions to test')
+    parser.add_argument('--faces', type=int, nargs='+', default=[1, 3, 10, 30],
+                        help='Numbers of faces per frame to test')
+    parser.add_argument('--face-size', type=int, default=160, help='Face width and height in pixels')
+    parser.add_argument('--repeats', type=int, default=10, help='Repetitions per measurement')
+    parser.add_argument('--image', default=None, help='Optional image to use instead of a synthetic frame')
+
+    args = parser.parse_args()
+
+    benchmark(
+        args.resolutions,
+        args.faces,
+        args.face_size,
+        args.repeats,
+        args.image
+    )
+
+
+if __name__ == "__main__":
+    main()
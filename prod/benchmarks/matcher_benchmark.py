@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for face matchers.
+
+This script builds a synthetic gallery, then compares the recall and
+per-query latency of the IVF index against exact brute-force search
+for a range of nprobe values.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+
+from prod.matchers import BruteForceMatcher, IVFFlatMatcher
+
+
+def make_gallery(size, dim, clusters, seed=0):
+    """
+    Create a clustered synthetic gallery of normalized features.
+
+    Args:
+        size: Number of identities
+        dim: Feature dimension
+        clusters: Number of underlying clusters
+        seed: Random seed
+
+    Returns:
+        Array of shape (size, dim)
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, size)] + 2.0 * rng.normal(size=(size, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(gallery, count, noise, seed=1):
+    """
+    Create queries as noisy copies of gallery entries.
+
+    Args:
+        gallery: Gallery features
+        count: Number of queries
+        noise: Standard deviation of the added noise
+        seed: Random seed
+
+    Returns:
+        Array of shape (count, dim)
+    """
+    rng = np.random.default_rng(seed)
+    queries = gallery[rng.integers(0, len(gallery), count)]
+    queries = queries + noise * rng.normal(size=queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def time_search(matcher, queries, batch_size):
+    """
+    Search all queries and measure the average latency per query.
+
+    Returns:
+        Tuple of (matched ids, microseconds per query)
+    """
+    matches = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        matches.extend(matcher.search(queries[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+    return [face_id for face_id, _ in matches], elapsed / len(queries) * 1e6
+
+
+def benchmark(size, dim, num_queries, noise, batch_size, nlist, nprobes):
+    """
+    Run the benchmark and print a recall vs. latency table.
+    """
+    print(f"Building synthetic gallery: {size} identities, {dim} dims")
+    gallery = make_gallery(size, dim, clusters=max(1, size // 50))
+    queries = make_queries(gallery, num_queries, noise)
+    ids = [f"person_{i}" for i in range(size)]
+
+    exact = BruteForceMatcher()
+    exact.build(ids, gallery)
+    exact_ids, exact_us = time_search(exact, queries, batch_size)
+
+    start = time.perf_counter()
+    ivf = IVFFlatMatcher(nlist=nlist)
+    ivf.build(ids, gallery)
+    build_s = time.perf_counter() - start
+
+    # Round-trip through disk to exercise save/load
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "index.npz")
+        ivf.save(path)
+        ivf, _ = BruteForceMatcher.load(path)
+
+    print(f"IVF index: {len(ivf.centroids)} lists, built in {build_s:.1f}s")
+    print(f"{'matcher':<16}{'recall@1':>10}{'us/query':>12}{'speedup':>10}")
+    print(f"{'brute':<16}{1.0:>10.3f}{exact_us:>12.1f}{1.0:>10.1f}")
+
+    for nprobe in nprobes:
+        ivf.nprobe = nprobe
+        ivf_ids, ivf_us = time_search(ivf, queries, batch_size)
+        recall = np.mean([a == b for a, b in zip(ivf_ids, exact_ids)])
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{recall:>10.3f}{ivf_us:>12.1f}{exact_us / ivf_us:>10.1f}")
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Benchmark face matchers')
+    parser.add_argument('--size', type=int, default=100000, help='Number of identities in the gallery')
+    parser.add_argument('--dim', type=int, default=512, help='Feature dimension')
+    parser.add_argument('--queries', type=int, default=1000, help='Number of queries')
+    parser.add_argument('--noise', type=float, default=0.04, help='Noise added to the queries')
+    parser.add_argument('--batch-size', type=int, default=16, help='Queries per search call')
+    parser.add_argument('--nlist', type=int, default=0, help='Number of IVF lists, 0 for automatic')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64],
+                        help='nprobe values to evaluate')
+
+    args = parser.parse_args()
+
+    benchmark(
+        args.size,
+        args.dim,
+        args.queries,
+        args.noise,
+        args.batch_size,
+        args.nlist,
+        args.nprobe
+    )
+
+
+if __name__ == "__main__":
+    main()
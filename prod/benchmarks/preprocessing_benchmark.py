@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for the face recognition preprocessing.
+
+This script preprocesses batches of face crops with the torchvision
+transforms the recognizer used to apply one face at a time (BGR to RGB,
+PIL image, Resize, CenterCrop, ToTensor, Normalize) and with
+FacePreprocessor, checks that both give the same input within a
+tolerance, and reports the CPU time per face for several crop sizes.
+
+Resizing differs slightly between PIL and OpenCV, so values are not
+bit-identical; the check fails (exit status 1) when the mean absolute
+difference of a crop size exceeds --tolerance, in normalized units.
+"""
+
+import argparse
+import sys
+import time
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from prod.benchmarks.codec_benchmark import make_frame
+from prod.face_recognition.preprocessing import FacePreprocessor, IMAGENET_MEAN, IMAGENET_STD
+
+
+def make_faces(size, count, image_path):
+    """Crops of a test frame, with a slightly different shape each."""
+    frame = make_frame(2 * size + count, 2 * size + count, image_path)
+    return [frame[i:i + size + i % 7, i:i + size] for i in range(count)]
+
+
+def torchvision_preprocess(transform, face_imgs):
+    """The per-face torchvision pipeline the recognizer used before."""
+    tensors = [transform(Image.fromarray(cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB))) for face_img in face_imgs]
+    return torch.stack(tensors).numpy()
+
+
+def time_it(preprocess, face_imgs, repeats):
+    """CPU microseconds per face of a preprocessing function."""
+    preprocess(face_imgs)  # warm up, and allocate reused buffers
+    start = time.process_time()
+    for _ in range(repeats):
+        preprocess(face_imgs)
+    return (time.process_time() - start) / (repeats * len(face_imgs)) * 1e6
+
+
+def benchmark(face_sizes, batch_size, repeats, tolerance, image_path):
+    """
+    Run the equivalence check and the benchmark.
+
+    Returns:
+        True when every crop size is within the tolerance
+    """
+    transform = transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+    ])
+    preprocessor = FacePreprocessor(resize_size=256, crop_size=224)
+
+    print(f"\nBatches of {batch_size} faces: CPU microseconds per face and difference in normalized units")
+    print(f"{'face px':>8}{'torchvision':>13}{'opencv':>9}{'speedup':>9}{'mean diff':>11}{'max diff':>10}")
+
+    consistent = True
+    for size in face_sizes:
+        face_imgs = make_faces(size, batch_size, image_path)
+        reference = torchvision_preprocess(transform, face_imgs)
+        batch, _ = preprocessor(face_imgs)
+        difference = np.abs(reference - batch)
+        consistent &= bool(difference.mean() <= tolerance)
+
+        torchvision_us = time_it(lambda faces: torchvision_preprocess(transform, faces), face_imgs, repeats)
+        opencv_us = time_it(preprocessor, face_imgs, repeats)
+        print(f"{size:>8}{torchvision_us:>13.0f}{opencv_us:>9.0f}{torchvision_us / opencv_us:>8.1f}x"
+              f"{difference.mean():>11.4f}{difference.max():>10.3f}")
+
+    return consistent
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description='Compare the torchvision and OpenCV face preprocessing')
+    parser.add_argument('--face-sizes', type=int, nargs='+', default=[100, 160, 256, 400],
+                        help='Face crop sizes in pixels to test')
+    parser.add_argument('--batch-size', type=int, default=16, help='Faces per batch')
+    parser.add_argument('--repeats', type=int, default=20, help='Repetitions per measurement')
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='Maximum mean absolute difference per crop size')
+    parser.add_argument('--image', default=None, help='Optional image to crop faces from instead of a synthetic frame')
+
+    args = parser.parse_args()
+
+    consistent = benchmark(
+        args.face_sizes,
+        args.batch_size,
+        args.repeats,
+        args.tolerance,
+        args.image
+    )
+    sys.exit(0 if consistent else 1)
+
+
+if __name__ == "__main__":
+    main()
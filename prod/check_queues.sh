@@ -29,6 +29,7 @@ FACES_QUEUE="faces_queue"
 RECOGNITION_QUEUE="recognition_queue"
 RESULTS_STORE="results_store"
 KNOWN_FACES_STORE="known_faces"
+PIPELINE_STATS="pipeline_stats"
 
 # Check if Redis container is running
 if ! docker ps | grep -q "face_recognition_redis"; then
@@ -36,11 +37,21 @@ if ! docker ps | grep -q "face_recognition_redis"; then
     exit 1
 fi
 
+# Function to get queue length (lists or streams, see QUEUE_BACKEND)
+queue_length() {
+    local queue=$1
+    if [ "$(docker exec face_recognition_redis redis-cli TYPE "$queue")" == "stream" ]; then
+        docker exec face_recognition_redis redis-cli XLEN "$queue"
+    else
+        docker exec face_recognition_redis redis-cli LLEN "$queue"
+    fi
+}
+
 # Function to check queue length
 check_queue_length() {
     local queue=$1
     local length
-    length=$(docker exec face_recognition_redis redis-cli LLEN "$queue")
+    length=$(queue_length "$queue")
     echo -e "${BLUE}$queue${NC}: ${length} items"
 }
 
@@ -59,10 +70,15 @@ check_queue_length $RECOGNITION_QUEUE
 check_hash_size $RESULTS_STORE
 check_hash_size $KNOWN_FACES_STORE
 
+echo -e "\n${YELLOW}Load shedding (queue drops, adaptive sample rates):${NC}"
+docker exec face_recognition_redis redis-cli HGETALL "$PIPELINE_STATS" | paste - - | while read -r key value; do
+    echo -e "${BLUE}$key${NC}: $value"
+done
+
 echo -e "\n${YELLOW}Queue status summary:${NC}"
-total_items=$(($(docker exec face_recognition_redis redis-cli LLEN "$FRAMES_QUEUE") + \
-               $(docker exec face_recognition_redis redis-cli LLEN "$FACES_QUEUE") + \
-               $(docker exec face_recognition_redis redis-cli LLEN "$RECOGNITION_QUEUE")))
+total_items=$(($(queue_length "$FRAMES_QUEUE") + \
+               $(queue_length "$FACES_QUEUE") + \
+               $(queue_length "$RECOGNITION_QUEUE")))
 
 if [ "$total_items" -eq 0 ]; then
     echo -e "${GREEN}All queues are empty. System is processing in real-time.${NC}"
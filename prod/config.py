@@ -1,9 +1,28 @@
 import os
+import json
+import logging
 from pathlib import Path
 
 # Base project directory
 BASE_DIR = Path(__file__).parent.parent
 
+
+def _load_tuned_settings(path: str) -> dict:
+    """Settings measured by `python -m prod.autotune`, empty when there are none."""
+    try:
+        with open(path) as f:
+            return dict(json.load(f)["settings"])
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.getLogger('config').warning(f"Ignoring invalid autotune file {path}: {str(e)}")
+        return {}
+
+
+# Worker counts, threads and batch sizes written by the autotuner; environment variables take precedence
+AUTOTUNE_FILE = os.environ.get("AUTOTUNE_FILE", str(BASE_DIR / "runs/autotune.json"))
+TUNED = _load_tuned_settings(AUTOTUNE_FILE)
+
 # Model path
 MODEL_PATH = os.environ.get("MODEL_PATH", str(BASE_DIR / "runs/detect/train3/weights/best.pt"))
 
@@ -19,14 +38,116 @@ FACES_QUEUE = "faces_queue"
 RECOGNITION_QUEUE = "recognition_queue"
 RESULTS_STORE = "results_store"
 KNOWN_FACES_STORE = "known_faces"
+KNOWN_FACES_VERSION = "known_faces:version"  # Counter bumped on every gallery change
+KNOWN_FACES_CHANNEL = "known_faces:updates"  # Pub/sub channel announcing gallery changes
+PIPELINE_STATS = "pipeline_stats"  # Hash of queue drop counters and adaptive sample rates
+FRAMES_STREAMS = "frames_streams"  # Set of stream ids that have their own frames queue
+FRAME_STORE_PREFIX = "frame_store"  # Prefix of the keys holding full-resolution frames
+
+# Queue transport
+QUEUE_BACKEND = os.environ.get("QUEUE_BACKEND", "list")  # "list" (RPUSH/BLPOP), "stream" (consumer groups) or "inprocess"
+STREAM_MAXLEN = int(os.environ.get("STREAM_MAXLEN", 10000))  # Approximate cap on entries kept per stream
+STREAM_CLAIM_IDLE_MS = int(os.environ.get("STREAM_CLAIM_IDLE_MS", 30000))  # Reclaim entries pending longer than this
+STREAM_CLAIM_INTERVAL = float(os.environ.get("STREAM_CLAIM_INTERVAL", 10))  # Seconds between checks for stale entries
+INPROCESS_QUEUE_SIZE = int(os.environ.get("INPROCESS_QUEUE_SIZE", 64))  # Capacity of each in-process queue
+INPROCESS_PUT_TIMEOUT = float(os.environ.get("INPROCESS_PUT_TIMEOUT", 10))  # Seconds a producer waits on a full in-process queue before dropping the item, 0 to wait forever
+FRAMES_QUEUE_MAXLEN = int(os.environ.get("FRAMES_QUEUE_MAXLEN", 1000))  # Oldest frames are dropped beyond this, 0 for no limit
+FACES_QUEUE_MAXLEN = int(os.environ.get("FACES_QUEUE_MAXLEN", 5000))  # Oldest faces are dropped beyond this, 0 for no limit
+PER_STREAM_QUEUES = os.environ.get("PER_STREAM_QUEUES", "false").lower() in ("1", "true", "yes")  # One frames queue per stream, scheduled fairly
+STREAM_PRIORITIES = os.environ.get("STREAM_PRIORITIES", "")  # Detector share per stream, e.g. "stream_0=3,stream_2=2" (default 1)
+STREAM_DISCOVERY_INTERVAL = float(os.environ.get("STREAM_DISCOVERY_INTERVAL", 5))  # Seconds between checks for new per-stream queues
+FRAME_TRANSPORT = os.environ.get("FRAME_TRANSPORT", "queue")  # "queue" (frames encoded on the queue) or "shm" (same-host shared memory)
+SHM_RING_SLOTS = int(os.environ.get("SHM_RING_SLOTS", 32))  # Frames kept per stream before a slot is overwritten
+SHM_PREFIX = os.environ.get("SHM_PREFIX", "frames")  # Prefix of the shared memory segment names
+FACE_TRANSPORT = os.environ.get("FACE_TRANSPORT", "crop")  # "crop" (face crops encoded on the faces queue) or "reference" (frame stored once, faces carry its key and bbox)
+
+# Consumer groups, one per stage reading from a queue
+DETECTION_GROUP = "face_detection"
+RECOGNITION_GROUP = "face_recognition"
+AGGREGATION_GROUP = "result_aggregator"
 
 # Frame processing
 FRAME_SAMPLE_RATE = int(os.environ.get("FRAME_SAMPLE_RATE", 5))  # Frames per second to process
+CAPTURE_MODE = os.environ.get("CAPTURE_MODE", "thread")  # "thread" (one thread per stream) or "process" (streams spread over worker processes)
+CAPTURE_PROCESSES = int(os.environ.get("CAPTURE_PROCESSES", 0))  # Capture worker processes, 0 for one per CPU (at most one per stream)
+
+# Backpressure: producers lower their sample rate while the frames queue is backed up
+BACKPRESSURE_INTERVAL = float(os.environ.get("BACKPRESSURE_INTERVAL", 1))  # Seconds between frames queue depth checks
+BACKPRESSURE_HIGH_DEPTH = int(os.environ.get("BACKPRESSURE_HIGH_DEPTH", 200))  # Depth from which the sample rate is halved
+BACKPRESSURE_LOW_DEPTH = int(os.environ.get("BACKPRESSURE_LOW_DEPTH", 50))  # Depth below which the sample rate recovers
+MIN_SAMPLE_RATE = float(os.environ.get("MIN_SAMPLE_RATE", 0.5))  # Lowest frames per second sampled under backpressure
+
+DETECTION_FRAME_WIDTH = int(os.environ.get("DETECTION_FRAME_WIDTH", 0))  # Wider frames are downscaled for detection at the source, 0 to send full frames
+FRAME_STORE_TTL = float(os.environ.get("FRAME_STORE_TTL", 30))  # Seconds full-resolution frames are kept for face cropping
+
+# Motion gating: only frames that differ from the scene background are sent to detection
+MOTION_GATING = os.environ.get("MOTION_GATING", "false").lower() in ("1", "true", "yes")
+MOTION_THRESHOLD = float(os.environ.get("MOTION_THRESHOLD", 0.01))  # Fraction of changed pixels from which a frame is sent
+MOTION_PIXEL_THRESHOLD = int(os.environ.get("MOTION_PIXEL_THRESHOLD", 25))  # Gray level difference for a pixel to count as changed
+MOTION_BACKGROUND_ALPHA = float(os.environ.get("MOTION_BACKGROUND_ALPHA", 0.05))  # Running background update rate
+MOTION_KEYFRAME_INTERVAL = float(os.environ.get("MOTION_KEYFRAME_INTERVAL", 5))  # Max seconds between frames sent, motion or not
+MOTION_DOWNSCALE_WIDTH = int(os.environ.get("MOTION_DOWNSCALE_WIDTH", 160))  # Width frames are compared at
+FRAME_ENVELOPE_VERSION = int(os.environ.get("FRAME_ENVELOPE_VERSION", 2))  # 1 = legacy JSON framing, 2 = binary envelope
+
+# Image codecs used on the queues: "jpeg", "png", "webp" or "raw"
+FRAME_CODEC = os.environ.get("FRAME_CODEC", "jpeg")
+FACE_CODEC = os.environ.get("FACE_CODEC", "jpeg")
+JPEG_QUALITY = int(os.environ.get("JPEG_QUALITY", 95))  # 0-100, OpenCV's default is 95
+PNG_COMPRESSION = int(os.environ.get("PNG_COMPRESSION", 1))  # 0-9, higher is smaller but slower
+WEBP_QUALITY = int(os.environ.get("WEBP_QUALITY", 90))  # 1-100
 
 # Face detection settings
 FACE_DETECTION_CONFIDENCE = float(os.environ.get("FACE_DETECTION_CONFIDENCE", 0.4))
 FACE_DETECTION_IOU = float(os.environ.get("FACE_DETECTION_IOU", 0.5))
 MIN_FACE_WIDTH = int(os.environ.get("MIN_FACE_WIDTH", 100))  # Minimum width for a detected face
+DETECTION_WORKERS = int(os.environ.get("DETECTION_WORKERS", TUNED.get("DETECTION_WORKERS", 2)))  # Worker threads of the face detection service
+DETECTION_TORCH_THREADS = int(os.environ.get("DETECTION_TORCH_THREADS", TUNED.get("DETECTION_TORCH_THREADS", 0)))  # Torch threads of the ultralytics backend, 0 for the default
+DETECTION_BATCH_SIZE = int(os.environ.get("DETECTION_BATCH_SIZE", TUNED.get("DETECTION_BATCH_SIZE", 8)))  # Max frames per YOLO predict call
+DETECTION_MAX_WAIT_MS = float(os.environ.get("DETECTION_MAX_WAIT_MS", 20))  # Max time to wait for a batch to fill
+DETECTION_MAX_AGE = float(os.environ.get("DETECTION_MAX_AGE", 10))  # Frames captured longer ago (seconds) are skipped, 0 to disable
+DETECTOR_BACKEND = os.environ.get("DETECTOR_BACKEND", "ultralytics")  # "ultralytics" (PyTorch) or "onnx" (ONNX Runtime)
+DETECTION_IMAGE_SIZE = int(os.environ.get("DETECTION_IMAGE_SIZE", 640))  # Model input size of the ONNX export
+ONNX_PROVIDERS = os.environ.get("ONNX_PROVIDERS", "CPUExecutionProvider")  # Comma separated, e.g. OpenVINOExecutionProvider,CPUExecutionProvider
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", TUNED.get("ONNX_THREADS", 0)))  # Intra-op threads per ONNX Runtime session, 0 for the default
+
+# Face tracking: only new tracks and periodic re-verifications are sent to recognition
+FACE_TRACKING = os.environ.get("FACE_TRACKING", "false").lower() in ("1", "true", "yes")
+TRACK_IOU_THRESHOLD = float(os.environ.get("TRACK_IOU_THRESHOLD", 0.3))  # Minimum IoU for a detection to continue a track
+TRACK_MAX_AGE = float(os.environ.get("TRACK_MAX_AGE", 1))  # Seconds a track survives without detections
+TRACK_REVERIFY_INTERVAL = float(os.environ.get("TRACK_REVERIFY_INTERVAL", 2))  # Seconds between recognitions of the same track
+TRACK_PENDING_TIMEOUT = float(os.environ.get("TRACK_PENDING_TIMEOUT", 5))  # Seconds the aggregator waits for a track's identity
+TRACK_IDENTITY_TTL = float(os.environ.get("TRACK_IDENTITY_TTL", 60))  # Seconds the aggregator remembers the identity of an idle track
+
+# Face quality: with tracking, only each track's best faces of a short window are recognized
+QUALITY_SELECTION = os.environ.get("QUALITY_SELECTION", "false").lower() in ("1", "true", "yes")
+QUALITY_WINDOW = float(os.environ.get("QUALITY_WINDOW", 1))  # Seconds of a track's faces compared before the best are recognized
+QUALITY_BEST_N = int(os.environ.get("QUALITY_BEST_N", 1))  # Faces recognized per window
+QUALITY_SHARPNESS_SCALE = float(os.environ.get("QUALITY_SHARPNESS_SCALE", 100))  # Laplacian variance scoring 0.5 for sharpness
+QUALITY_FRONTAL_ASPECT = float(os.environ.get("QUALITY_FRONTAL_ASPECT", 0.8))  # Width/height of a frontal face box
+
+# Face recognition settings
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "resnet50")  # "resnet50" (2048-d), "resnet18" (512-d) or "facenet" (512-d, needs facenet-pytorch)
+EMBEDDING_WEIGHTS = os.environ.get("EMBEDDING_WEIGHTS", "")  # Optional state dict replacing the pretrained weights of EMBEDDING_MODEL
+EMBEDDING_QUANTIZATION = os.environ.get("EMBEDDING_QUANTIZATION", "none")  # "none", "dynamic" (Linear layers) or "static" (INT8 convolutions, CPU only)
+EMBEDDING_CALIBRATION_DIR = os.environ.get("EMBEDDING_CALIBRATION_DIR", "")  # Folder of face crops calibrating static quantization
+EMBEDDING_CHANNELS_LAST = os.environ.get("EMBEDDING_CHANNELS_LAST", "false").lower() in ("1", "true", "yes")
+EMBEDDING_COMPILE = os.environ.get("EMBEDDING_COMPILE", "none")  # "none", "torchscript" or "inductor" (torch.compile)
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", str(BASE_DIR / "runs/embedding_cache"))  # Compiled models, empty to disable
+RECOGNITION_WORKERS = int(os.environ.get("RECOGNITION_WORKERS", TUNED.get("RECOGNITION_WORKERS", 2)))  # Worker threads or processes of the face recognition service
+RECOGNITION_BATCH_SIZE = int(os.environ.get("RECOGNITION_BATCH_SIZE", TUNED.get("RECOGNITION_BATCH_SIZE", 16)))  # Max faces per embedding forward pass
+RECOGNITION_MAX_WAIT_MS = float(os.environ.get("RECOGNITION_MAX_WAIT_MS", 10))  # Max time to wait for a batch to fill
+RECOGNITION_WORKER_MODE = os.environ.get("RECOGNITION_WORKER_MODE", TUNED.get("RECOGNITION_WORKER_MODE", "thread"))  # "thread" or "process" (forked workers sharing the model copy-on-write)
+RECOGNITION_TORCH_THREADS = int(os.environ.get("RECOGNITION_TORCH_THREADS", TUNED.get("RECOGNITION_TORCH_THREADS", 0)))  # Torch threads per worker process, 0 for CPUs / workers
+RECOGNITION_MAX_AGE = float(os.environ.get("RECOGNITION_MAX_AGE", 20))  # Faces captured longer ago (seconds) are skipped, 0 to disable
+GALLERY_REFRESH_INTERVAL = float(os.environ.get("GALLERY_REFRESH_INTERVAL", 10))  # Seconds between gallery version checks
+FACE_MATCHER = os.environ.get("FACE_MATCHER", "auto")  # "brute", "ivf" or "auto"
+ANN_MIN_GALLERY_SIZE = int(os.environ.get("ANN_MIN_GALLERY_SIZE", 50000))  # Gallery size from which "auto" uses the IVF index
+IVF_NLIST = int(os.environ.get("IVF_NLIST", 0))  # Number of IVF clusters, 0 to derive from the gallery size
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 16))  # Number of IVF clusters scored per query
+MATCHER_INDEX_PATH = os.environ.get("MATCHER_INDEX_PATH", "")  # Where to cache the built index, empty to disable
+
+# Monitoring
+STATS_LOG_INTERVAL = float(os.environ.get("STATS_LOG_INTERVAL", 30))  # Seconds between throughput reports
 
 # Database settings
 POSTGRES_HOST = os.environ.get("POSTGRES_HOST", "postgres")
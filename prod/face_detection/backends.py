@@ -0,0 +1,279 @@
+import os
+import ast
+import logging
+import cv2
+import numpy as np
+from typing import List, Sequence, Tuple
+
+from prod.config import (
+    DETECTION_IMAGE_SIZE,
+    ONNX_PROVIDERS,
+    ONNX_THREADS
+)
+from prod.utils import file_digest
+
+logger = logging.getLogger('detector_backends')
+
+# Same as ultralytics: gray padding, at most 300 detections per frame, and
+# boxes of different classes shifted apart so one NMS pass keeps classes apart
+LETTERBOX_COLOR = 114
+MAX_DETECTIONS = 300
+CLASS_OFFSET = 7680
+
+
+class UltralyticsBackend:
+    """Runs the YOLO weights with ultralytics on PyTorch."""
+
+    name = "ultralytics"
+
+    def __init__(self, model_path: str, image_size: int = DETECTION_IMAGE_SIZE):
+        """
+        Load the model.
+
+        Args:
+            model_path: Path to the YOLO .pt weights
+            image_size: Model input size (ultralytics picks its own)
+        """
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)
+        self.names = self.model.model.names
+
+    def predict(self, frames: List[np.ndarray], conf: float, iou: float) -> List[np.ndarray]:
+        """
+        Detect objects in a batch of frames.
+
+        Args:
+            frames: BGR frames, of any sizes
+            conf: Minimum confidence
+            iou: IoU threshold of the non-maximum suppression
+
+        Returns:
+            One array of shape (n, 5) per frame: x1, y1, x2, y2, confidence
+            in frame coordinates
+        """
+        results = self.model.predict(frames, conf=conf, iou=iou, verbose=False)
+        return [
+            np.column_stack((result.boxes.xyxy.cpu().numpy(), result.boxes.conf.cpu().numpy()))
+            for result in results
+        ]
+
+
+class OnnxBackend:
+    """
+    Runs the YOLO weights exported to ONNX on ONNX Runtime.
+
+    The export happens once and is cached next to the weights, keyed by
+    their hash and the input size. Preprocessing (letterbox, BGR to RGB,
+    scaling) and postprocessing (confidence filter, NMS, undoing the
+    letterbox) are done here in NumPy, so ultralytics is only needed for
+    the export. Other execution providers, e.g. OpenVINO, can be selected
+    with ONNX_PROVIDERS when their onnxruntime package is installed.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, image_size: int = DETECTION_IMAGE_SIZE,
+                 providers: Sequence[str] = tuple(ONNX_PROVIDERS.split(",")),
+                 threads: int = ONNX_THREADS):
+        """
+        Load (exporting first if needed) the model.
+
+        Args:
+            model_path: Path to the YOLO .pt weights
+            image_size: Model input size
+            providers: ONNX Runtime execution providers, in order of preference
+            threads: Intra-op threads, 0 for the ONNX Runtime default
+        """
+        import onnxruntime as ort
+
+        onnx_path = export_onnx(model_path, image_size)
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=[p.strip() for p in providers])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Fixed-shape exports take one frame at a time at their own size
+        self.batched = not isinstance(model_input.shape[0], int)
+        self.image_size = model_input.shape[2] if isinstance(model_input.shape[2], int) else image_size
+
+        names = self.session.get_modelmeta().custom_metadata_map.get("names", "{}")
+        self.names = ast.literal_eval(names)
+        logger.info(f"Loaded {onnx_path} with providers {self.session.get_providers()}")
+
+    def predict(self, frames: List[np.ndarray], conf: float, iou: float) -> List[np.ndarray]:
+        """
+        Detect objects in a batch of frames.
+
+        Args:
+            frames: BGR frames, of any sizes
+            conf: Minimum confidence
+            iou: IoU threshold of the non-maximum suppression
+
+        Returns:
+            One array of shape (n, 5) per frame: x1, y1, x2, y2, confidence
+            in frame coordinates
+        """
+        images, gains, pads = letterbox_batch(frames, self.image_size)
+        if self.batched:
+            outputs = self.session.run(None, {self.input_name: images})[0]
+        else:
+            outputs = np.concatenate([self.session.run(None, {self.input_name: image[None]})[0]
+                                      for image in images])
+
+        shapes = [frame.shape[:2] for frame in frames]
+        return postprocess(outputs, conf, iou, gains, pads, shapes)
+
+
+DETECTOR_BACKENDS = {
+    UltralyticsBackend.name: UltralyticsBackend,
+    OnnxBackend.name: OnnxBackend,
+}
+
+
+def get_detector_backend(name: str, model_path: str, image_size: int = DETECTION_IMAGE_SIZE):
+    """
+    Load a detector backend by name.
+
+    Args:
+        name: "ultralytics" or "onnx"
+        model_path: Path to the YOLO .pt weights
+        image_size: Model input size
+
+    Returns:
+        Backend with a predict(frames, conf, iou) method and class names
+    """
+    if name not in DETECTOR_BACKENDS:
+        raise ValueError(f"Unknown detector backend '{name}', expected one of: {', '.join(DETECTOR_BACKENDS)}")
+    return DETECTOR_BACKENDS[name](model_path, image_size=image_size)
+
+
+def export_onnx(model_path: str, image_size: int = DETECTION_IMAGE_SIZE) -> str:
+    """
+    Export YOLO weights to ONNX, unless an export of the same weights exists.
+
+    The export is named after the weights, their hash and the input size,
+    e.g. best.3f2a9c1d0b7e4a56.640.onnx next to best.pt, so retrained
+    weights are exported again while restarts reuse the file.
+
+    Args:
+        model_path: Path to the YOLO .pt weights
+        image_size: Model input size
+
+    Returns:
+        Path of the ONNX model
+    """
+    stem = os.path.splitext(model_path)[0]
+    onnx_path = f"{stem}.{file_digest(model_path)[:16]}.{image_size}.onnx"
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    from ultralytics import YOLO
+
+    logger.info(f"Exporting {model_path} to ONNX, this happens once per weights file")
+    exported = YOLO(model_path).export(format="onnx", imgsz=image_size, dynamic=True)
+    os.replace(exported, onnx_path)
+    return onnx_path
+
+
+def letterbox_batch(frames: List[np.ndarray], size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Letterbox frames into one model input batch.
+
+    Each frame is resized to fit size x size keeping its aspect ratio and
+    centered on gray padding; the channel swap, layout change and scaling
+    are then done for the whole batch at once.
+
+    Args:
+        frames: BGR frames, of any sizes
+        size: Model input size
+
+    Returns:
+        Tuple of (float32 RGB batch of shape (n, 3, size, size) in [0, 1],
+        scale of each frame, (left, top) padding of each frame)
+    """
+    canvas = np.full((len(frames), size, size, 3), LETTERBOX_COLOR, dtype=np.uint8)
+    gains = np.empty(len(frames), dtype=np.float32)
+    pads = np.empty((len(frames), 2), dtype=np.float32)
+
+    for i, frame in enumerate(frames):
+        height, width = frame.shape[:2]
+        gain = min(size / height, size / width)
+        new_width, new_height = round(width * gain), round(height * gain)
+        left, top = (size - new_width) // 2, (size - new_height) // 2
+        if (new_width, new_height) != (width, height):
+            frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        canvas[i, top:top + new_height, left:left + new_width] = frame
+        gains[i] = gain
+        pads[i] = (left, top)
+
+    images = np.empty((len(frames), 3, size, size), dtype=np.float32)
+    np.multiply(canvas[..., ::-1].transpose(0, 3, 1, 2), np.float32(1 / 255), out=images)
+    return images, gains, pads
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    """
+    Greedy non-maximum suppression.
+
+    Args:
+        boxes: Array of shape (n, 4) of (x1, y1, x2, y2)
+        scores: Array of shape (n,)
+        iou_threshold: Boxes overlapping a kept box by more are dropped
+
+    Returns:
+        Indices of the kept boxes, highest score first
+    """
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        x1 = np.maximum(boxes[best, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[best, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[best, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[best, 3], boxes[rest, 3])
+        intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        overlap = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+        order = rest[overlap <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def postprocess(outputs: np.ndarray, conf: float, iou: float, gains: np.ndarray,
+                pads: np.ndarray, shapes: List[Tuple[int, int]]) -> List[np.ndarray]:
+    """
+    Turn raw YOLO outputs into detections in frame coordinates.
+
+    Args:
+        outputs: Model output of shape (n, 4 + classes, anchors), boxes as
+            center x, center y, width, height in input coordinates
+        conf: Minimum confidence
+        iou: IoU threshold of the non-maximum suppression
+        gains: Scale of each frame from letterbox_batch
+        pads: Padding of each frame from letterbox_batch
+        shapes: (height, width) of each frame
+
+    Returns:
+        One array of shape (n, 5) per frame: x1, y1, x2, y2, confidence
+    """
+    detections = []
+    for prediction, gain, (left, top), (height, width) in zip(outputs.transpose(0, 2, 1), gains, pads, shapes):
+        class_scores = prediction[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        candidates = scores > conf
+        prediction, classes, scores = prediction[candidates], classes[candidates], scores[candidates]
+
+        boxes = np.empty((len(prediction), 4), dtype=np.float32)
+        boxes[:, :2] = prediction[:, :2] - prediction[:, 2:4] / 2
+        boxes[:, 2:] = prediction[:, :2] + prediction[:, 2:4] / 2
+
+        keep = nms(boxes + classes[:, None] * CLASS_OFFSET, scores, iou)[:MAX_DETECTIONS]
+        boxes = (boxes[keep] - (left, top, left, top)) / gain
+        np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+        detections.append(np.column_stack((boxes, scores[keep])))
+    return detections
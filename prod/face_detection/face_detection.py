@@ -2,10 +2,9 @@ import time
 import logging
 import signal
 import threading
-from ultralytics import YOLO
 import numpy as np
 import cv2
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 
 from prod.config import (
     MODEL_PATH,
@@ -15,15 +14,31 @@ from prod.config import (
     REDIS_PASSWORD,
     FRAMES_QUEUE,
     FACES_QUEUE,
+    RECOGNITION_QUEUE,
     FACE_DETECTION_CONFIDENCE,
     FACE_DETECTION_IOU,
-    MIN_FACE_WIDTH
-)
-from prod.utils import (
-    get_redis_connection,
-    decode_frame_data,
-    encode_face_data
+    MIN_FACE_WIDTH,
+    DETECTION_WORKERS,
+    DETECTION_TORCH_THREADS,
+    DETECTION_BATCH_SIZE,
+    DETECTION_MAX_WAIT_MS,
+    DETECTION_MAX_AGE,
+    DETECTION_GROUP,
+    DETECTOR_BACKEND,
+    FACE_TRACKING,
+    QUALITY_SELECTION,
+    QUEUE_BACKEND,
+    FACE_TRANSPORT,
+    PIPELINE_STATS,
+    STATS_LOG_INTERVAL
 )
+from prod.face_detection.backends import get_detector_backend
+from prod.frame_store import FrameStore, frame_key
+from prod.quality import BestFaceSelector, face_quality
+from prod.queues import get_queue, consumer_name
+from prod.shm_ring import ShmFrameReader
+from prod.tracking import FaceTracker
+from prod.utils import get_redis_connection
 
 # Configure logging
 logging.basicConfig(
@@ -35,26 +50,86 @@ logger = logging.getLogger('face_detection')
 class FaceDetector:
     """Detects faces in frames retrieved from the Redis queue."""
     
-    def __init__(self, model_path: str = MODEL_PATH, workers: int = 1):
+    def __init__(self, model_path: str = MODEL_PATH, workers: int = DETECTION_WORKERS,
+                 batch_size: int = DETECTION_BATCH_SIZE,
+                 max_wait_ms: float = DETECTION_MAX_WAIT_MS,
+                 max_age: float = DETECTION_MAX_AGE,
+                 face_transport: str = FACE_TRANSPORT,
+                 face_tracking: bool = FACE_TRACKING,
+                 quality_selection: bool = QUALITY_SELECTION,
+                 detector_backend: str = DETECTOR_BACKEND,
+                 torch_threads: int = DETECTION_TORCH_THREADS,
+                 queue_backend: str = QUEUE_BACKEND):
         """
         Initialize the face detector.
         
         Args:
             model_path: Path to the YOLO model weights
             workers: Number of worker threads to process frames
+            batch_size: Maximum number of frames per YOLO predict call
+            max_wait_ms: Maximum time to wait for a batch to fill, in milliseconds
+            max_age: Skip frames captured more than this many seconds ago, 0 to disable
+            face_transport: "crop" to queue face crops, "reference" to queue
+                the frame store key and bbox of each face
+            face_tracking: Whether to track faces and only send new tracks
+                and periodic re-verifications to recognition
+            quality_selection: Whether to send the best faces of a short window
+                of each track to recognition instead of the first one
+            detector_backend: "ultralytics" (PyTorch) or "onnx" (ONNX Runtime)
+            torch_threads: Torch intra-op threads of the ultralytics backend,
+                0 for the default (ONNX Runtime uses ONNX_THREADS)
+            queue_backend: Queue backend used between the pipeline stages
         """
         self.model_path = model_path
+        self.detector_backend = detector_backend
+        self.torch_threads = torch_threads
         self.workers = workers
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_age = max_age
+        # In-process queues already pass frames by reference
+        self.face_transport = "crop" if queue_backend == "inprocess" else face_transport
+        self.queue_backend = queue_backend
         self.redis_client = get_redis_connection()
+        self.faces_queue = get_queue(FACES_QUEUE, redis_client=self.redis_client, backend=queue_backend)
+        # Faces of known tracks skip recognition and go straight to the aggregator
+        self.recognition_queue = get_queue(RECOGNITION_QUEUE, redis_client=self.redis_client, backend=queue_backend)
+        self.shm_reader = ShmFrameReader()
+        self.frame_store = FrameStore(self.redis_client, backend=queue_backend)
         self.stop_event = threading.Event()
         self.model = None
         self.worker_threads = []
         
+        # One tracker per stream, shared by the workers
+        self.face_tracking = face_tracking
+        self.trackers: Dict[str, FaceTracker] = {}
+        self.trackers_lock = threading.Lock()
+        if quality_selection and not face_tracking:
+            logger.warning("Quality selection picks the best faces of each track, enable face tracking to use it")
+        # Guarded by trackers_lock too
+        self.best_faces = BestFaceSelector() if quality_selection and face_tracking else None
+        
+        # Throughput counters shared by all workers
+        self.stats_lock = threading.Lock()
+        self.frames_processed = 0
+        self.batches_processed = 0
+        self.frames_expired = 0
+        self.frames_overwritten = 0
+        self.full_frames_missing = 0
+        self.faces_recognized = 0
+        self.faces_tracked = 0
+        
+        # Time frames spent between capture and detection: stream id -> [count, total, max]
+        self.stream_waits: Dict[str, List[float]] = {}
+        
         # Register signal handlers
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
         
-        logger.info(f"Face detector initialized with model: {model_path}, workers: {workers}")
+        logger.info(f"Face detector initialized with model: {model_path}, backend: {detector_backend}, workers: {workers}, "
+                    f"batch size: {self.batch_size}, max wait: {max_wait_ms}ms, "
+                    f"face transport: {self.face_transport}, face tracking: {face_tracking}, "
+                    f"quality selection: {self.best_faces is not None}")
     
     def _signal_handler(self, sig, frame):
         """Handle termination signals gracefully."""
@@ -65,8 +140,8 @@ class FaceDetector:
         """Load the YOLO model for face detection."""
         try:
             logger.info(f"Loading model from {self.model_path}")
-            self.model = YOLO(self.model_path)
-            logger.info(f"Model loaded successfully, class names: {self.model.model.names}")
+            self.model = get_detector_backend(self.detector_backend, self.model_path)
+            logger.info(f"Model loaded successfully, class names: {self.model.names}")
             return True
         except Exception as e:
             logger.error(f"Failed to load model: {str(e)}")
@@ -74,6 +149,10 @@ class FaceDetector:
     
     def start(self):
         """Start the face detection workers."""
+        if self.torch_threads and self.detector_backend == "ultralytics":
+            import torch
+            torch.set_num_threads(self.torch_threads)
+        
         if not self._load_model():
             logger.error("Failed to load model, exiting")
             return
@@ -89,10 +168,14 @@ class FaceDetector:
             thread.start()
             logger.info(f"Started worker thread {i}")
         
-        # Keep the main thread alive
+        # Keep the main thread alive and report throughput periodically
+        last_report = time.monotonic()
         try:
             while not self.stop_event.is_set():
                 time.sleep(1)
+                if time.monotonic() - last_report >= STATS_LOG_INTERVAL:
+                    self._log_stats(time.monotonic() - last_report)
+                    last_report = time.monotonic()
         except KeyboardInterrupt:
             logger.info("Keyboard interrupt received, shutting down...")
         finally:
@@ -107,30 +190,81 @@ class FaceDetector:
         """
         logger.info(f"Worker {worker_id} starting to process frames")
         
+        frames_queue = get_queue(
+            FRAMES_QUEUE,
+            group=DETECTION_GROUP,
+            consumer=consumer_name(worker_id),
+            redis_client=self.redis_client,
+            backend=self.queue_backend
+        )
+        
         while not self.stop_event.is_set():
             try:
-                # BLPOP waits for items in the queue with a timeout
-                queue_item = self.redis_client.blpop(FRAMES_QUEUE, timeout=1)
+                # Wait for a frame, then drain up to a full batch
+                batch = frames_queue.get_batch(self.batch_size, self.max_wait, max_age=self.max_age)
                 
-                if not queue_item:
-                    continue
+                # Stale frames were discarded by the queue before being decoded;
+                # counted per thread, as in-process queues are shared by the workers
+                expired = frames_queue.take_expired()
+                if expired:
+                    with self.stats_lock:
+                        self.frames_expired += expired
                 
-                # Extract the frame data (queue name and data)
-                _, frame_data = queue_item
+                # Send the best faces of the windows that have closed
+                self._flush_best_faces(time.time())
                 
-                # Decode the frame data
-                frame, metadata = decode_frame_data(frame_data)
+                if not batch:
+                    continue
+                
+                message_ids = [message_id for message_id, _ in batch]
+                frames, frames_metadata = self._resolve_frames([item for _, item in batch])
                 
-                # Detect faces in the frame
-                faces = self._detect_faces(frame)
+                # Detect faces in all frames with a single predict call
+                crop = self.face_transport == "crop"
+                batch_faces = self._detect_faces_batch(frames, frames_metadata, crop=crop) if frames else []
                 
-                # Process each detected face
-                for face_img, bbox in faces:
-                    # Encode and queue the face data
-                    encoded_face = encode_face_data(face_img, bbox, metadata)
-                    self.redis_client.rpush(FACES_QUEUE, encoded_face)
+                # Fan the detections back out with their own frame's metadata
+                detected_at = time.time()
+                self._update_waits(frames_metadata, detected_at)
+                face_items = []
+                tracked_results = []
+                for faces, frame, metadata in zip(batch_faces, frames, frames_metadata):
+                    if not faces:
+                        continue
+                    decisions = self._track_faces(metadata, [bbox for _, bbox, _ in faces])
                     
-                    logger.debug(f"Worker {worker_id} queued face from {metadata['stream_id']}")
+                    for (face_img, bbox, quality), (track_id, recognize) in zip(faces, decisions):
+                        # The bbox is already in full-resolution coordinates
+                        face_metadata = {key: value for key, value in metadata.items()
+                                         if key not in ("scale_x", "scale_y")}
+                        face_metadata["bbox"] = bbox
+                        face_metadata["detected_at"] = detected_at
+                        face_metadata["quality"] = round(quality, 4)
+                        if track_id is not None:
+                            face_metadata["track_id"] = track_id
+                        
+                        if self.best_faces is not None:
+                            face = self._select_face(frame, metadata, (face_img, face_metadata), recognize)
+                            if face is not None:
+                                tracked_results.append(face[1])
+                        elif recognize:
+                            face_items.append(self._keep_face(frame, metadata, (face_img, face_metadata)))
+                            logger.debug(f"Worker {worker_id} queued face from {metadata['stream_id']}")
+                        else:
+                            # The aggregator fills in the identity of the track
+                            tracked_results.append(face_metadata)
+                
+                # Queue all faces at once, then acknowledge the frames
+                self.faces_queue.put_many(face_items)
+                if tracked_results:
+                    self.recognition_queue.put_many(tracked_results)
+                frames_queue.ack(message_ids)
+                
+                with self.stats_lock:
+                    self.frames_processed += len(frames)
+                    self.batches_processed += 1
+                    self.faces_recognized += len(face_items)
+                    self.faces_tracked += len(tracked_results)
                 
             except Exception as e:
                 logger.error(f"Worker {worker_id} error: {str(e)}")
@@ -138,46 +272,337 @@ class FaceDetector:
         
         logger.info(f"Worker {worker_id} stopping")
     
-    def _detect_faces(self, frame: np.ndarray) -> List[Tuple[np.ndarray, List[int]]]:
+    def _resolve_frames(self, items: List[Tuple[Any, Dict[str, Any]]]) -> Tuple[List[np.ndarray], List[Dict[str, Any]]]:
+        """
+        Split queue items into frames and metadata, reading frames sent
+        through shared memory or the frame store and dropping those
+        overwritten or expired since.
+        
+        Args:
+            items: (frame, metadata) items, frame None for descriptors
+            
+        Returns:
+            Tuple of (frames, metadata) for the frames still available
+        """
+        frames = []
+        frames_metadata = []
+        overwritten = 0
+        missing = 0
+        
+        # Frames in the frame store are read with a single round trip
+        keys = [metadata["frame_key"] for frame, metadata in items
+                if frame is None and "shm_name" not in metadata]
+        stored = self.frame_store.get_many(keys) if keys else {}
+        
+        for frame, metadata in items:
+            if frame is None and "shm_name" not in metadata:
+                frame = stored[metadata["frame_key"]]
+                if frame is None:
+                    missing += 1
+                    continue
+            elif frame is None:
+                frame = self.shm_reader.read(metadata)
+                if frame is None:
+                    overwritten += 1
+                    continue
+                
+                # The descriptor is of no use past this stage
+                metadata = {key: value for key, value in metadata.items() if not key.startswith("shm_")}
+            
+            frames.append(frame)
+            frames_metadata.append(metadata)
+        
+        if overwritten:
+            logger.debug(f"Skipped {overwritten} frames overwritten in shared memory")
+            with self.stats_lock:
+                self.frames_overwritten += overwritten
+        if missing:
+            with self.stats_lock:
+                self.full_frames_missing += missing
+        
+        return frames, frames_metadata
+    
+    def _track_faces(self, metadata: Dict[str, Any], bboxes: List[List[int]]) -> List[Tuple[Optional[int], bool]]:
+        """
+        Assign the faces of a frame to their stream's tracks.
+        
+        Args:
+            metadata: Frame metadata
+            bboxes: Face bounding boxes of the frame
+            
+        Returns:
+            One (track_id, recognize) tuple per face; without tracking every
+            face is recognized and has no track
+        """
+        if not self.face_tracking:
+            return [(None, True)] * len(bboxes)
+        
+        with self.trackers_lock:
+            tracker = self.trackers.setdefault(metadata["stream_id"], FaceTracker())
+            return tracker.update(bboxes, metadata["timestamp"])
+    
+    def _keep_face(self, frame: np.ndarray, metadata: Dict[str, Any],
+                   face: Tuple[Optional[np.ndarray], Dict[str, Any]]) -> Tuple[Optional[np.ndarray], Dict[str, Any]]:
+        """
+        Make a face independent of the frame it was detected in, so it can
+        be sent to recognition later.
+        
+        Face crops are copied rather than kept as views of the frame; with
+        the reference transport the frame is put in the frame store, once
+        for all its faces, unless it is already there.
+        
+        Args:
+            frame: Frame the face was detected in
+            metadata: Frame metadata, gets the frame store key
+            face: (face_image, face_metadata) item
+            
+        Returns:
+            The face item
+        """
+        face_img, face_metadata = face
+        if face_img is not None:
+            return face_img.copy(), face_metadata
+        
+        if "frame_key" not in metadata:
+            # Frames read from shared memory are stored once for all their faces
+            metadata["frame_key"] = frame_key(metadata["stream_id"], metadata["timestamp"])
+            self.frame_store.put(metadata["frame_key"], frame, metadata["timestamp"],
+                                 metadata["stream_id"], metadata.get("frame_seq", 0))
+        face_metadata["frame_key"] = metadata["frame_key"]
+        return face_img, face_metadata
+    
+    def _select_face(self, frame: np.ndarray, metadata: Dict[str, Any],
+                     face: Tuple[Optional[np.ndarray], Dict[str, Any]],
+                     recognize: bool) -> Optional[Tuple[Optional[np.ndarray], Dict[str, Any]]]:
+        """
+        Offer a tracked face to its track's best face window.
+        
+        A face due for recognition opens a window; the faces of the track
+        seen while it is open compete on quality and the best are sent to
+        recognition when it closes (see _flush_best_faces).
+        
+        Args:
+            frame: Frame the face was detected in
+            metadata: Frame metadata
+            face: (face_image, face_metadata) item
+            recognize: Whether the tracker found the face due for recognition
+            
+        Returns:
+            The face left out of the window, this one or one it displaced,
+            to be handled as a tracked face; None if none was
+        """
+        face_metadata = face[1]
+        key = (face_metadata["stream_id"], face_metadata["track_id"])
+        quality = face_metadata["quality"]
+        
+        with self.trackers_lock:
+            if recognize:
+                self.best_faces.open(key, time.time())
+            if not self.best_faces.accepts(key, quality):
+                return face
+        
+        # Copied or stored outside the lock, the window may have moved on meanwhile
+        face = self._keep_face(frame, metadata, face)
+        with self.trackers_lock:
+            return self.best_faces.offer(key, quality, face)
+    
+    def _flush_best_faces(self, now: float):
+        """
+        Send the faces selected by the closed best face windows to recognition.
+        
+        Args:
+            now: Current time, float('inf') to close every window
+        """
+        if self.best_faces is None:
+            return
+        
+        with self.trackers_lock:
+            selected = self.best_faces.flush(now)
+        if selected:
+            self.faces_queue.put_many(selected)
+            with self.stats_lock:
+                self.faces_recognized += len(selected)
+    
+    def _update_waits(self, frames_metadata: List[Dict[str, Any]], now: float):
+        """
+        Record how long each frame waited between capture and detection.
+        
+        Args:
+            frames_metadata: Metadata of the detected frames
+            now: Detection time
+        """
+        with self.stats_lock:
+            for metadata in frames_metadata:
+                wait = now - metadata.get("timestamp", now)
+                waits = self.stream_waits.setdefault(metadata.get("stream_id", "unknown"), [0, 0.0, 0.0])
+                waits[0] += 1
+                waits[1] += wait
+                waits[2] = max(waits[2], wait)
+    
+    def _detect_faces(self, frame: np.ndarray,
+                      metadata: Optional[Dict[str, Any]] = None) -> List[Tuple[Optional[np.ndarray], List[int], float]]:
         """
         Detect faces in a frame.
         
         Args:
             frame: Input image frame
+            metadata: Frame metadata, with the scale factors and frame store
+                key of frames downscaled at the source
+            
+        Returns:
+            List of tuples containing (face_image, bounding_box, quality)
+        """
+        return self._detect_faces_batch([frame], [metadata or {}])[0]
+    
+    def _detect_faces_batch(self, frames: List[np.ndarray],
+                            frames_metadata: Optional[List[Dict[str, Any]]] = None,
+                            crop: bool = True) -> List[List[Tuple[Optional[np.ndarray], List[int], float]]]:
+        """
+        Detect faces in a batch of frames with a single model call.
+        
+        Frames downscaled at the source are detected as they are; their
+        bounding boxes are scaled back to full-resolution coordinates and
+        the faces cropped from the full-resolution frame in the frame store.
+        Quality scores are measured on the detected frame, which is cheaper
+        and works without cropping.
+        
+        Args:
+            frames: Input image frames
+            frames_metadata: Metadata of each frame
+            crop: Whether to crop the face images, None is returned in their
+                place otherwise
             
         Returns:
-            List of tuples containing (face_image, bounding_box)
+            One list of (face_image, bounding_box, quality) tuples per input frame
         """
-        faces = []
+        batch_faces = [[] for _ in frames]
+        frames_metadata = frames_metadata or [{} for _ in frames]
         
         try:
-            # Run detection
+            # Run detection; results come back in the same order as the frames
             results = self.model.predict(
-                frame, 
+                frames, 
                 conf=FACE_DETECTION_CONFIDENCE, 
                 iou=FACE_DETECTION_IOU
             )
             
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    # Get bounding box coordinates
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
+            for frame, metadata, faces, detections in zip(frames, frames_metadata, batch_faces, results):
+                scale_x = metadata.get("scale_x", 1.0)
+                scale_y = metadata.get("scale_y", 1.0)
+                full_frame = None
+                # Downscaled frames are cropped from the stored original, read on the first face
+                load_full_frame = crop and "scale_x" in metadata
+                
+                for x1, y1, x2, y2, confidence in detections.tolist():
+                    # Get bounding box coordinates in the full-resolution frame
+                    bbox = [int(x1 * scale_x), int(y1 * scale_y), int(x2 * scale_x), int(y2 * scale_y)]
                     
                     # Filter out small detections
-                    if (x2 - x1) < MIN_FACE_WIDTH:
+                    if (bbox[2] - bbox[0]) < MIN_FACE_WIDTH:
                         continue
                     
-                    # Extract the face image
-                    face_img = frame[y1:y2, x1:x2]
+                    quality = face_quality(frame[int(y1):int(y2), int(x1):int(x2)], bbox[2] - bbox[0],
+                                           confidence)
+                    
+                    # Extract the face image, at full resolution when available
+                    if load_full_frame:
+                        full_frame = self._load_full_frame(metadata["frame_key"])
+                        load_full_frame = False
+                    if not crop:
+                        face_img = None
+                    elif full_frame is not None:
+                        face_img = full_frame[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+                    else:
+                        face_img = frame[int(y1):int(y2), int(x1):int(x2)]
                     
-                    # Store face image and bbox
-                    faces.append((face_img, [x1, y1, x2, y2]))
+                    # Store face image, bbox and quality
+                    faces.append((face_img, bbox, quality))
             
         except Exception as e:
             logger.error(f"Error detecting faces: {str(e)}")
         
-        return faces
+        return batch_faces
+    
+    def _load_full_frame(self, key: str) -> Optional[np.ndarray]:
+        """
+        Read the full-resolution version of a downscaled frame.
+        
+        Args:
+            key: Frame store key
+            
+        Returns:
+            The full-resolution frame, or None if it has expired
+        """
+        try:
+            full_frame = self.frame_store.get(key)
+        except Exception as e:
+            logger.error(f"Error reading full-resolution frame {key}: {str(e)}")
+            full_frame = None
+        
+        if full_frame is None:
+            # Faces are then cropped from the downscaled frame
+            with self.stats_lock:
+                self.full_frames_missing += 1
+        return full_frame
+    
+    def _log_stats(self, elapsed: float):
+        """
+        Log throughput and batch fill since the last report.
+        
+        Args:
+            elapsed: Seconds covered by this report
+        """
+        with self.stats_lock:
+            frames = self.frames_processed
+            batches = self.batches_processed
+            expired = self.frames_expired
+            overwritten = self.frames_overwritten
+            missing = self.full_frames_missing
+            recognized = self.faces_recognized
+            tracked = self.faces_tracked
+            self.full_frames_missing = 0
+            self.faces_recognized = 0
+            self.faces_tracked = 0
+            self.frames_processed = 0
+            self.batches_processed = 0
+            self.frames_overwritten = 0
+            self.frames_expired = 0
+            stream_waits = self.stream_waits
+            self.stream_waits = {}
+        
+        fps = frames / elapsed if elapsed > 0 else 0.0
+        fill = frames / (batches * self.batch_size) if batches else 0.0
+        logger.info(f"Processed {frames} frames in {batches} batches: "
+                    f"{fps:.1f} frames/sec, batch fill {fill:.0%}")
+        if self.face_tracking and recognized + tracked:
+            logger.info(f"Sent {recognized} of {recognized + tracked} faces to recognition, "
+                        f"{tracked / (recognized + tracked):.0%} followed by tracking")
+        if expired:
+            logger.warning(f"Skipped {expired} frames captured more than {self.max_age:g}s ago")
+        if overwritten:
+            logger.warning(f"Skipped {overwritten} frames overwritten in shared memory before detection; "
+                           f"raise SHM_RING_SLOTS or add detection workers")
+        if missing:
+            logger.warning(f"{missing} frames had expired from the frame store before detection "
+                           f"(skipped, or faces cropped from the downscaled frame); raise FRAME_STORE_TTL")
+        
+        if stream_waits:
+            # Per-stream wait shows whether a busy stream starves the others
+            summary = ", ".join(
+                f"{stream_id} {total / count * 1000:.0f}ms avg/{longest * 1000:.0f}ms max"
+                for stream_id, (count, total, longest) in sorted(stream_waits.items())
+            )
+            logger.info(f"Capture to detection wait: {summary}")
+            
+            if self.queue_backend != "inprocess":
+                try:
+                    self.redis_client.hset(
+                        PIPELINE_STATS,
+                        mapping={f"detection_wait_ms:{stream_id}": round(total / count * 1000, 1)
+                                 for stream_id, (count, total, _) in stream_waits.items()}
+                    )
+                except Exception as e:
+                    logger.error(f"Error publishing detection wait: {str(e)}")
     
     def _cleanup(self):
         """Clean up resources before shutdown."""
@@ -189,6 +614,13 @@ class FaceDetector:
             thread.join(timeout=2)
             logger.info(f"Worker thread {i} joined")
         
+        # Faces still waiting in a best face window are sent rather than lost
+        try:
+            self._flush_best_faces(float('inf'))
+        except Exception as e:
+            logger.error(f"Error sending selected faces: {str(e)}")
+        
+        self.shm_reader.close()
         logger.info("Face detector shutdown complete")
 
 
@@ -198,11 +630,38 @@ def main():
     
     parser = argparse.ArgumentParser(description='Face Detection Service')
     parser.add_argument('--model', default=MODEL_PATH, help='Path to the YOLO model weights')
-    parser.add_argument('--workers', type=int, default=1, help='Number of worker threads')
+    parser.add_argument('--workers', type=int, default=DETECTION_WORKERS, help='Number of worker threads')
+    parser.add_argument('--batch-size', type=int, default=DETECTION_BATCH_SIZE,
+                        help='Maximum number of frames per inference batch')
+    parser.add_argument('--max-wait-ms', type=float, default=DETECTION_MAX_WAIT_MS,
+                        help='Maximum time to wait for a batch to fill, in milliseconds')
+    parser.add_argument('--max-age', type=float, default=DETECTION_MAX_AGE,
+                        help='Skip frames captured more than this many seconds ago, 0 to disable')
+    parser.add_argument('--face-transport', choices=['crop', 'reference'], default=FACE_TRANSPORT,
+                        help='Queue face crops, or the frame store key and bbox of each face')
+    parser.add_argument('--face-tracking', action='store_true', default=FACE_TRACKING,
+                        help='Only send new face tracks and periodic re-verifications to recognition')
+    parser.add_argument('--quality-selection', action='store_true', default=QUALITY_SELECTION,
+                        help="With face tracking, recognize each track's best faces of a short window")
+    parser.add_argument('--detector-backend', choices=['ultralytics', 'onnx'], default=DETECTOR_BACKEND,
+                        help='Run the detector with ultralytics (PyTorch) or ONNX Runtime')
+    parser.add_argument('--torch-threads', type=int, default=DETECTION_TORCH_THREADS,
+                        help='Torch threads of the ultralytics backend, 0 for the default')
     
     args = parser.parse_args()
     
-    detector = FaceDetector(model_path=args.model, workers=args.workers)
+    detector = FaceDetector(
+        model_path=args.model,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_age=args.max_age,
+        face_transport=args.face_transport,
+        face_tracking=args.face_tracking,
+        quality_selection=args.quality_selection,
+        detector_backend=args.detector_backend,
+        torch_threads=args.torch_threads
+    )
     detector.start()
 
 
@@ -0,0 +1,316 @@
+import os
+import time
+import hashlib
+import logging
+import cv2
+import numpy as np
+import torch
+from torch import nn
+from torchvision import models
+from typing import Callable, Dict, List, Optional, Tuple
+
+from prod.config import (
+    EMBEDDING_MODEL,
+    EMBEDDING_WEIGHTS,
+    EMBEDDING_QUANTIZATION,
+    EMBEDDING_CALIBRATION_DIR,
+    EMBEDDING_CHANNELS_LAST,
+    EMBEDDING_COMPILE,
+    EMBEDDING_CACHE_DIR
+)
+from prod.face_recognition.preprocessing import FacePreprocessor, IMAGENET_MEAN, IMAGENET_STD
+from prod.utils import file_digest
+
+logger = logging.getLogger('embeddings')
+
+# FaceNet's fixed image standardization, (pixel - 127.5) / 128, as mean and std of pixels in [0, 1]
+FACENET_MEAN = (127.5 / 255,) * 3
+FACENET_STD = (128 / 255,) * 3
+
+# Face crops used to calibrate static quantization, and the batch they are run in
+CALIBRATION_MAX_FACES = 512
+CALIBRATION_BATCH_SIZE = 16
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+class EmbeddingModel:
+    """
+    A face embedding network with the preprocessing it expects.
+
+    Calling it on a batch of BGR face crops returns their L2-normalized
+    embeddings of dimension `dim`.
+    """
+
+    def __init__(self, name: str, module: nn.Module, dim: int, preprocess: FacePreprocessor,
+                 device: torch.device, mode: str = "fp32"):
+        """
+        Initialize the model and check its output dimension.
+
+        Args:
+            name: Registry name
+            module: Network mapping a normalized NCHW batch to (n, dim) or (n, dim, 1, 1)
+            dim: Embedding dimension
+            preprocess: Preprocessing of the face crops
+            device: Device to run on
+            mode: Description of the optimizations applied, for logs
+        """
+        self.name = name
+        self.module = module.to(device).eval()
+        self.dim = dim
+        self.mode = mode
+        self.preprocess = preprocess
+        self.device = device
+
+        # Catches weights or registry entries of the wrong shape at startup
+        with torch.no_grad():
+            output = self.module(_example_input(preprocess, device)).flatten(1)
+        if output.shape[1] != dim:
+            raise ValueError(f"Embedding model {name} outputs {output.shape[1]} dimensions, expected {dim}")
+
+    def __call__(self, face_imgs: List[np.ndarray]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Embed a batch of face crops with one forward pass.
+
+        Args:
+            face_imgs: BGR face crops, of any sizes
+
+        Returns:
+            Tuple of (array of shape (n, dim) of L2-normalized embeddings of
+            the crops that could be preprocessed, their indices in face_imgs)
+        """
+        batch, valid = self.preprocess(face_imgs)
+        if not valid:
+            return np.zeros((0, self.dim), dtype=np.float32), valid
+
+        with torch.no_grad():
+            features = self.module(torch.from_numpy(batch).to(self.device))
+            features = features.flatten(1).cpu().numpy()
+
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        return features / np.maximum(norms, 1e-12), valid
+
+    def parameter_bytes(self) -> int:
+        """Memory taken by the weights (0 for frozen TorchScript, which inlines them)."""
+        tensors = [value for value in self.module.state_dict().values() if isinstance(value, torch.Tensor)]
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _example_input(preprocess: FacePreprocessor, device: Optional[torch.device] = None) -> torch.Tensor:
+    """A batch of one blank face in the layout the preprocessing produces."""
+    size = preprocess.crop_size
+    example = torch.zeros(1, 3, size, size, device=device)
+    if preprocess.channels_last:
+        example = example.contiguous(memory_format=torch.channels_last)
+    return example
+
+
+def _load_weights(module: nn.Module, weights: str):
+    """Load a state dict saved with torch.save(model.state_dict(), path)."""
+    state_dict = torch.load(weights, map_location="cpu")
+    if state_dict and all(key.startswith("fc.") for key in state_dict):
+        raise ValueError(f"{weights} only holds a classifier head ({', '.join(state_dict)}), not an embedding "
+                         f"backbone; facenet_model.pth from train_face.ipynb is such a head over 128-d embeddings")
+    module.load_state_dict(state_dict)
+
+
+def _resnet(name: str) -> Callable[[Optional[str], bool], nn.Module]:
+    """Builder of an ImageNet ResNet with its classification layer removed."""
+    def build(weights: Optional[str], pretrained: bool) -> nn.Module:
+        model = getattr(models, name)(weights="DEFAULT" if pretrained and not weights else None)
+        if weights:
+            _load_weights(model, weights)
+        return nn.Sequential(*list(model.children())[:-1])
+    return build
+
+
+def _facenet(weights: Optional[str], pretrained: bool) -> nn.Module:
+    """Builder of FaceNet (Inception-ResNet v1) trained on VGGFace2, from facenet-pytorch."""
+    try:
+        from facenet_pytorch import InceptionResnetV1
+    except ImportError:
+        raise ImportError("The facenet embedding model requires facenet-pytorch: pip install facenet-pytorch")
+
+    module = InceptionResnetV1(pretrained="vggface2" if pretrained and not weights else None)
+    if weights:
+        _load_weights(module, weights)
+    return module
+
+
+# Preprocessing of the face crops each network was trained with
+IMAGENET_INPUT = {"resize_size": 256, "crop_size": 224, "mean": IMAGENET_MEAN, "std": IMAGENET_STD}
+FACENET_INPUT = {"resize_size": 160, "crop_size": 160, "mean": FACENET_MEAN, "std": FACENET_STD}
+
+# name -> (embedding dimension, builder, preprocessing)
+EMBEDDING_MODELS: Dict[str, Tuple[int, Callable, Dict]] = {
+    "resnet50": (2048, _resnet("resnet50"), IMAGENET_INPUT),
+    "resnet18": (512, _resnet("resnet18"), IMAGENET_INPUT),
+    "facenet": (512, _facenet, FACENET_INPUT),
+}
+
+
+def load_face_crops(directory: str, limit: int = CALIBRATION_MAX_FACES) -> List[np.ndarray]:
+    """
+    Read the face crops of a folder, e.g. saved from the faces queue.
+
+    Args:
+        directory: Folder searched recursively for images
+        limit: Maximum number of crops
+
+    Returns:
+        BGR face crops, in file name order
+    """
+    paths = sorted(os.path.join(root, name) for root, _, names in os.walk(directory)
+                   for name in names if name.lower().endswith(IMAGE_EXTENSIONS))
+    crops = [cv2.imread(path) for path in paths[:limit]]
+    return [crop for crop in crops if crop is not None]
+
+
+def _quantize(module: nn.Module, quantization: str, preprocess: FacePreprocessor,
+              calibration_dir: str, name: str) -> nn.Module:
+    """
+    Quantize a model to INT8 for CPU inference.
+
+    Dynamic quantization converts the Linear layers (weights stored as
+    INT8, activations quantized on the fly); convolutional backbones have
+    few or none, so they need static quantization: the model is traced
+    with FX, run on calibration face crops to record activation ranges,
+    and converted so convolutions run in INT8.
+    """
+    if quantization == "dynamic":
+        if not any(isinstance(layer, nn.Linear) for layer in module.modules()):
+            logger.warning(f"Embedding model {name} has no Linear layers, dynamic quantization changes nothing; "
+                           f"use static quantization")
+        return torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8)
+
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    crops = load_face_crops(calibration_dir) if calibration_dir else []
+    if not crops:
+        raise ValueError("Static quantization needs face crops to calibrate on, "
+                         "set EMBEDDING_CALIBRATION_DIR to a folder of them")
+
+    prepared = prepare_fx(module.eval(), get_default_qconfig_mapping("x86"), (_example_input(preprocess),))
+    with torch.no_grad():
+        for start in range(0, len(crops), CALIBRATION_BATCH_SIZE):
+            batch, _ = preprocess(crops[start:start + CALIBRATION_BATCH_SIZE])
+            prepared(torch.from_numpy(batch))
+    logger.info(f"Calibrated static quantization on {len(crops)} face crops from {calibration_dir}")
+    return convert_fx(prepared)
+
+
+def _cache_path(cache_dir: str, name: str, weights: Optional[str], pretrained: bool, quantization: str,
+                calibration_dir: str, channels_last: bool) -> str:
+    """
+    Path of a compiled model, keyed by everything that changes it.
+
+    The weights, calibration crops (names and sizes) and torch version are
+    part of the key, so a changed input compiles a new model instead of
+    loading a stale one.
+    """
+    key = hashlib.sha256()
+    key.update(f"{name}|{pretrained}|{quantization}|{channels_last}|{torch.__version__}".encode())
+    if weights:
+        key.update(file_digest(weights).encode())
+    if quantization == "static" and calibration_dir:
+        for root, _, names in sorted(os.walk(calibration_dir)):
+            for file_name in sorted(names):
+                key.update(f"{file_name}:{os.path.getsize(os.path.join(root, file_name))}".encode())
+    return os.path.join(cache_dir, f"{name}.{quantization}.{key.hexdigest()[:16]}.pt")
+
+
+def _optimize(module: nn.Module, preprocess: FacePreprocessor, device: torch.device, name: str,
+              quantization: str, calibration_dir: str, compile_mode: str) -> nn.Module:
+    """Apply quantization, the memory format and compilation, in that order."""
+    module = module.eval()
+    if quantization != "none":
+        module = _quantize(module, quantization, preprocess, calibration_dir, name)
+    if preprocess.channels_last:
+        module = module.to(memory_format=torch.channels_last)
+
+    module = module.to(device)
+    if compile_mode == "torchscript":
+        with torch.no_grad():
+            module = torch.jit.freeze(torch.jit.trace(module, _example_input(preprocess, device)))
+    elif compile_mode == "inductor":
+        module = torch.compile(module, dynamic=True)
+    return module
+
+
+def embedding_dim(name: str) -> int:
+    """Embedding dimension of a registered model, without loading it."""
+    if name not in EMBEDDING_MODELS:
+        raise ValueError(f"Unknown embedding model '{name}', expected one of: {', '.join(EMBEDDING_MODELS)}")
+    return EMBEDDING_MODELS[name][0]
+
+
+def get_embedding_model(name: str = EMBEDDING_MODEL, device: Optional[torch.device] = None,
+                        weights: Optional[str] = EMBEDDING_WEIGHTS, pretrained: bool = True,
+                        quantization: str = EMBEDDING_QUANTIZATION,
+                        calibration_dir: str = EMBEDDING_CALIBRATION_DIR,
+                        channels_last: bool = EMBEDDING_CHANNELS_LAST,
+                        compile_mode: str = EMBEDDING_COMPILE,
+                        cache_dir: str = EMBEDDING_CACHE_DIR) -> EmbeddingModel:
+    """
+    Load an embedding model by name, optimized for inference.
+
+    TorchScript models are saved in cache_dir and loaded from there on the
+    next start, which also skips the quantization and its calibration;
+    torch.compile keeps its own cache, pointed at cache_dir too.
+
+    Args:
+        name: "resnet50" (2048-d), "resnet18" (512-d) or "facenet" (512-d)
+        device: Device to run on, CPU by default
+        weights: Optional state dict to load instead of the pretrained weights
+        pretrained: Whether to download the pretrained weights; without
+            them the outputs are meaningless, which is only useful for
+            measuring speed
+        quantization: "none", "dynamic" or "static" (INT8, CPU only)
+        calibration_dir: Folder of face crops calibrating static quantization
+        channels_last: Whether to run convolutions on NHWC tensors
+        compile_mode: "none", "torchscript" or "inductor" (torch.compile)
+        cache_dir: Folder of compiled models, empty to disable the cache
+
+    Returns:
+        Loaded model
+    """
+    dim = embedding_dim(name)
+    device = device or torch.device('cpu')
+    if quantization not in ("none", "dynamic", "static"):
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of: none, dynamic, static")
+    if compile_mode not in ("none", "torchscript", "inductor"):
+        raise ValueError(f"Unknown compile mode '{compile_mode}', expected one of: none, torchscript, inductor")
+    if quantization != "none" and device.type != "cpu":
+        logger.warning(f"Quantized models only run on CPU, not quantizing for {device}")
+        quantization = "none"
+
+    start = time.perf_counter()
+    _, build, model_input = EMBEDDING_MODELS[name]
+    preprocess = FacePreprocessor(**model_input, channels_last=channels_last)
+    mode = "+".join(option for option in (quantization if quantization != "none" else "fp32",
+                                          "channels_last" if channels_last else "",
+                                          compile_mode if compile_mode != "none" else "") if option)
+
+    cache_path = None
+    if compile_mode == "torchscript" and cache_dir:
+        cache_path = _cache_path(cache_dir, name, weights or None, pretrained, quantization,
+                                 calibration_dir, channels_last)
+    elif compile_mode == "inductor" and cache_dir:
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
+
+    if cache_path and os.path.exists(cache_path):
+        module = torch.jit.load(cache_path, map_location=device)
+        logger.info(f"Loaded compiled embedding model from {cache_path}")
+    else:
+        module = build(weights or None, pretrained)
+        module = _optimize(module, preprocess, device, name, quantization, calibration_dir, compile_mode)
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            torch.jit.save(module, cache_path + ".tmp")
+            os.replace(cache_path + ".tmp", cache_path)
+            logger.info(f"Saved compiled embedding model to {cache_path}")
+
+    model = EmbeddingModel(name, module, dim, preprocess, device, mode)
+    logger.info(f"Loaded embedding model {name} ({model.dim}-d, {mode}, "
+                f"{model.parameter_bytes() / 2**20:.0f}MB of weights) in {time.perf_counter() - start:.1f}s")
+    return model
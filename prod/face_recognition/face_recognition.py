@@ -1,17 +1,15 @@
+import gc
 import time
+import queue
 import logging
 import signal
 import threading
+import multiprocessing
 import numpy as np
-import cv2
-import json
 import os
 import base64
 from typing import Dict, Any, Optional, List, Tuple
 import torch
-from torch import nn
-from torchvision import models, transforms
-from PIL import Image
 
 from prod.config import (
     REDIS_HOST,
@@ -20,13 +18,28 @@ from prod.config import (
     REDIS_PASSWORD,
     FACES_QUEUE,
     RECOGNITION_QUEUE,
-    KNOWN_FACES_STORE,
-    DATABASE_URL
+    DATABASE_URL,
+    RECOGNITION_WORKERS,
+    RECOGNITION_BATCH_SIZE,
+    RECOGNITION_MAX_WAIT_MS,
+    RECOGNITION_MAX_AGE,
+    RECOGNITION_GROUP,
+    RECOGNITION_WORKER_MODE,
+    RECOGNITION_TORCH_THREADS,
+    EMBEDDING_MODEL,
+    EMBEDDING_QUANTIZATION,
+    EMBEDDING_CHANNELS_LAST,
+    EMBEDDING_COMPILE,
+    QUEUE_BACKEND,
+    STATS_LOG_INTERVAL
 )
+from prod.face_recognition.embeddings import embedding_dim, get_embedding_model
+from prod.frame_store import FrameStore
+from prod.gallery import FaceGallery
+from prod.queues import get_queue, consumer_name
 from prod.utils import (
     get_redis_connection,
-    decode_face_data,
-    encode_recognition_result
+    build_recognition_result
 )
 
 # Configure logging
@@ -39,27 +52,87 @@ logger = logging.getLogger('face_recognition')
 class FaceRecognizer:
     """Recognizes faces from detected face images."""
     
-    def __init__(self, workers: int = 1, similarity_threshold: float = 0.7):
+    def __init__(self, workers: int = RECOGNITION_WORKERS, similarity_threshold: float = 0.7,
+                 batch_size: int = RECOGNITION_BATCH_SIZE,
+                 max_wait_ms: float = RECOGNITION_MAX_WAIT_MS,
+                 max_age: float = RECOGNITION_MAX_AGE,
+                 embedding_model: str = EMBEDDING_MODEL,
+                 quantization: str = EMBEDDING_QUANTIZATION,
+                 channels_last: bool = EMBEDDING_CHANNELS_LAST,
+                 compile_mode: str = EMBEDDING_COMPILE,
+                 worker_mode: str = RECOGNITION_WORKER_MODE,
+                 torch_threads: int = RECOGNITION_TORCH_THREADS,
+                 queue_backend: str = QUEUE_BACKEND):
         """
         Initialize the face recognizer.
         
         Args:
-            workers: Number of worker threads to process faces
+            workers: Number of worker threads (or processes) to process faces
             similarity_threshold: Threshold for face matching confidence
+            batch_size: Maximum number of faces per embedding forward pass
+            max_wait_ms: Maximum time to wait for a batch to fill, in milliseconds
+            max_age: Skip faces captured more than this many seconds ago, 0 to disable
+            embedding_model: Name of the embedding model, see EMBEDDING_MODELS
+            quantization: "none", "dynamic" or "static" INT8 quantization
+                (static is calibrated on EMBEDDING_CALIBRATION_DIR)
+            channels_last: Whether to run the model on NHWC tensors
+            compile_mode: "none", "torchscript" (cached in EMBEDDING_CACHE_DIR)
+                or "inductor" (torch.compile)
+            worker_mode: "thread" to run the workers as threads sharing one
+                model, "process" to load the model once and fork the
+                workers, sharing its weights copy-on-write (CPU only)
+            torch_threads: Torch intra-op threads per worker process, 0 for
+                the CPUs divided among the workers
+            queue_backend: Queue backend used between the pipeline stages
         """
         self.workers = workers
         self.similarity_threshold = similarity_threshold
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_age = max_age
+        self.queue_backend = queue_backend
         self.redis_client = get_redis_connection()
+        self.recognition_queue = get_queue(RECOGNITION_QUEUE, redis_client=self.redis_client, backend=queue_backend)
+        self.frame_store = FrameStore(self.redis_client, backend=queue_backend)
         self.stop_event = threading.Event()
         self.worker_threads = []
-        self.feature_extractor = None
+        self.embedding_model = embedding_model
+        self.quantization = quantization
+        self.channels_last = channels_last
+        self.compile_mode = compile_mode
+        self.embedder = None
+        # Only known faces of the model's dimension are matched against
+        self.gallery = FaceGallery(self.redis_client, expected_dim=embedding_dim(embedding_model))
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         
+        if worker_mode == "process" and (self.device.type != "cpu" or queue_backend == "inprocess"):
+            logger.warning("Worker processes need a CPU model and a Redis queue backend, running the workers as threads")
+            worker_mode = "thread"
+        self.worker_mode = worker_mode
+        self.torch_threads = torch_threads
+        if worker_mode == "process":
+            # Forked, not spawned, so the workers share the parent's model and gallery
+            self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // max(1, workers))
+            self.mp_context = multiprocessing.get_context("fork")
+            self.process_stop_event = self.mp_context.Event()
+            self.stats_queue = self.mp_context.Queue()
+            self.worker_processes: List[Optional[multiprocessing.Process]] = [None] * workers
+            self.process_restarts = [0] * workers
+        
+        # Throughput counters shared by all workers
+        self.stats_lock = threading.Lock()
+        self.faces_processed = 0
+        self.batches_processed = 0
+        self.faces_expired = 0
+        self.faces_missing = 0
+        
         # Register signal handlers
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
         
-        logger.info(f"Face recognizer initialized with workers: {workers}, device: {self.device}")
+        logger.info(f"Face recognizer initialized with {workers} {worker_mode} workers, device: {self.device}, "
+                    f"embedding model: {embedding_model} ({self.gallery.expected_dim}-d), "
+                    f"batch size: {self.batch_size}, max wait: {max_wait_ms}ms")
     
     def _signal_handler(self, sig, frame):
         """Handle termination signals gracefully."""
@@ -69,25 +142,13 @@ class FaceRecognizer:
     def _load_model(self):
         """Load the face recognition model."""
         try:
-            logger.info("Loading face recognition model")
-            
-            # Use ResNet50 as a feature extractor
-            model = models.resnet50(weights=models.ResNet50_Weights.DEFAULT)
-            # Remove the classification layer
-            self.feature_extractor = nn.Sequential(*list(model.children())[:-1])
-            self.feature_extractor.to(self.device)
-            self.feature_extractor.eval()
+            logger.info(f"Loading face recognition model {self.embedding_model}")
             
-            # Define preprocessing transform
-            self.transform = transforms.Compose([
-                transforms.Resize(256),
-                transforms.CenterCrop(224),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    mean=[0.485, 0.456, 0.406],
-                    std=[0.229, 0.224, 0.225]
-                ),
-            ])
+            # Checks the output dimension of the model with a dummy forward pass
+            self.embedder = get_embedding_model(self.embedding_model, self.device,
+                                                quantization=self.quantization,
+                                                channels_last=self.channels_last,
+                                                compile_mode=self.compile_mode)
             
             logger.info("Model loaded successfully")
             return True
@@ -97,10 +158,20 @@ class FaceRecognizer:
     
     def start(self):
         """Start the face recognition workers."""
+        if self.torch_threads:
+            torch.set_num_threads(self.torch_threads)
+        
         if not self._load_model():
             logger.error("Failed to load model, exiting")
             return
         
+        if self.worker_mode == "process":
+            self._supervise()
+            return
+        
+        # Load known faces and keep them in sync with the store
+        self.gallery.start()
+        
         # Start worker threads
         for i in range(self.workers):
             thread = threading.Thread(
@@ -112,15 +183,127 @@ class FaceRecognizer:
             thread.start()
             logger.info(f"Started worker thread {i}")
         
-        # Keep the main thread alive
+        # Keep the main thread alive and report throughput periodically
+        last_report = time.monotonic()
         try:
             while not self.stop_event.is_set():
                 time.sleep(1)
+                if time.monotonic() - last_report >= STATS_LOG_INTERVAL:
+                    self._log_stats(time.monotonic() - last_report)
+                    last_report = time.monotonic()
         except KeyboardInterrupt:
             logger.info("Keyboard interrupt received, shutting down...")
         finally:
             self._cleanup()
     
+    def _supervise(self):
+        """
+        Run the worker processes, restarting any that die, and collect
+        their throughput stats.
+        """
+        # Loaded once here and shared copy-on-write with every worker; each
+        # worker follows gallery changes itself
+        self.gallery.reload()
+        # Keep the garbage collector of the workers from writing to (and so
+        # copying) the pages of the objects inherited from this process
+        gc.freeze()
+        
+        for index in range(len(self.worker_processes)):
+            self._start_worker_process(index)
+        
+        last_report = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                self._collect_stats(timeout=1)
+                
+                for index, process in enumerate(self.worker_processes):
+                    if process.is_alive() or self.stop_event.is_set():
+                        continue
+                    self.process_restarts[index] += 1
+                    logger.error(f"Worker process {index} exited with code {process.exitcode}, "
+                                 f"restarting (restart #{self.process_restarts[index]})")
+                    self._start_worker_process(index)
+                
+                if time.monotonic() - last_report >= STATS_LOG_INTERVAL:
+                    self._log_stats(time.monotonic() - last_report)
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            logger.info("Keyboard interrupt received, shutting down...")
+        finally:
+            self._cleanup()
+    
+    def _start_worker_process(self, index: int):
+        """
+        Fork (or re-fork) a worker process.
+        
+        Args:
+            index: Index of the worker
+        """
+        process = self.mp_context.Process(
+            target=self._run_worker_process,
+            args=(index,),
+            name=f"recognition_{index}",
+            daemon=True
+        )
+        process.start()
+        self.worker_processes[index] = process
+        logger.info(f"Started worker process {index} (pid {process.pid}) with {self.torch_threads} torch threads")
+    
+    def _run_worker_process(self, index: int):
+        """
+        Entry point of a forked worker process.
+        
+        Args:
+            index: Index of the worker
+        """
+        # The supervisor handles Ctrl+C; a worker killed on its own is restarted
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        torch.set_num_threads(self.torch_threads)
+        
+        # Connections and locks inherited from the supervisor must not be shared
+        self.redis_client = get_redis_connection()
+        self.recognition_queue = get_queue(RECOGNITION_QUEUE, redis_client=self.redis_client, backend=self.queue_backend)
+        self.frame_store = FrameStore(self.redis_client, backend=self.queue_backend)
+        self.gallery.after_fork(self.redis_client)
+        self.gallery.start(reload=False)
+        self.stop_event = self.process_stop_event
+        self.stats_lock = threading.Lock()
+        self._take_stats()
+        
+        worker = threading.Thread(target=self._process_faces, args=(index,), daemon=True)
+        worker.start()
+        
+        # Send the counters to the supervisor, which aggregates and logs them.
+        # The event is polled, not waited on: a worker killed while waiting
+        # on it would leave it unusable for the supervisor
+        while not self.stop_event.is_set():
+            time.sleep(1)
+            self.stats_queue.put(self._take_stats())
+        
+        worker.join(timeout=2)
+        self.gallery.stop()
+        self.stats_queue.put(self._take_stats())
+    
+    def _collect_stats(self, timeout: float):
+        """
+        Add up the counters sent by the worker processes.
+        
+        Args:
+            timeout: Maximum time to wait for the first update
+        """
+        try:
+            stats = self.stats_queue.get(timeout=timeout)
+            while True:
+                with self.stats_lock:
+                    self.faces_processed += stats["faces_processed"]
+                    self.batches_processed += stats["batches_processed"]
+                    self.faces_expired += stats["faces_expired"]
+                    self.faces_missing += stats["faces_missing"]
+                stats = self.stats_queue.get_nowait()
+        except queue.Empty:
+            pass
+    
     def _process_faces(self, worker_id: int):
         """
         Process faces from the queue.
@@ -130,31 +313,55 @@ class FaceRecognizer:
         """
         logger.info(f"Worker {worker_id} starting to process faces")
         
+        faces_queue = get_queue(
+            FACES_QUEUE,
+            group=RECOGNITION_GROUP,
+            consumer=consumer_name(worker_id),
+            redis_client=self.redis_client,
+            backend=self.queue_backend
+        )
+        
         while not self.stop_event.is_set():
             try:
-                # BLPOP waits for items in the queue with a timeout
-                queue_item = self.redis_client.blpop(FACES_QUEUE, timeout=1)
+                # Wait for a face, then drain up to a full batch
+                batch = faces_queue.get_batch(self.batch_size, self.max_wait, max_age=self.max_age)
+                
+                # Stale faces were discarded by the queue before being decoded;
+                # counted per thread, as in-process queues are shared by the workers
+                expired = faces_queue.take_expired()
+                if expired:
+                    with self.stats_lock:
+                        self.faces_expired += expired
                 
-                if not queue_item:
+                if not batch:
                     continue
                 
-                # Extract the face data (queue name and data)
-                _, face_data = queue_item
+                message_ids = [message_id for message_id, _ in batch]
+                face_imgs, faces_metadata = self._resolve_faces([item for _, item in batch])
+                if not face_imgs:
+                    faces_queue.ack(message_ids)
+                    continue
                 
-                # Decode the face data
-                face_img, metadata = decode_face_data(face_data)
+                # Extract features for the whole batch in one forward pass
+                batch_features = self._extract_features_batch(face_imgs)
                 
-                # Extract features from the face
-                face_features = self._extract_features(face_img)
+                # Match the whole batch against known faces
+                matches = self._match_faces(batch_features)
                 
-                # Match against known faces
-                face_id, confidence = self._match_face(face_features)
+                # Queue each recognition result with its own metadata
+                results = []
+                for (face_id, confidence), metadata in zip(matches, faces_metadata):
+                    results.append(build_recognition_result(face_id, confidence, metadata))
+                    
+                    logger.debug(f"Worker {worker_id} recognized face from {metadata['stream_id']}: {face_id} ({confidence:.2f})")
                 
-                # Encode and queue the recognition result
-                result = encode_recognition_result(face_id, confidence, metadata)
-                self.redis_client.rpush(RECOGNITION_QUEUE, result)
+                # Queue all results at once, then acknowledge the faces
+                self.recognition_queue.put_many(results)
+                faces_queue.ack(message_ids)
                 
-                logger.debug(f"Worker {worker_id} recognized face from {metadata['stream_id']}: {face_id} ({confidence:.2f})")
+                with self.stats_lock:
+                    self.faces_processed += len(face_imgs)
+                    self.batches_processed += 1
                 
             except Exception as e:
                 logger.error(f"Worker {worker_id} error: {str(e)}")
@@ -162,6 +369,47 @@ class FaceRecognizer:
         
         logger.info(f"Worker {worker_id} stopping")
     
+    def _resolve_faces(self, items: List[Tuple[Optional[np.ndarray], Dict[str, Any]]]) -> Tuple[List[np.ndarray], List[Dict[str, Any]]]:
+        """
+        Split queue items into face images and metadata, cropping faces sent
+        by reference from their frame.
+        
+        Each referenced frame is read and decoded once, however many of the
+        batch's faces come from it, and all frames with a single round trip.
+        Faces whose frame has expired from the frame store are dropped.
+        
+        Args:
+            items: (face_image, metadata) items, face_image None for faces
+                sent as a frame store key and bbox
+            
+        Returns:
+            Tuple of (face_images, metadata) for the faces still available
+        """
+        keys = list({metadata["frame_key"] for face_img, metadata in items if face_img is None})
+        frames = self.frame_store.get_many(keys) if keys else {}
+        
+        face_imgs = []
+        faces_metadata = []
+        missing = 0
+        for face_img, metadata in items:
+            if face_img is None:
+                frame = frames[metadata["frame_key"]]
+                if frame is None:
+                    missing += 1
+                    continue
+                x1, y1, x2, y2 = metadata["bbox"]
+                face_img = frame[y1:y2, x1:x2]
+            
+            face_imgs.append(face_img)
+            faces_metadata.append(metadata)
+        
+        if missing:
+            logger.debug(f"Skipped {missing} faces whose frame has expired")
+            with self.stats_lock:
+                self.faces_missing += missing
+        
+        return face_imgs, faces_metadata
+    
     def _extract_features(self, face_img: np.ndarray) -> np.ndarray:
         """
         Extract features from a face image.
@@ -172,27 +420,28 @@ class FaceRecognizer:
         Returns:
             Face feature vector
         """
-        try:
-            # Convert OpenCV BGR image to RGB
-            rgb_img = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
-            
-            # Convert to PIL image and apply transformations
-            pil_img = Image.fromarray(rgb_img)
-            img_tensor = self.transform(pil_img).unsqueeze(0).to(self.device)
-            
-            # Extract features
-            with torch.no_grad():
-                features = self.feature_extractor(img_tensor)
-                features = features.squeeze().cpu().numpy()
-            
-            # Normalize features
-            features = features / np.linalg.norm(features)
-            
-            return features
+        return self._extract_features_batch([face_img])[0]
+    
+    def _extract_features_batch(self, face_imgs: List[np.ndarray]) -> np.ndarray:
+        """
+        Extract features from a batch of face images with one forward pass.
+        
+        Args:
+            face_imgs: Face image arrays
             
+        Returns:
+            Array of shape (len(face_imgs), feature_dim); rows for faces that
+            could not be processed are zero vectors
+        """
+        batch_features = np.zeros((len(face_imgs), self.embedder.dim), dtype=np.float32)
+        try:
+            # Preprocessed into this thread's reused batch buffer, embedded and L2-normalized
+            features, valid = self.embedder(face_imgs)
+            batch_features[valid] = features
         except Exception as e:
             logger.error(f"Error extracting features: {str(e)}")
-            return np.zeros(512)  # Return zero vector on error
+        
+        return batch_features
     
     def _match_face(self, face_features: np.ndarray) -> Tuple[str, float]:
         """
@@ -204,49 +453,102 @@ class FaceRecognizer:
         Returns:
             Tuple of (face_id, confidence)
         """
-        best_match_id = "unknown"
-        best_match_score = 0.0
+        return self._match_faces(face_features[np.newaxis, :])[0]
+    
+    def _match_faces(self, batch_features: np.ndarray) -> List[Tuple[str, float]]:
+        """
+        Match a batch of face feature vectors against known faces.
         
-        try:
-            # Get all known faces from Redis
-            known_faces = self.redis_client.hgetall(KNOWN_FACES_STORE)
+        Args:
+            batch_features: Array of shape (num_faces, feature_dim)
             
-            if not known_faces:
+        Returns:
+            List of (face_id, confidence) tuples, one per face
+        """
+        matches = [("unknown", 0.0)] * len(batch_features)
+        
+        try:
+            if not len(self.gallery):
                 logger.debug("No known faces found in database")
-                return best_match_id, best_match_score
-            
-            # Compare with each known face
-            for face_id, face_data in known_faces.items():
-                face_id = face_id.decode('utf-8')
-                face_data = json.loads(face_data.decode('utf-8'))
-                known_features = np.array(face_data['features'])
-                
-                # Compute similarity (cosine similarity)
-                similarity = np.dot(face_features, known_features)
-                
-                if similarity > best_match_score:
-                    best_match_score = similarity
-                    best_match_id = face_id
+                return matches
             
-            # Check if similarity is above threshold
-            if best_match_score < self.similarity_threshold:
-                best_match_id = "unknown"
+            # Cosine similarity against the cached gallery matrix
+            matches = []
+            for best_match_id, best_score in self.gallery.match(batch_features):
+                best_score = max(best_score, 0.0)
+                # Check if similarity is above threshold
+                if best_match_id is None or best_score < self.similarity_threshold:
+                    matches.append(("unknown", best_score))
+                else:
+                    matches.append((best_match_id, best_score))
             
         except Exception as e:
             logger.error(f"Error matching face: {str(e)}")
         
-        return best_match_id, float(best_match_score)
+        return matches
+    
+    def _take_stats(self) -> Dict[str, int]:
+        """Read and reset the throughput counters."""
+        with self.stats_lock:
+            stats = {
+                "faces_processed": self.faces_processed,
+                "batches_processed": self.batches_processed,
+                "faces_expired": self.faces_expired,
+                "faces_missing": self.faces_missing
+            }
+            self.faces_processed = 0
+            self.batches_processed = 0
+            self.faces_expired = 0
+            self.faces_missing = 0
+        return stats
+    
+    def _log_stats(self, elapsed: float):
+        """
+        Log throughput and batch fill since the last report.
+        
+        Args:
+            elapsed: Seconds covered by this report
+        """
+        stats = self._take_stats()
+        faces = stats["faces_processed"]
+        batches = stats["batches_processed"]
+        expired = stats["faces_expired"]
+        missing = stats["faces_missing"]
+        
+        faces_per_sec = faces / elapsed if elapsed > 0 else 0.0
+        fill = faces / (batches * self.batch_size) if batches else 0.0
+        logger.info(f"Processed {faces} faces in {batches} batches: "
+                    f"{faces_per_sec:.1f} faces/sec, batch fill {fill:.0%}")
+        if expired:
+            logger.warning(f"Skipped {expired} faces captured more than {self.max_age:g}s ago")
+        if missing:
+            logger.warning(f"Skipped {missing} faces whose frame had expired from the frame store; "
+                           f"raise FRAME_STORE_TTL")
     
     def _cleanup(self):
         """Clean up resources before shutdown."""
         logger.info("Cleaning up resources...")
         self.stop_event.set()
+        self.gallery.stop()
         
         # Wait for all threads to finish
         for i, thread in enumerate(self.worker_threads):
             thread.join(timeout=2)
             logger.info(f"Worker thread {i} joined")
         
+        # Stop the worker processes, forcibly if they do not exit in time
+        if self.worker_mode == "process":
+            self.process_stop_event.set()
+            for index, process in enumerate(self.worker_processes):
+                if process is None:
+                    continue
+                process.join(timeout=5)
+                if process.is_alive():
+                    logger.warning(f"Worker process {index} did not stop, terminating")
+                    process.terminate()
+                    process.join(timeout=2)
+                logger.info(f"Worker process {index} joined")
+        
         logger.info("Face recognizer shutdown complete")
 
 
@@ -255,12 +557,42 @@ def main():
     import argparse
     
     parser = argparse.ArgumentParser(description='Face Recognition Service')
-    parser.add_argument('--workers', type=int, default=1, help='Number of worker threads')
+    parser.add_argument('--workers', type=int, default=RECOGNITION_WORKERS, help='Number of worker threads or processes')
+    parser.add_argument('--worker-mode', choices=['thread', 'process'], default=RECOGNITION_WORKER_MODE,
+                        help='Run the workers as threads, or as forked processes sharing the model')
+    parser.add_argument('--torch-threads', type=int, default=RECOGNITION_TORCH_THREADS,
+                        help='Torch threads per worker process, 0 for the CPUs divided among the workers')
     parser.add_argument('--threshold', type=float, default=0.7, help='Similarity threshold')
+    parser.add_argument('--batch-size', type=int, default=RECOGNITION_BATCH_SIZE,
+                        help='Maximum number of faces per embedding batch')
+    parser.add_argument('--max-wait-ms', type=float, default=RECOGNITION_MAX_WAIT_MS,
+                        help='Maximum time to wait for a batch to fill, in milliseconds')
+    parser.add_argument('--max-age', type=float, default=RECOGNITION_MAX_AGE,
+                        help='Skip faces captured more than this many seconds ago, 0 to disable')
+    parser.add_argument('--embedding-model', choices=['resnet50', 'resnet18', 'facenet'], default=EMBEDDING_MODEL,
+                        help='Face embedding model')
+    parser.add_argument('--quantization', choices=['none', 'dynamic', 'static'], default=EMBEDDING_QUANTIZATION,
+                        help='INT8 quantization of the embedding model (CPU only)')
+    parser.add_argument('--channels-last', action='store_true', default=EMBEDDING_CHANNELS_LAST,
+                        help='Run the embedding model on NHWC tensors')
+    parser.add_argument('--compile', choices=['none', 'torchscript', 'inductor'], default=EMBEDDING_COMPILE,
+                        help='Compile the embedding model with TorchScript (cached on disk) or torch.compile')
     
     args = parser.parse_args()
     
-    recognizer = FaceRecognizer(workers=args.workers, similarity_threshold=args.threshold)
+    recognizer = FaceRecognizer(
+        workers=args.workers,
+        similarity_threshold=args.threshold,
+        batch_size=args.batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_age=args.max_age,
+        embedding_model=args.embedding_model,
+        quantization=args.quantization,
+        channels_last=args.channels_last,
+        compile_mode=args.compile,
+        worker_mode=args.worker_mode,
+        torch_threads=args.torch_threads
+    )
     recognizer.start()
 
 
@@ -0,0 +1,110 @@
+import logging
+import threading
+import cv2
+import numpy as np
+from typing import List, Tuple
+
+logger = logging.getLogger('face_preprocessing')
+
+# ImageNet statistics the ResNet weights were trained with, in RGB order
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+class FacePreprocessor:
+    """
+    Turns a batch of BGR face crops into a normalized NCHW float32 batch.
+
+    Equivalent to torchvision's Resize(resize_size), CenterCrop(crop_size),
+    ToTensor() and Normalize(mean, std) on an RGB PIL image, but each crop
+    is resized with OpenCV straight into a uint8 batch, and the channel
+    swap, layout change and normalization are then fused into one
+    multiply-add per channel over the whole batch. The batch buffers are
+    kept and reused per thread, so the returned array is only valid until
+    the same thread preprocesses the next batch.
+
+    With channels_last the batch is laid out as NHWC in memory (the shape
+    is still NCHW), which is what channels_last models read, so torch does
+    not have to reorder it.
+    """
+
+    def __init__(self, resize_size: int = 256, crop_size: int = 224,
+                 mean: Tuple[float, ...] = IMAGENET_MEAN, std: Tuple[float, ...] = IMAGENET_STD,
+                 channels_last: bool = False):
+        """
+        Initialize the preprocessor.
+
+        Args:
+            resize_size: Length the shorter side of each crop is resized to
+            crop_size: Side of the square center crop
+            mean: Per-channel mean in RGB order, for pixels in [0, 1]
+            std: Per-channel standard deviation in RGB order
+            channels_last: Whether to lay the batch out as NHWC in memory
+        """
+        self.resize_size = resize_size
+        self.crop_size = crop_size
+        self.channels_last = channels_last
+        # (pixel / 255 - mean) / std as pixel * scale + bias
+        self.scale = [np.float32(1.0 / (255.0 * s)) for s in std]
+        self.bias = [np.float32(-m / s) for m, s in zip(mean, std)]
+        self._local = threading.local()
+
+    def _buffers(self, batch_size: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get this thread's buffers, grown to hold at least batch_size crops."""
+        pixels = getattr(self._local, "pixels", None)
+        if pixels is None or len(pixels) < batch_size:
+            size = self.crop_size
+            self._local.pixels = np.empty((batch_size, size, size, 3), dtype=np.uint8)
+            if self.channels_last:
+                self._local.batch = np.empty((batch_size, size, size, 3), dtype=np.float32).transpose(0, 3, 1, 2)
+            else:
+                self._local.batch = np.empty((batch_size, 3, size, size), dtype=np.float32)
+        return self._local.pixels, self._local.batch
+
+    def _resize_crop(self, face_img: np.ndarray, out: np.ndarray):
+        """Resize the shorter side of a crop and write its center into out."""
+        height, width = face_img.shape[:2]
+        if not height or not width:
+            raise ValueError(f"Empty face image of shape {face_img.shape}")
+
+        # Same output size and crop offsets as torchvision
+        if width <= height:
+            new_width, new_height = self.resize_size, int(self.resize_size * height / width)
+        else:
+            new_width, new_height = int(self.resize_size * width / height), self.resize_size
+        top = int(round((new_height - self.crop_size) / 2.0))
+        left = int(round((new_width - self.crop_size) / 2.0))
+
+        # INTER_AREA averages like PIL's antialiased downscaling
+        interpolation = cv2.INTER_AREA if new_width < width else cv2.INTER_LINEAR
+        resized = cv2.resize(face_img, (new_width, new_height), interpolation=interpolation)
+        out[...] = resized[top:top + self.crop_size, left:left + self.crop_size]
+
+    def __call__(self, face_imgs: List[np.ndarray]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Preprocess a batch of face crops.
+
+        Args:
+            face_imgs: BGR face crops, of any sizes
+
+        Returns:
+            Tuple of (array of shape (n, 3, crop_size, crop_size) of the
+            crops that could be processed, their indices in face_imgs)
+        """
+        pixels, batch = self._buffers(len(face_imgs))
+
+        valid = []
+        for i, face_img in enumerate(face_imgs):
+            try:
+                self._resize_crop(face_img, pixels[len(valid)])
+                valid.append(i)
+            except Exception as e:
+                logger.warning(f"Error preprocessing face: {str(e)}")
+
+        count = len(valid)
+        for channel in range(3):
+            # BGR pixels into RGB planes
+            out = batch[:count, channel]
+            np.multiply(pixels[:count, :, :, 2 - channel], self.scale[channel], out=out)
+            out += self.bias[channel]
+        return batch[:count], valid
@@ -0,0 +1,113 @@
+import time
+import logging
+import threading
+import numpy as np
+import redis
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from prod.config import FRAME_STORE_PREFIX, FRAME_STORE_TTL, QUEUE_BACKEND
+from prod.utils import get_redis_connection, encode_frame_data, decode_frame_data
+
+logger = logging.getLogger('frame_store')
+
+# Frames stored by in-process pipelines: key -> (expiry, frame)
+_inprocess_frames: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+_inprocess_lock = threading.Lock()
+
+
+def frame_key(stream_id: str, timestamp: float) -> str:
+    """Key of a stream's frame captured at timestamp."""
+    return f"{FRAME_STORE_PREFIX}:{stream_id}:{int(timestamp * 1000)}"
+
+
+class FrameStore:
+    """
+    Full-resolution frames kept for a short time under a key.
+
+    When the stream processor sends detection a downscaled copy of a frame,
+    the original goes here so that faces can still be cropped at full
+    resolution. With FACE_TRANSPORT=reference every frame goes here once and
+    the queues only carry its key. Frames expire after ttl seconds, so
+    nothing has to delete them once the pipeline is done with them. Redis
+    backends store frames encoded with the frame codec; the in-process
+    backend keeps them by reference.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None, backend: str = QUEUE_BACKEND,
+                 ttl: float = FRAME_STORE_TTL):
+        """
+        Initialize the store.
+
+        Args:
+            redis_client: Redis connection to use, a new one by default
+            backend: Queue backend of the pipeline, "inprocess" keeps frames in memory
+            ttl: Seconds frames are kept
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.redis_client = None if backend == "inprocess" else (redis_client or get_redis_connection())
+
+    def put(self, key: str, frame: np.ndarray, timestamp: float, stream_id: str, frame_seq: int = 0):
+        """
+        Store a frame.
+
+        Args:
+            key: Key from frame_key
+            frame: Full-resolution frame
+            timestamp: Capture timestamp
+            stream_id: Stream the frame was captured from
+            frame_seq: Sequence number of the frame within its stream
+        """
+        if self.redis_client is None:
+            now = time.monotonic()
+            with _inprocess_lock:
+                # Entries are in insertion order, so expired ones are at the front
+                while _inprocess_frames and next(iter(_inprocess_frames.values()))[0] <= now:
+                    _inprocess_frames.popitem(last=False)
+                _inprocess_frames[key] = (now + self.ttl, frame)
+            return
+
+        data = encode_frame_data(frame, timestamp, stream_id, frame_seq)
+        self.redis_client.set(key, data, px=int(self.ttl * 1000))
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Read a frame.
+
+        Args:
+            key: Key the frame was stored under
+
+        Returns:
+            The frame, or None if it expired or was never stored
+        """
+        if self.redis_client is None:
+            with _inprocess_lock:
+                entry = _inprocess_frames.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+        data = self.redis_client.get(key)
+        if data is None:
+            return None
+        frame, _ = decode_frame_data(data)
+        return frame
+
+    def get_many(self, keys: List[str]) -> Dict[str, Optional[np.ndarray]]:
+        """
+        Read several frames with a single round trip.
+
+        Args:
+            keys: Keys the frames were stored under
+
+        Returns:
+            Frame per key, None for frames that expired or were never stored
+        """
+        if self.redis_client is None:
+            return {key: self.get(key) for key in keys}
+
+        frames = {}
+        for key, data in zip(keys, self.redis_client.mget(keys)):
+            frames[key] = decode_frame_data(data)[0] if data is not None else None
+        return frames
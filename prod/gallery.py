@@ -0,0 +1,390 @@
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+import redis
+from typing import Dict, Any, Optional, List, Tuple
+
+from prod.config import (
+    KNOWN_FACES_STORE,
+    KNOWN_FACES_VERSION,
+    KNOWN_FACES_CHANNEL,
+    GALLERY_REFRESH_INTERVAL,
+    FACE_MATCHER,
+    MATCHER_INDEX_PATH
+)
+from prod.matchers import BruteForceMatcher, IVFFlatMatcher, create_matcher
+
+logger = logging.getLogger('gallery')
+
+
+def enroll_known_face(redis_client: redis.Redis, face_id: str, features: np.ndarray,
+                      extra: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Add or replace a known face and notify running galleries.
+
+    Args:
+        redis_client: Redis connection
+        face_id: Identity the features belong to
+        features: Face feature vector
+        extra: Additional fields stored alongside the features
+
+    Returns:
+        New gallery version
+    """
+    face_data = dict(extra or {})
+    face_data["features"] = np.asarray(features, dtype=np.float32).tolist()
+
+    # The version is bumped in the same MULTI as the write, so a gallery
+    # that reads version V always sees the changes it covers
+    pipe = redis_client.pipeline()
+    pipe.incr(KNOWN_FACES_VERSION)
+    pipe.hset(KNOWN_FACES_STORE, face_id, json.dumps(face_data))
+    version, _ = pipe.execute()
+    redis_client.publish(KNOWN_FACES_CHANNEL, json.dumps({
+        "op": "upsert",
+        "face_id": face_id,
+        "version": version
+    }))
+    return version
+
+
+def remove_known_face(redis_client: redis.Redis, face_id: str) -> int:
+    """
+    Remove a known face and notify running galleries.
+
+    Args:
+        redis_client: Redis connection
+        face_id: Identity to remove
+
+    Returns:
+        New gallery version
+    """
+    # Same MULTI as the write, see enroll_known_face
+    pipe = redis_client.pipeline()
+    pipe.incr(KNOWN_FACES_VERSION)
+    pipe.hdel(KNOWN_FACES_STORE, face_id)
+    version, _ = pipe.execute()
+    redis_client.publish(KNOWN_FACES_CHANNEL, json.dumps({
+        "op": "remove",
+        "face_id": face_id,
+        "version": version
+    }))
+    return version
+
+
+class FaceGallery:
+    """
+    In-memory copy of the known faces store.
+
+    Features are L2-normalized and held by a matcher (see prod.matchers):
+    exact search over a contiguous float32 matrix for small galleries, or an
+    IVF index for large ones. The copy is patched one face at a time from
+    pub/sub notifications; a full reload only happens when the version
+    counter shows that notifications were missed.
+    """
+
+    def __init__(self, redis_client: redis.Redis,
+                 refresh_interval: float = GALLERY_REFRESH_INTERVAL,
+                 matcher: str = FACE_MATCHER,
+                 index_path: str = MATCHER_INDEX_PATH,
+                 expected_dim: int = 0):
+        """
+        Initialize the gallery.
+
+        Args:
+            redis_client: Redis connection
+            refresh_interval: Seconds between version counter checks
+            matcher: Matcher name passed to create_matcher
+            index_path: File to cache the built matcher in, empty to disable
+            expected_dim: Dimension of the embeddings the gallery is matched
+                against; known faces of another dimension (enrolled with a
+                different embedding model) are skipped. 0 accepts any
+        """
+        self.redis_client = redis_client
+        self.refresh_interval = refresh_interval
+        self.matcher_kind = matcher
+        self.index_path = index_path
+        self.expected_dim = expected_dim
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.listener_thread = None
+        self.version = 0
+        self.matcher = BruteForceMatcher()
+
+    @property
+    def dim(self) -> int:
+        """Feature dimension of the gallery, 0 while it is empty."""
+        return self.matcher.dim
+
+    def __len__(self) -> int:
+        return len(self.matcher)
+
+    def start(self, reload: bool = True):
+        """
+        Load the gallery and start following changes in the background.
+
+        Args:
+            reload: Whether to load the gallery first; False for a gallery
+                already loaded, e.g. inherited from a parent process
+        """
+        if reload:
+            self.reload()
+        self.listener_thread = threading.Thread(target=self._listen, daemon=True)
+        self.listener_thread.start()
+
+    def after_fork(self, redis_client: redis.Redis):
+        """
+        Prepare a gallery loaded before a fork for use in the child process.
+
+        The matcher stays shared with the parent copy-on-write until it is
+        patched; the connection, lock and listener become the child's own.
+
+        Args:
+            redis_client: Redis connection opened in the child
+        """
+        self.redis_client = redis_client
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.listener_thread = None
+
+    def stop(self):
+        """Stop following changes."""
+        self.stop_event.set()
+        if self.listener_thread is not None:
+            self.listener_thread.join(timeout=2)
+
+    def reload(self):
+        """Rebuild the gallery from the known faces store."""
+        # Read the version first so changes made during the load are replayed
+        version = int(self.redis_client.get(KNOWN_FACES_VERSION) or 0)
+        
+        if self._load_index(version):
+            return
+        
+        known_faces = self.redis_client.hgetall(KNOWN_FACES_STORE)
+
+        ids = []
+        rows = []
+        skipped = 0
+        for face_id, face_data in known_faces.items():
+            features = self._parse_features(face_data)
+            if features is None:
+                continue
+            if self.expected_dim and features.shape[0] != self.expected_dim:
+                skipped += 1
+                continue
+            if rows and features.shape != rows[0].shape:
+                logger.warning(f"Skipping known face {face_id.decode('utf-8')}: "
+                               f"dimension {features.shape[0]} != {rows[0].shape[0]}")
+                continue
+            ids.append(face_id.decode('utf-8'))
+            rows.append(features)
+
+        matrix = np.ascontiguousarray(rows, dtype=np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+        matcher = create_matcher(len(ids), self.matcher_kind)
+        matcher.build(ids, matrix)
+
+        with self.lock:
+            self.matcher = matcher
+            self.version = version
+
+        logger.info(f"Loaded {len(ids)} known faces (version {version}, {matcher.kind} matcher)")
+        if skipped:
+            logger.error(f"Skipped {skipped} known faces whose dimension is not {self.expected_dim}; "
+                         f"they were enrolled with another embedding model and must be enrolled again")
+
+        if self.index_path and len(ids):
+            try:
+                matcher.save(self.index_path, version)
+            except OSError as e:
+                logger.warning(f"Could not save matcher index to {self.index_path}: {str(e)}")
+
+    def _load_index(self, version: int) -> bool:
+        """
+        Load the matcher from the index cache if it matches the store.
+
+        Args:
+            version: Current gallery version
+
+        Returns:
+            True if the cached index was loaded
+        """
+        if not self.index_path or not os.path.exists(self.index_path):
+            return False
+
+        try:
+            matcher, index_version = BruteForceMatcher.load(self.index_path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable matcher index {self.index_path}: {str(e)}")
+            return False
+
+        if index_version != version:
+            logger.info(f"Matcher index is at version {index_version}, store is at {version}, rebuilding")
+            return False
+
+        if self.expected_dim and len(matcher) and matcher.dim != self.expected_dim:
+            logger.info(f"Matcher index has dimension {matcher.dim}, expected {self.expected_dim}, rebuilding")
+            return False
+
+        # FACE_MATCHER (or the auto threshold) and IVF_NLIST may have changed since it was saved
+        expected = create_matcher(len(matcher), self.matcher_kind)
+        if matcher.kind != expected.kind:
+            logger.info(f"Matcher index is a {matcher.kind} matcher, {expected.kind} is configured, rebuilding")
+            return False
+        if isinstance(matcher, IVFFlatMatcher):
+            if matcher.nlist != expected.nlist:
+                logger.info(f"Matcher index has nlist {matcher.nlist}, {expected.nlist} is configured, rebuilding")
+                return False
+            # Only used by queries, no rebuild needed
+            matcher.nprobe = expected.nprobe
+
+        with self.lock:
+            self.matcher = matcher
+            self.version = version
+
+        logger.info(f"Loaded {len(matcher)} known faces from {self.index_path} (version {version}, {matcher.kind} matcher)")
+        return True
+
+    def upsert(self, face_id: str, features: np.ndarray):
+        """
+        Add or replace a single entry.
+
+        Args:
+            face_id: Identity of the entry
+            features: Face feature vector (normalized here)
+        """
+        features = self._normalize(np.asarray(features, dtype=np.float32))
+
+        if self.expected_dim and features.shape[0] != self.expected_dim:
+            logger.warning(f"Ignoring known face {face_id}: dimension {features.shape[0]} != {self.expected_dim}")
+            return
+
+        with self.lock:
+            if len(self.matcher) and features.shape[0] != self.dim:
+                logger.warning(f"Ignoring known face {face_id}: dimension {features.shape[0]} != {self.dim}")
+                return
+
+            self.matcher.add(face_id, features)
+
+    def remove(self, face_id: str):
+        """
+        Remove a single entry.
+
+        Args:
+            face_id: Identity of the entry
+        """
+        with self.lock:
+            self.matcher.remove(face_id)
+
+    def match(self, batch_features: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Find the closest known face for each feature vector.
+
+        Args:
+            batch_features: Array of shape (num_faces, feature_dim)
+
+        Returns:
+            List of (face_id, similarity) tuples; face_id is None when the
+            gallery is empty or the dimensions do not match
+        """
+        with self.lock:
+            if not len(self.matcher):
+                return [(None, 0.0)] * len(batch_features)
+
+            if batch_features.shape[1] != self.dim:
+                logger.warning(f"Feature dimension {batch_features.shape[1]} does not match gallery dimension {self.dim}")
+                return [(None, 0.0)] * len(batch_features)
+
+            return self.matcher.search(np.asarray(batch_features, dtype=np.float32))
+
+    def _listen(self):
+        """Apply change notifications and fall back to a reload on gaps."""
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(KNOWN_FACES_CHANNEL)
+        last_check = 0.0
+
+        # Anything enrolled between the initial load and the subscription
+        # is caught by the first version check below
+        while not self.stop_event.is_set():
+            try:
+                message = pubsub.get_message(timeout=1.0)
+                if message:
+                    self._apply_notification(json.loads(message['data']))
+
+                now = time.monotonic()
+                if now - last_check >= self.refresh_interval:
+                    last_check = now
+                    remote_version = int(self.redis_client.get(KNOWN_FACES_VERSION) or 0)
+                    if remote_version > self.version:
+                        logger.info(f"Gallery version {self.version} behind {remote_version}, reloading")
+                        self.reload()
+
+            except Exception as e:
+                logger.error(f"Error following gallery changes: {str(e)}")
+                self.stop_event.wait(1)
+
+        pubsub.close()
+
+    def _apply_notification(self, notification: Dict[str, Any]):
+        """
+        Apply a single change notification.
+
+        Notifications must arrive in version order: on a gap (a message
+        lost while reconnecting, or concurrent changes published out of
+        order) the gallery is reloaded instead.
+
+        Args:
+            notification: Decoded message published by enroll/remove
+        """
+        face_id = notification['face_id']
+        version = int(notification['version'])
+
+        with self.lock:
+            current = self.version
+        if version <= current:
+            # Already covered by a reload
+            return
+        if version != current + 1:
+            logger.info(f"Gallery version {current} missed changes before {version}, reloading")
+            self.reload()
+            return
+
+        if notification['op'] == 'remove':
+            self.remove(face_id)
+        else:
+            features = self._parse_features(self.redis_client.hget(KNOWN_FACES_STORE, face_id))
+            if features is None:
+                self.remove(face_id)
+            else:
+                self.upsert(face_id, features)
+
+        with self.lock:
+            self.version = version
+
+    def _parse_features(self, face_data: Optional[bytes]) -> Optional[np.ndarray]:
+        """
+        Parse and normalize the features of a stored known face.
+
+        Args:
+            face_data: JSON document from the known faces store
+
+        Returns:
+            Normalized float32 feature vector, or None if unusable
+        """
+        if face_data is None:
+            return None
+        try:
+            features = np.asarray(json.loads(face_data.decode('utf-8'))['features'], dtype=np.float32)
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Ignoring malformed known face entry: {str(e)}")
+            return None
+        return self._normalize(features)
+
+    @staticmethod
+    def _normalize(features: np.ndarray) -> np.ndarray:
+        """L2-normalize a feature vector."""
+        norm = np.linalg.norm(features)
+        return features / norm if norm > 0 else features
@@ -0,0 +1,170 @@
+import struct
+import numpy as np
+import cv2
+from typing import Dict, Union
+
+from prod.config import (
+    JPEG_QUALITY,
+    PNG_COMPRESSION,
+    WEBP_QUALITY
+)
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class ImageCodec:
+    """
+    Base class for the image codecs used on the queues.
+
+    Only decodes, with any format cv2.imdecode detects on its own; it
+    serves messages without a codec id. Subclasses add encode.
+    """
+
+    # Identifier stored in the message envelope so consumers know how to decode
+    codec_id = 0
+    name = "auto"
+
+    def decode(self, data: Buffer) -> np.ndarray:
+        """Decode bytes produced by encode back to an OpenCV image."""
+        # frombuffer wraps bytes and memoryviews alike without copying
+        np_arr = np.frombuffer(data, np.uint8)
+        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}()"
+
+
+class OpenCVCodec(ImageCodec):
+    """Codec backed by cv2.imencode for a given file extension."""
+
+    extension = ""
+
+    def __init__(self, params=None):
+        """
+        Initialize the codec.
+
+        Args:
+            params: cv2.imencode parameters
+        """
+        self.params = list(params or [])
+
+    def encode(self, image: np.ndarray) -> bytes:
+        """Encode an OpenCV image to bytes."""
+        success, encoded_img = cv2.imencode(self.extension, image, self.params)
+        if not success:
+            raise ValueError(f"Failed to encode image as {self.name}")
+        return encoded_img.tobytes()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.params})"
+
+
+class JpegCodec(OpenCVCodec):
+    """Lossy JPEG with an explicit quality setting."""
+
+    codec_id = 1
+    name = "jpeg"
+    extension = ".jpg"
+
+    def __init__(self, quality: int = JPEG_QUALITY):
+        super().__init__([cv2.IMWRITE_JPEG_QUALITY, quality])
+
+
+class PngCodec(OpenCVCodec):
+    """Lossless PNG, mainly useful for face crops."""
+
+    codec_id = 2
+    name = "png"
+    extension = ".png"
+
+    def __init__(self, compression: int = PNG_COMPRESSION):
+        super().__init__([cv2.IMWRITE_PNG_COMPRESSION, compression])
+
+
+class WebpCodec(OpenCVCodec):
+    """Lossy WebP, smaller than JPEG at similar quality but slower."""
+
+    codec_id = 3
+    name = "webp"
+    extension = ".webp"
+
+    def __init__(self, quality: int = WEBP_QUALITY):
+        super().__init__([cv2.IMWRITE_WEBP_QUALITY, quality])
+
+
+class RawCodec(ImageCodec):
+    """
+    Uncompressed uint8 pixels behind a small shape header.
+
+    Costs almost no CPU but ships every pixel, so it only makes sense
+    when producer and consumer share a host.
+    """
+
+    codec_id = 4
+    name = "raw"
+    header = struct.Struct('<IIB')
+
+    def encode(self, image: np.ndarray) -> bytes:
+        """Encode an OpenCV image to bytes."""
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        height, width = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        return b''.join((self.header.pack(height, width, channels), image.data))
+
+    def decode(self, data: Buffer) -> np.ndarray:
+        """
+        Decode bytes produced by encode back to an OpenCV image.
+
+        The returned array is a read-only view into data.
+        """
+        height, width, channels = self.header.unpack_from(data)
+        pixels = np.frombuffer(data, np.uint8, offset=self.header.size)
+        if channels == 1:
+            return pixels.reshape(height, width)
+        return pixels.reshape(height, width, channels)
+
+
+CODECS = {
+    JpegCodec.name: JpegCodec,
+    PngCodec.name: PngCodec,
+    WebpCodec.name: WebpCodec,
+    RawCodec.name: RawCodec,
+}
+
+# Messages without a codec id (older envelopes) hold JPEG or another format
+# cv2.imdecode detects on its own
+DECODERS: Dict[int, ImageCodec] = {
+    ImageCodec.codec_id: ImageCodec(),
+    **{codec.codec_id: codec() for codec in CODECS.values()},
+}
+
+
+def get_codec(name: str) -> ImageCodec:
+    """
+    Create a codec by name.
+
+    Args:
+        name: One of "jpeg", "png", "webp" or "raw"
+
+    Returns:
+        Codec configured from the environment settings
+    """
+    if name not in CODECS:
+        raise ValueError(f"Unknown image codec '{name}', expected one of: {', '.join(CODECS)}")
+    return CODECS[name]()
+
+
+def decode_with(codec_id: int, data: Buffer) -> np.ndarray:
+    """
+    Decode image bytes with the codec named in a message envelope.
+
+    Args:
+        codec_id: Codec identifier from the envelope
+        data: Encoded image
+
+    Returns:
+        Decoded OpenCV image
+    """
+    if codec_id not in DECODERS:
+        raise ValueError(f"Unknown image codec id {codec_id}")
+    return DECODERS[codec_id].decode(data)
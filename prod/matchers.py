@@ -0,0 +1,439 @@
+import os
+import logging
+import numpy as np
+from typing import Dict, Optional, List, Tuple
+
+from prod.config import (
+    FACE_MATCHER,
+    ANN_MIN_GALLERY_SIZE,
+    IVF_NLIST,
+    IVF_NPROBE
+)
+
+logger = logging.getLogger('matchers')
+
+
+class BruteForceMatcher:
+    """
+    Exact nearest-neighbour search over normalized face features.
+
+    Features live in a contiguous float32 matrix with a parallel list of ids,
+    so a batch of queries is matched with one matrix product plus argmax.
+    """
+
+    kind = "brute"
+
+    def __init__(self):
+        """Initialize an empty matcher."""
+        self.ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._size = 0
+
+    @property
+    def dim(self) -> int:
+        """Feature dimension, 0 while the matcher is empty."""
+        return self._matrix.shape[1] if self._size else 0
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Feature matrix, one row per entry of ids."""
+        return self._matrix[:self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def build(self, ids: List[str], vectors: np.ndarray):
+        """
+        Replace the contents of the matcher.
+
+        Args:
+            ids: Identity of each row
+            vectors: Normalized features, shape (len(ids), dim)
+        """
+        self.ids = list(ids)
+        self._index = {face_id: i for i, face_id in enumerate(self.ids)}
+        self._matrix = np.ascontiguousarray(vectors, dtype=np.float32).reshape(len(self.ids), -1)
+        self._size = len(self.ids)
+
+    def add(self, face_id: str, vector: np.ndarray) -> int:
+        """
+        Add or replace a single entry.
+
+        Args:
+            face_id: Identity of the entry
+            vector: Normalized feature vector
+
+        Returns:
+            Row of the entry in the matrix
+        """
+        row = self._index.get(face_id)
+        if row is not None:
+            self._matrix[row] = vector
+            return row
+
+        # Grow the backing buffer geometrically so appends stay amortized O(1)
+        if self._size == self._matrix.shape[0] or self._matrix.shape[1] != vector.shape[0]:
+            capacity = max(16, 2 * self._matrix.shape[0])
+            matrix = np.zeros((capacity, vector.shape[0]), dtype=np.float32)
+            matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+
+        row = self._size
+        self._matrix[row] = vector
+        self._index[face_id] = row
+        self.ids.append(face_id)
+        self._size += 1
+        return row
+
+    def remove(self, face_id: str) -> Optional[Tuple[int, int]]:
+        """
+        Remove a single entry.
+
+        Args:
+            face_id: Identity of the entry
+
+        Returns:
+            (removed_row, moved_from_row) describing how rows were compacted,
+            or None if the entry did not exist
+        """
+        row = self._index.pop(face_id, None)
+        if row is None:
+            return None
+
+        # Move the last row into the hole to keep the matrix contiguous
+        last = self._size - 1
+        if row != last:
+            moved_id = self.ids[last]
+            self._matrix[row] = self._matrix[last]
+            self.ids[row] = moved_id
+            self._index[moved_id] = row
+        self.ids.pop()
+        self._size -= 1
+        return row, last
+
+    def search(self, queries: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Find the closest entry for each query.
+
+        Args:
+            queries: Normalized features, shape (num_queries, dim)
+
+        Returns:
+            List of (face_id, similarity) tuples
+        """
+        if not self._size:
+            return [(None, 0.0)] * len(queries)
+
+        similarities = queries @ self.matrix.T
+        best_rows = similarities.argmax(axis=1)
+        best_scores = similarities[np.arange(len(queries)), best_rows]
+
+        return [
+            (self.ids[best_row], float(best_score))
+            for best_row, best_score in zip(best_rows, best_scores)
+        ]
+
+    def save(self, path: str, version: int = 0):
+        """
+        Save the matcher to disk.
+
+        Written to a temporary file and renamed into place, so other
+        workers never read a partial file.
+
+        Args:
+            path: Destination file
+            version: Gallery version the contents correspond to
+        """
+        # One temporary file per process, as several workers may save at once
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                np.savez(f, **self._state(), kind=self.kind, version=version)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["BruteForceMatcher", int]:
+        """
+        Load a matcher saved with save().
+
+        Args:
+            path: File written by save()
+
+        Returns:
+            Tuple of (matcher, gallery version)
+        """
+        with np.load(path, allow_pickle=False) as state:
+            matcher_class = MATCHERS[str(state['kind'])]
+            matcher = matcher_class.__new__(matcher_class)
+            matcher._restore(state)
+            return matcher, int(state['version'])
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to restore the matcher."""
+        return {"ids": np.asarray(self.ids, dtype=str), "matrix": self.matrix}
+
+    def _restore(self, state):
+        """Restore the matcher from arrays produced by _state()."""
+        BruteForceMatcher.__init__(self)
+        BruteForceMatcher.build(self, state['ids'].tolist(), state['matrix'])
+
+
+class IVFFlatMatcher(BruteForceMatcher):
+    """
+    Approximate nearest-neighbour search with an inverted file index.
+
+    Entries are partitioned into nlist clusters by spherical k-means. A query
+    only scores the entries of its nprobe closest clusters, so its cost grows
+    with nprobe / nlist of the gallery instead of the whole gallery. Entries
+    are stored exactly ("flat"), so scores are exact cosine similarities.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, nlist: int = IVF_NLIST, nprobe: int = IVF_NPROBE,
+                 kmeans_iterations: int = 10, seed: int = 0):
+        """
+        Initialize an empty index.
+
+        Args:
+            nlist: Number of clusters, 0 to choose from the gallery size
+            nprobe: Number of clusters scored per query
+            kmeans_iterations: Training iterations for the cluster centroids
+            seed: Random seed for centroid initialization
+        """
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.kmeans_iterations = kmeans_iterations
+        self.seed = seed
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._lists: List[List[int]] = []
+        self._list_arrays: List[Optional[np.ndarray]] = []
+
+    def build(self, ids: List[str], vectors: np.ndarray):
+        """
+        Train the clusters and index all entries.
+
+        Args:
+            ids: Identity of each row
+            vectors: Normalized features, shape (len(ids), dim)
+        """
+        super().build(ids, vectors)
+        if not self._size:
+            self.centroids = np.zeros((0, 0), dtype=np.float32)
+            self._assign_all()
+            return
+
+        nlist = self.nlist or int(4 * np.sqrt(self._size))
+        self.centroids = self._train(self.matrix, max(1, min(nlist, self._size)))
+        self._assign_all()
+        logger.info(f"Built IVF index over {self._size} faces with {len(self.centroids)} lists")
+
+    def add(self, face_id: str, vector: np.ndarray) -> int:
+        """
+        Add or replace a single entry in its closest cluster.
+
+        Args:
+            face_id: Identity of the entry
+            vector: Normalized feature vector
+
+        Returns:
+            Row of the entry in the matrix
+        """
+        if not len(self.centroids):
+            # Nothing to cluster against yet, the entry becomes the first centroid
+            self.centroids = vector[np.newaxis, :].astype(np.float32)
+            self._lists = [[]]
+            self._list_arrays = [None]
+
+        existing = self._index.get(face_id)
+        if existing is not None:
+            self._unlink(existing)
+
+        row = super().add(face_id, vector)
+        if len(self._assignments) < self._matrix.shape[0]:
+            assignments = np.zeros(self._matrix.shape[0], dtype=np.int32)
+            assignments[:len(self._assignments)] = self._assignments
+            self._assignments = assignments
+
+        self._link(row, int(np.argmax(self.centroids @ vector)))
+        return row
+
+    def remove(self, face_id: str) -> Optional[Tuple[int, int]]:
+        """
+        Remove a single entry.
+
+        Args:
+            face_id: Identity of the entry
+
+        Returns:
+            (removed_row, moved_from_row) describing how rows were compacted,
+            or None if the entry did not exist
+        """
+        row = self._index.get(face_id)
+        if row is None:
+            return None
+
+        self._unlink(row)
+        last = self._size - 1
+        if row != last:
+            # The last row is about to move into the hole
+            moved_list = int(self._assignments[last])
+            self._unlink(last)
+            self._link(row, moved_list)
+
+        return super().remove(face_id)
+
+    def search(self, queries: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Find the closest entry for each query among its nprobe closest clusters.
+
+        Args:
+            queries: Normalized features, shape (num_queries, dim)
+
+        Returns:
+            List of (face_id, similarity) tuples
+        """
+        if not self._size:
+            return [(None, 0.0)] * len(queries)
+
+        nprobe = min(self.nprobe, len(self.centroids))
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+
+        matrix = self.matrix
+        matches = []
+        for query, query_probes in zip(queries, probes):
+            candidates = [self._list_array(list_no) for list_no in query_probes]
+            candidates = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+            if not len(candidates):
+                matches.append((None, 0.0))
+                continue
+
+            similarities = matrix[candidates] @ query
+            best = int(np.argmax(similarities))
+            matches.append((self.ids[candidates[best]], float(similarities[best])))
+
+        return matches
+
+    def _train(self, vectors: np.ndarray, nlist: int) -> np.ndarray:
+        """
+        Train cluster centroids with spherical k-means.
+
+        Args:
+            vectors: Normalized features
+            nlist: Number of clusters
+
+        Returns:
+            Normalized centroids, shape (nlist, dim)
+        """
+        rng = np.random.default_rng(self.seed)
+
+        # A few hundred points per cluster are plenty to place the centroids
+        sample_size = min(len(vectors), nlist * 256)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+
+            # Re-seed empty clusters with random points
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.maximum(norms, 1e-12)
+
+        return centroids.astype(np.float32)
+
+    def _assign_all(self):
+        """Assign every row to its closest centroid and rebuild the lists."""
+        self._assignments = np.zeros(self._matrix.shape[0], dtype=np.int32)
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._list_arrays = [None] * len(self.centroids)
+
+        # Assign in chunks to bound the size of the score matrix
+        for start in range(0, self._size, 65536):
+            chunk = self.matrix[start:start + 65536]
+            self._assignments[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+
+        for row in range(self._size):
+            self._lists[self._assignments[row]].append(row)
+
+    def _link(self, row: int, list_no: int):
+        """Put a row into an inverted list."""
+        self._assignments[row] = list_no
+        self._lists[list_no].append(row)
+        self._list_arrays[list_no] = None
+
+    def _unlink(self, row: int):
+        """Take a row out of its inverted list."""
+        list_no = int(self._assignments[row])
+        self._lists[list_no].remove(row)
+        self._list_arrays[list_no] = None
+
+    def _list_array(self, list_no: int) -> np.ndarray:
+        """Rows of an inverted list as an array, cached until the list changes."""
+        rows = self._list_arrays[list_no]
+        if rows is None:
+            rows = np.asarray(self._lists[list_no], dtype=np.int64)
+            self._list_arrays[list_no] = rows
+        return rows
+
+    def _state(self) -> Dict[str, np.ndarray]:
+        """Arrays needed to restore the index."""
+        state = super()._state()
+        state.update({
+            "centroids": self.centroids,
+            "assignments": self._assignments[:self._size],
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+        })
+        return state
+
+    def _restore(self, state):
+        """Restore the index from arrays produced by _state()."""
+        IVFFlatMatcher.__init__(self, nlist=int(state['nlist']), nprobe=int(state['nprobe']))
+        BruteForceMatcher.build(self, state['ids'].tolist(), state['matrix'])
+        self.centroids = state['centroids']
+        self._assignments = np.array(state['assignments'], dtype=np.int32)
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._list_arrays = [None] * len(self.centroids)
+        for row in range(self._size):
+            self._lists[self._assignments[row]].append(row)
+
+
+MATCHERS = {
+    BruteForceMatcher.kind: BruteForceMatcher,
+    IVFFlatMatcher.kind: IVFFlatMatcher,
+}
+
+
+def create_matcher(gallery_size: int, kind: str = FACE_MATCHER) -> BruteForceMatcher:
+    """
+    Create the matcher to use for a gallery.
+
+    Args:
+        gallery_size: Number of known faces the matcher will hold
+        kind: Matcher name, or "auto" to use exact search for small galleries
+              and the IVF index from ANN_MIN_GALLERY_SIZE faces upwards
+
+    Returns:
+        An empty matcher
+    """
+    if kind == "auto":
+        kind = IVFFlatMatcher.kind if gallery_size >= ANN_MIN_GALLERY_SIZE else BruteForceMatcher.kind
+
+    if kind not in MATCHERS:
+        raise ValueError(f"Unknown face matcher '{kind}', expected one of: auto, {', '.join(MATCHERS)}")
+
+    return MATCHERS[kind]()
@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+from typing import Optional
+
+from prod.config import (
+    MOTION_THRESHOLD,
+    MOTION_PIXEL_THRESHOLD,
+    MOTION_BACKGROUND_ALPHA,
+    MOTION_KEYFRAME_INTERVAL,
+    MOTION_DOWNSCALE_WIDTH
+)
+
+
+class MotionGate:
+    """
+    Decides which frames of a stream are worth sending to face detection.
+
+    Each frame is downscaled, converted to grayscale and compared with a
+    running average of the previous frames; it passes when enough pixels
+    differ from that background. A frame is also let through at least
+    every keyframe_interval seconds so people standing still (and thus
+    absorbed into the background) are still seen.
+    """
+
+    def __init__(self, threshold: float = MOTION_THRESHOLD,
+                 pixel_threshold: int = MOTION_PIXEL_THRESHOLD,
+                 alpha: float = MOTION_BACKGROUND_ALPHA,
+                 keyframe_interval: float = MOTION_KEYFRAME_INTERVAL,
+                 width: int = MOTION_DOWNSCALE_WIDTH):
+        """
+        Initialize the gate.
+
+        Args:
+            threshold: Fraction of changed pixels from which a frame passes
+            pixel_threshold: Gray level difference from which a pixel counts as changed
+            alpha: Weight of each new frame in the running background
+            keyframe_interval: Maximum seconds between frames let through
+            width: Width frames are downscaled to before comparison
+        """
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.alpha = alpha
+        self.keyframe_interval = keyframe_interval
+        self.width = width
+        self.background: Optional[np.ndarray] = None
+        self.last_passed = float('-inf')
+        self.changed_fraction = 0.0
+
+    def check(self, frame: np.ndarray, now: float) -> bool:
+        """
+        Update the background with a frame and decide whether it passes.
+
+        Args:
+            frame: BGR frame
+            now: Current monotonic time in seconds
+
+        Returns:
+            True if the frame should be sent to face detection
+        """
+        height, width = frame.shape[:2]
+        small_size = (self.width, max(1, round(height * self.width / width)))
+        small = cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        if self.background is None or self.background.shape != small.shape:
+            # First frame, or the stream resolution changed
+            self.background = small.astype(np.float32)
+            self.last_passed = now
+            return True
+
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        self.changed_fraction = np.count_nonzero(diff > self.pixel_threshold) / diff.size
+        cv2.accumulateWeighted(small, self.background, self.alpha)
+
+        if self.changed_fraction >= self.threshold or now - self.last_passed >= self.keyframe_interval:
+            self.last_passed = now
+            return True
+        return False
@@ -0,0 +1,131 @@
+import heapq
+import itertools
+import cv2
+import numpy as np
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from prod.config import (
+    MIN_FACE_WIDTH,
+    QUALITY_BEST_N,
+    QUALITY_WINDOW,
+    QUALITY_SHARPNESS_SCALE,
+    QUALITY_FRONTAL_ASPECT
+)
+
+# Side of the square faces are resized to before measuring sharpness, so
+# scores of large and small faces are comparable
+SHARPNESS_SIZE = 64
+
+
+def face_quality(face_img: np.ndarray, width: int, confidence: float,
+                 min_width: int = MIN_FACE_WIDTH) -> float:
+    """
+    Score how well a face crop lends itself to recognition, from 0 to 1.
+
+    The score is the product of four factors, each from 0 to 1:
+    sharpness (variance of the Laplacian, low for motion blur and defocus),
+    size (full from twice the minimum face width), aspect ratio (faces
+    turned into profile get narrow) and the detector confidence.
+
+    Args:
+        face_img: BGR face crop, at any resolution
+        width: Width of the face in the full-resolution frame
+        confidence: Detector confidence
+        min_width: Minimum width of a detected face
+
+    Returns:
+        Quality score
+    """
+    height, crop_width = face_img.shape[:2]
+    if not height or not crop_width:
+        return 0.0
+
+    gray = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.resize(gray, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    variance = cv2.Laplacian(gray, cv2.CV_64F).var()
+    sharpness = variance / (variance + QUALITY_SHARPNESS_SCALE)
+
+    size = min(1.0, width / (2 * max(min_width, 1)))
+
+    aspect = crop_width / height
+    aspect = min(aspect / QUALITY_FRONTAL_ASPECT, QUALITY_FRONTAL_ASPECT / aspect)
+
+    return float(sharpness * size * aspect * confidence)
+
+
+class BestFaceSelector:
+    """
+    Keeps the best faces seen in a short window.
+
+    A window is opened per key (a face track) when a face of it is due for
+    recognition; for the next `window` seconds the faces of the key are
+    offered and only the best_n by quality are kept. Once the window has
+    passed, flush returns them to be sent to recognition.
+    """
+
+    def __init__(self, best_n: int = QUALITY_BEST_N, window: float = QUALITY_WINDOW):
+        """
+        Initialize the selector.
+
+        Args:
+            best_n: Faces kept per window
+            window: Seconds a window stays open
+        """
+        self.best_n = max(1, best_n)
+        self.window = window
+        # key -> (deadline, min-heap of (quality, sequence, item))
+        self.windows: Dict[Hashable, Tuple[float, List[Tuple[float, int, Any]]]] = {}
+        self._sequence = itertools.count()
+
+    def open(self, key: Hashable, now: float):
+        """Open a window for a key, unless one is already open."""
+        if key not in self.windows:
+            self.windows[key] = (now + self.window, [])
+
+    def accepts(self, key: Hashable, quality: float) -> bool:
+        """Whether a face of the given quality would be kept right now."""
+        window = self.windows.get(key)
+        if window is None:
+            return False
+        candidates = window[1]
+        return len(candidates) < self.best_n or quality > candidates[0][0]
+
+    def offer(self, key: Hashable, quality: float, item: Any) -> Optional[Any]:
+        """
+        Offer a face to the window of its key.
+
+        Args:
+            key: Window key
+            quality: Quality score of the face
+            item: Face to keep
+
+        Returns:
+            The face that is not kept, the offered one or one it displaced,
+            or None
+        """
+        if not self.accepts(key, quality):
+            return item
+
+        candidates = self.windows[key][1]
+        entry = (quality, next(self._sequence), item)
+        if len(candidates) < self.best_n:
+            heapq.heappush(candidates, entry)
+            return None
+        return heapq.heapreplace(candidates, entry)[2]
+
+    def flush(self, now: float) -> List[Any]:
+        """
+        Close the windows that have passed.
+
+        Args:
+            now: Current time, float('inf') to close every window
+
+        Returns:
+            The faces kept by the closed windows, best first
+        """
+        selected = []
+        for key, (deadline, candidates) in list(self.windows.items()):
+            if deadline <= now:
+                del self.windows[key]
+                selected.extend(item for _, _, item in sorted(candidates, reverse=True))
+        return selected
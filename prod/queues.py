@@ -0,0 +1,878 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import collections
+import redis
+import numpy as np
+from typing import Dict, Any, Optional, List, Tuple, Iterable
+
+from prod.config import (
+    FRAMES_QUEUE,
+    FACES_QUEUE,
+    RECOGNITION_QUEUE,
+    PIPELINE_STATS,
+    FRAMES_STREAMS,
+    QUEUE_BACKEND,
+    STREAM_MAXLEN,
+    STREAM_CLAIM_IDLE_MS,
+    STREAM_CLAIM_INTERVAL,
+    INPROCESS_QUEUE_SIZE,
+    INPROCESS_PUT_TIMEOUT,
+    FRAMES_QUEUE_MAXLEN,
+    FACES_QUEUE_MAXLEN,
+    PER_STREAM_QUEUES,
+    STREAM_PRIORITIES,
+    STREAM_DISCOVERY_INTERVAL
+)
+from prod.utils import (
+    get_redis_connection,
+    encode_message,
+    decode_message,
+    encode_image,
+    decode_image,
+    peek_timestamp,
+    frame_codec,
+    face_codec
+)
+
+logger = logging.getLogger('queues')
+
+# A queued message: transport-specific id (None when there is nothing to
+# acknowledge) and the item
+Message = Tuple[Optional[bytes], Any]
+
+
+class FrameSerializer:
+    """Converts (frame, metadata) items to and from envelope bytes."""
+
+    codec = frame_codec
+
+    def dumps(self, item: Tuple[Optional[np.ndarray], Dict[str, Any]]) -> bytes:
+        image, metadata = item
+        if image is None:
+            # Descriptor of a frame held in shared memory or the frame store, no payload
+            return encode_message(metadata, b'')
+        return encode_message(metadata, encode_image(image, self.codec), self.codec.codec_id)
+
+    def loads(self, data: bytes) -> Tuple[Optional[np.ndarray], Dict[str, Any]]:
+        metadata, image_bytes, codec_id = decode_message(data)
+        if not len(image_bytes) and ("shm_name" in metadata or "frame_key" in metadata):
+            return None, metadata
+        image = decode_image(image_bytes, codec_id)
+        if image is None:
+            raise ValueError("Failed to decode image")
+        return image, metadata
+
+    def timestamp(self, data: bytes) -> Optional[float]:
+        """Capture timestamp of a message, read from the envelope header only."""
+        return peek_timestamp(data)
+
+
+class FaceSerializer(FrameSerializer):
+    """Converts (face_image, metadata) items, bbox included in the metadata."""
+
+    codec = face_codec
+
+
+class ResultSerializer:
+    """Converts recognition result dicts to and from JSON."""
+
+    def dumps(self, item: Dict[str, Any]) -> bytes:
+        return json.dumps(item).encode('utf-8')
+
+    def loads(self, data: bytes) -> Dict[str, Any]:
+        return json.loads(data.decode('utf-8'))
+
+    def timestamp(self, data: bytes) -> Optional[float]:
+        return self.loads(data).get("timestamp")
+
+
+SERIALIZERS = {
+    FRAMES_QUEUE: FrameSerializer(),
+    FACES_QUEUE: FaceSerializer(),
+    RECOGNITION_QUEUE: ResultSerializer(),
+}
+
+# Queues that shed their oldest items beyond a maximum length (0 for no limit)
+QUEUE_MAXLEN = {
+    FRAMES_QUEUE: FRAMES_QUEUE_MAXLEN,
+    FACES_QUEUE: FACES_QUEUE_MAXLEN,
+}
+
+
+class RedisListQueue:
+    """
+    Queue backed by a plain Redis list (RPUSH / BLPOP).
+
+    Messages are removed as soon as they are read, so acknowledging is a
+    no-op and work in flight is lost if a worker dies. When a maximum
+    length is set, the oldest messages are trimmed off (LTRIM) and counted
+    in the PIPELINE_STATS hash.
+    """
+
+    def __init__(self, redis_client: redis.Redis, name: str, serializer=None, maxlen: int = 0):
+        """
+        Initialize the queue.
+
+        Args:
+            redis_client: Redis connection
+            name: Redis key of the list
+            serializer: Converts items to and from bytes, None for raw bytes
+            maxlen: Maximum number of queued messages, 0 for no limit
+        """
+        self.redis_client = redis_client
+        self.name = name
+        self.serializer = serializer
+        self.maxlen = maxlen
+        self.dropped = 0
+        self.expired = 0
+        # Expired messages per reading thread, see take_expired
+        self.local = threading.local()
+
+    def put(self, item: Any):
+        """Append an item to the queue."""
+        self.put_many([item])
+
+    def put_many(self, items: Iterable[Any]):
+        """Append several items in a single round trip."""
+        items = [self._dumps(item) for item in items]
+        if not items:
+            return
+
+        if not self.maxlen:
+            self.redis_client.rpush(self.name, *items)
+            return
+
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpush(self.name, *items)
+        pipe.ltrim(self.name, -self.maxlen, -1)
+        length, _ = pipe.execute()
+        self._count_dropped(length - self.maxlen)
+
+    def _count_dropped(self, count: int):
+        """Record messages dropped to keep the queue within its maximum length."""
+        if count <= 0:
+            return
+        self.dropped += count
+        self.redis_client.hincrby(PIPELINE_STATS, f"{self.name}:dropped", count)
+        logger.debug(f"Dropped {count} oldest messages from {self.name}")
+
+    def _count_expired(self, count: int):
+        """Record messages discarded for being older than the reader's max age."""
+        if count <= 0:
+            return
+        self.expired += count
+        self.local.expired = getattr(self.local, "expired", 0) + count
+        self.redis_client.hincrby(PIPELINE_STATS, f"{self.name}:expired", count)
+        logger.debug(f"Discarded {count} expired messages from {self.name}")
+
+    def get_batch(self, max_items: int, max_wait: float, timeout: int = 1,
+                  max_age: Optional[float] = None) -> List[Message]:
+        """
+        Read up to max_items items.
+
+        Blocks for up to timeout seconds waiting for the first item, then
+        keeps draining the queue until the batch is full or max_wait seconds
+        have passed. Items captured more than max_age seconds ago are
+        discarded without being decoded.
+        """
+        queue_item = self.redis_client.blpop(self.name, timeout=timeout)
+        if not queue_item:
+            return []
+
+        batch = [queue_item[1]]
+        deadline = time.monotonic() + max_wait
+
+        while len(batch) < max_items:
+            # LPOP with a count drains several items in a single round trip
+            items = self.redis_client.lpop(self.name, max_items - len(batch))
+            if items:
+                batch.extend(items)
+                continue
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.005))
+
+        return self._loads_batch([(None, data) for data in batch], max_age)
+
+    def poll(self, max_items: int, max_age: Optional[float] = None) -> List[Message]:
+        """Read up to max_items items that are already queued, without blocking."""
+        items = self.redis_client.lpop(self.name, max_items)
+        return self._loads_batch([(None, data) for data in items or []], max_age)
+
+    @staticmethod
+    def wait_any(queues: List["RedisListQueue"], timeout: int,
+                 max_age: Optional[float] = None) -> List[Tuple["RedisListQueue", Message]]:
+        """
+        Wait for an item on any of several queues.
+
+        Returns:
+            (queue, message) pairs read, empty on timeout
+        """
+        by_name = {queue.name: queue for queue in queues}
+        queue_item = queues[0].redis_client.blpop(list(by_name), timeout=timeout)
+        if not queue_item:
+            return []
+        queue = by_name[_key_name(queue_item[0])]
+        return [(queue, message) for message in queue._loads_batch([(None, queue_item[1])], max_age)]
+
+    def take_expired(self) -> int:
+        """Messages discarded for their age by this thread's reads since its last call."""
+        count = getattr(self.local, "expired", 0)
+        self.local.expired = 0
+        return count
+
+    def ack(self, message_ids: List[Optional[bytes]]):
+        """Acknowledge processed messages (nothing to do for lists)."""
+
+    def depth(self) -> int:
+        """Number of messages waiting in the queue."""
+        return self.redis_client.llen(self.name)
+
+    def _dumps(self, item: Any) -> bytes:
+        """Serialize an item for Redis."""
+        return self.serializer.dumps(item) if self.serializer else item
+
+    def _loads_batch(self, batch: List[Tuple[Optional[bytes], bytes]],
+                     max_age: Optional[float] = None) -> List[Message]:
+        """
+        Deserialize a batch read from Redis.
+
+        Messages older than max_age are acknowledged and discarded before
+        decoding; messages that cannot be decoded are logged, acknowledged
+        and dropped.
+        """
+        if not self.serializer:
+            return batch
+
+        if max_age:
+            batch = self._discard_expired(batch, max_age)
+
+        items = []
+        dropped = []
+        for message_id, data in batch:
+            try:
+                items.append((message_id, self.serializer.loads(data)))
+            except Exception as e:
+                logger.warning(f"Dropped undecodable message from {self.name}: {str(e)}")
+                dropped.append(message_id)
+
+        self.ack(dropped)
+        return items
+
+    def _discard_expired(self, batch: List[Tuple[Optional[bytes], bytes]],
+                         max_age: float) -> List[Tuple[Optional[bytes], bytes]]:
+        """
+        Remove messages captured more than max_age seconds ago from a batch.
+
+        Returns:
+            The messages still fresh enough to process
+        """
+        now = time.time()
+        fresh = []
+        expired = []
+        for message_id, data in batch:
+            try:
+                timestamp = self.serializer.timestamp(data)
+            except Exception:
+                # Left for _loads_batch to report
+                timestamp = None
+            if timestamp is not None and now - timestamp > max_age:
+                expired.append(message_id)
+            else:
+                fresh.append((message_id, data))
+
+        if expired:
+            self.ack(expired)
+            self._count_expired(len(expired))
+        return fresh
+
+
+class RedisStreamQueue(RedisListQueue):
+    """
+    Queue backed by a Redis stream read through a consumer group.
+
+    Every worker reads with its own consumer name, so messages a worker
+    has read but not acknowledged stay pending and are reclaimed by another
+    worker once they have been idle for STREAM_CLAIM_IDLE_MS. The stream is
+    capped at roughly maxlen entries; trimmed entries are not counted as
+    dropped, since most of them have usually been read already.
+    """
+
+    FIELD = b'd'
+
+    def __init__(self, redis_client: redis.Redis, name: str, serializer=None,
+                 group: Optional[str] = None, consumer: Optional[str] = None,
+                 maxlen: int = STREAM_MAXLEN,
+                 claim_idle_ms: int = STREAM_CLAIM_IDLE_MS,
+                 claim_interval: float = STREAM_CLAIM_INTERVAL):
+        """
+        Initialize the queue.
+
+        Args:
+            redis_client: Redis connection
+            name: Redis key of the stream
+            serializer: Converts items to and from bytes, None for raw bytes
+            group: Consumer group of the reading stage (readers only)
+            consumer: Unique consumer name within the group (readers only)
+            maxlen: Approximate maximum number of entries kept in the stream
+            claim_idle_ms: Idle time after which pending entries are reclaimed
+            claim_interval: Seconds between checks for stale pending entries
+        """
+        super().__init__(redis_client, name, serializer, maxlen)
+        self.group = group
+        self.consumer = consumer
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_interval = claim_interval
+        self.last_claim = 0.0
+
+        if group:
+            self._ensure_group()
+
+    def _ensure_group(self):
+        """Create the consumer group (and the stream) if needed."""
+        try:
+            self.redis_client.xgroup_create(self.name, self.group, id='0', mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {self.name}")
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def put(self, item: Any):
+        """Append an item to the stream."""
+        self.redis_client.xadd(self.name, {self.FIELD: self._dumps(item)}, maxlen=self.maxlen, approximate=True)
+
+    def put_many(self, items: Iterable[Any]):
+        """Append several items in a single round trip."""
+        pipe = self.redis_client.pipeline(transaction=False)
+        for item in items:
+            pipe.xadd(self.name, {self.FIELD: self._dumps(item)}, maxlen=self.maxlen, approximate=True)
+        pipe.execute()
+
+    def get_batch(self, max_items: int, max_wait: float, timeout: int = 1,
+                  max_age: Optional[float] = None) -> List[Message]:
+        """
+        Read up to max_items items for this consumer.
+
+        Stale pending entries of dead consumers are reclaimed first. Then
+        blocks for up to timeout seconds waiting for new messages, and keeps
+        reading until the batch is full or max_wait seconds have passed.
+        Items captured more than max_age seconds ago are acknowledged and
+        discarded without being decoded.
+        """
+        batch = self._claim_stale(max_items)
+        deadline = None
+
+        while len(batch) < max_items:
+            if not batch:
+                block_ms = int(timeout * 1000)
+            else:
+                if deadline is None:
+                    deadline = time.monotonic() + max_wait
+                block_ms = int((deadline - time.monotonic()) * 1000)
+                if block_ms <= 0:
+                    break
+
+            response = self.redis_client.xreadgroup(
+                self.group,
+                self.consumer,
+                {self.name: '>'},
+                count=max_items - len(batch),
+                block=block_ms
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                break
+            batch.extend((message_id, fields[self.FIELD]) for message_id, fields in entries)
+
+        return self._loads_batch(batch, max_age)
+
+    def poll(self, max_items: int, max_age: Optional[float] = None) -> List[Message]:
+        """Read up to max_items items for this consumer, without blocking."""
+        batch = self._claim_stale(max_items)
+        if len(batch) < max_items:
+            response = self.redis_client.xreadgroup(
+                self.group,
+                self.consumer,
+                {self.name: '>'},
+                count=max_items - len(batch)
+            )
+            entries = response[0][1] if response else []
+            batch.extend((message_id, fields[self.FIELD]) for message_id, fields in entries)
+        return self._loads_batch(batch, max_age)
+
+    @staticmethod
+    def wait_any(queues: List["RedisStreamQueue"], timeout: int,
+                 max_age: Optional[float] = None) -> List[Tuple["RedisStreamQueue", Message]]:
+        """
+        Wait for new messages on any of several streams read by the same
+        consumer group.
+
+        Returns:
+            (queue, message) pairs read, empty on timeout
+        """
+        by_name = {queue.name: queue for queue in queues}
+        first = queues[0]
+        response = first.redis_client.xreadgroup(
+            first.group,
+            first.consumer,
+            {name: '>' for name in by_name},
+            count=1,
+            block=int(timeout * 1000)
+        )
+
+        received = []
+        for stream_name, entries in response or []:
+            queue = by_name[_key_name(stream_name)]
+            batch = [(message_id, fields[queue.FIELD]) for message_id, fields in entries]
+            received.extend((queue, message) for message in queue._loads_batch(batch, max_age))
+        return received
+
+    def _claim_stale(self, max_items: int) -> List[Tuple[bytes, bytes]]:
+        """
+        Take over entries left pending by consumers that stopped responding.
+
+        Args:
+            max_items: Maximum number of entries to claim
+
+        Returns:
+            Claimed (message_id, data) pairs
+        """
+        now = time.monotonic()
+        if now - self.last_claim < self.claim_interval:
+            return []
+        self.last_claim = now
+
+        response = self.redis_client.xautoclaim(
+            self.name,
+            self.group,
+            self.consumer,
+            min_idle_time=self.claim_idle_ms,
+            start_id='0-0',
+            count=max_items
+        )
+        claimed = [(message_id, fields[self.FIELD]) for message_id, fields in response[1] if fields]
+        if claimed:
+            logger.warning(f"{self.consumer} reclaimed {len(claimed)} stale messages from {self.name}")
+        return claimed
+
+    def ack(self, message_ids: List[Optional[bytes]]):
+        """Acknowledge processed messages in bulk."""
+        message_ids = [message_id for message_id in message_ids if message_id is not None]
+        if message_ids:
+            self.redis_client.xack(self.name, self.group, *message_ids)
+
+    def depth(self) -> int:
+        """Number of messages the consumer group has not read yet."""
+        if self.group:
+            try:
+                for group in self.redis_client.xinfo_groups(self.name):
+                    if group['name'].decode('utf-8') == self.group and group.get('lag') is not None:
+                        return int(group['lag'])
+            except redis.ResponseError:
+                return 0
+        return self.redis_client.xlen(self.name)
+
+
+class InProcessQueue:
+    """
+    Bounded queue shared by the threads of a single process.
+
+    Items are passed by reference, so frames and crops are never encoded
+    or copied. While the queue is full, producers either block for up to
+    put_timeout seconds, then drop their item, or, with drop_oldest, push
+    the oldest item out.
+    """
+
+    def __init__(self, name: str, maxsize: int = INPROCESS_QUEUE_SIZE, drop_oldest: bool = False,
+                 put_timeout: float = INPROCESS_PUT_TIMEOUT):
+        """
+        Initialize the queue.
+
+        Args:
+            name: Queue name
+            maxsize: Maximum number of queued items
+            drop_oldest: Drop the oldest item instead of blocking when full
+            put_timeout: Seconds to block on a full queue before dropping
+                the new item, 0 to block until there is room
+        """
+        self.name = name
+        self.maxsize = maxsize
+        self.drop_oldest = drop_oldest
+        self.put_timeout = put_timeout or None
+        self.dropped = 0
+        self.expired = 0
+        # Expired items per reading thread: the queue is shared by all workers
+        self.local = threading.local()
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+
+    def put(self, item: Any):
+        """
+        Append an item, waiting while the queue is full unless dropping the oldest.
+
+        If the queue is still full after put_timeout seconds, e.g. because
+        its reader stopped, the item is dropped and counted like the items
+        pushed out with drop_oldest, so the producer does not hang.
+        """
+        with self.condition:
+            if self.drop_oldest:
+                while len(self.items) >= self.maxsize:
+                    self.items.popleft()
+                    self.dropped += 1
+            elif not self.condition.wait_for(lambda: len(self.items) < self.maxsize, self.put_timeout):
+                self.dropped += 1
+                logger.warning(f"Dropped an item put on {self.name}, still full after {self.put_timeout:g}s")
+                return
+            self.items.append(item)
+            self.condition.notify_all()
+
+    def put_many(self, items: Iterable[Any]):
+        """Append several items."""
+        for item in items:
+            self.put(item)
+
+    def get_batch(self, max_items: int, max_wait: float, timeout: int = 1,
+                  max_age: Optional[float] = None) -> List[Message]:
+        """
+        Take up to max_items items.
+
+        Blocks for up to timeout seconds waiting for the first item, then
+        keeps waiting until the batch is full or max_wait seconds have passed.
+        Items captured more than max_age seconds ago are discarded.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.items, timeout):
+                return []
+
+            deadline = time.monotonic() + max_wait
+            batch = []
+            while len(batch) < max_items:
+                while self.items and len(batch) < max_items:
+                    batch.append((None, self.items.popleft()))
+                self.condition.notify_all()
+
+                remaining = deadline - time.monotonic()
+                if len(batch) >= max_items or remaining <= 0:
+                    break
+                self.condition.wait_for(lambda: self.items, remaining)
+
+            if max_age:
+                now = time.time()
+                fresh = [message for message in batch if now - _item_timestamp(message[1], now) <= max_age]
+                self.expired += len(batch) - len(fresh)
+                self.local.expired = getattr(self.local, "expired", 0) + len(batch) - len(fresh)
+                batch = fresh
+            return batch
+
+    def poll(self, max_items: int, max_age: Optional[float] = None) -> List[Message]:
+        """Take up to max_items items that are already queued, without blocking."""
+        return self.get_batch(max_items, 0, timeout=0, max_age=max_age)
+
+    @staticmethod
+    def wait_any(queues: List["InProcessQueue"], timeout: int,
+                 max_age: Optional[float] = None) -> List[Tuple["InProcessQueue", Message]]:
+        """
+        Wait for an item on any of several queues.
+
+        Returns:
+            (queue, message) pairs taken, empty on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            for queue in queues:
+                messages = queue.poll(1, max_age)
+                if messages:
+                    return [(queue, messages[0])]
+            if time.monotonic() >= deadline:
+                return []
+            time.sleep(0.005)
+
+    def take_expired(self) -> int:
+        """Items discarded for their age by this thread's reads since its last call."""
+        count = getattr(self.local, "expired", 0)
+        self.local.expired = 0
+        return count
+
+    def ack(self, message_ids: List[Optional[bytes]]):
+        """Acknowledge processed messages (nothing to do in process)."""
+
+    def depth(self) -> int:
+        """Number of items waiting in the queue."""
+        return len(self.items)
+
+
+class FairQueue:
+    """
+    Reads the per-stream frames queues fairly, by weighted deficit round robin.
+
+    Every round each stream earns its weight in credit and may contribute
+    as many frames to the batch as it has whole credits, so a busy camera
+    cannot starve the quiet ones and a camera with weight 3 gets three times
+    the detector share of a camera with weight 1. Streams whose queue is
+    empty do not bank credit. New streams are discovered through the
+    FRAMES_STREAMS set (or the in-process queue registry).
+    """
+
+    def __init__(self, name: str, weights: Optional[Dict[str, float]] = None,
+                 group: Optional[str] = None, consumer: Optional[str] = None,
+                 redis_client: Optional[redis.Redis] = None, backend: str = QUEUE_BACKEND,
+                 discovery_interval: float = STREAM_DISCOVERY_INTERVAL):
+        """
+        Initialize the queue.
+
+        Args:
+            name: Base name of the per-stream queues
+            weights: Share of each stream id, 1 for streams not listed
+            group: Consumer group of the reading stage
+            consumer: Unique consumer name within the group
+            redis_client: Redis connection to use, a new one by default
+            backend: "list", "stream" or "inprocess"
+            discovery_interval: Seconds between checks for new streams
+        """
+        self.name = name
+        self.weights = weights if weights is not None else parse_priorities(STREAM_PRIORITIES)
+        self.group = group
+        self.consumer = consumer
+        self.backend = backend
+        self.redis_client = None if backend == "inprocess" else (redis_client or get_redis_connection())
+        self.discovery_interval = discovery_interval
+        self.last_discovery = float('-inf')
+        self.queues: Dict[str, Any] = {}
+        self.deficits: Dict[str, float] = {}
+        self.position = 0
+
+    @property
+    def expired(self) -> int:
+        """Messages discarded for their age across all streams."""
+        return sum(queue.expired for queue in self.queues.values())
+
+    def take_expired(self) -> int:
+        """Messages discarded for their age by this thread's reads since its last call."""
+        return sum(queue.take_expired() for queue in self.queues.values())
+
+    def get_batch(self, max_items: int, max_wait: float, timeout: int = 1,
+                  max_age: Optional[float] = None) -> List[Message]:
+        """
+        Read up to max_items items across the streams.
+
+        Blocks for up to timeout seconds waiting for the first item, then
+        keeps filling the batch fairly until it is full or max_wait seconds
+        have passed. Message ids are (stream_id, message_id) pairs.
+        """
+        self._discover()
+        if not self.queues:
+            time.sleep(timeout)
+            return []
+
+        batch = self._fill(max_items, max_age)
+        if not batch:
+            queues = list(self.queues.values())
+            received = type(queues[0]).wait_any(queues, timeout, max_age)
+            stream_ids = {id(queue): stream_id for stream_id, queue in self.queues.items()}
+            for queue, (message_id, item) in received:
+                stream_id = stream_ids[id(queue)]
+                self.deficits[stream_id] -= 1
+                batch.append(((stream_id, message_id), item))
+            if not batch:
+                return []
+
+        deadline = time.monotonic() + max_wait
+        while len(batch) < max_items:
+            batch.extend(self._fill(max_items - len(batch), max_age))
+            remaining = deadline - time.monotonic()
+            if len(batch) >= max_items or remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.005))
+
+        return batch
+
+    def _fill(self, max_items: int, max_age: Optional[float]) -> List[Message]:
+        """
+        Take up to max_items already queued items in deficit round robin order.
+        """
+        batch = []
+        stream_ids = sorted(self.queues)
+
+        while len(batch) < max_items:
+            progressed = False
+            for offset in range(len(stream_ids)):
+                index = (self.position + offset) % len(stream_ids)
+                stream_id = stream_ids[index]
+                self.deficits[stream_id] += self.weights.get(stream_id, 1.0)
+
+                count = min(int(self.deficits[stream_id]), max_items - len(batch))
+                if count <= 0:
+                    continue
+
+                messages = self.queues[stream_id].poll(count, max_age)
+                if not messages:
+                    self.deficits[stream_id] = 0.0
+                    continue
+
+                self.deficits[stream_id] -= len(messages)
+                batch.extend(((stream_id, message_id), item) for message_id, item in messages)
+                progressed = True
+
+                if len(batch) >= max_items:
+                    # Resume with the next stream on the following call
+                    self.position = (index + 1) % len(stream_ids)
+                    return batch
+
+            if not progressed:
+                break
+
+        return batch
+
+    def _discover(self):
+        """Open the queues of streams that appeared since the last check."""
+        now = time.monotonic()
+        if now - self.last_discovery < self.discovery_interval:
+            return
+        self.last_discovery = now
+
+        for stream_id in stream_queue_ids(self.name, self.redis_client, self.backend):
+            if stream_id in self.queues:
+                continue
+            self.queues[stream_id] = get_queue(
+                stream_queue_name(self.name, stream_id),
+                group=self.group,
+                consumer=self.consumer,
+                redis_client=self.redis_client,
+                backend=self.backend
+            )
+            self.deficits[stream_id] = 0.0
+            logger.info(f"Reading {self.name} of {stream_id} with weight {self.weights.get(stream_id, 1.0):g}")
+
+    def put(self, item: Any):
+        """Producers write to the stream's own queue, see frames_queue_name."""
+        raise TypeError("FairQueue is read-only, put frames on the stream's own queue")
+
+    def ack(self, message_ids: List[Tuple[str, Optional[bytes]]]):
+        """Acknowledge processed messages, grouped by stream."""
+        by_stream: Dict[str, List[Optional[bytes]]] = collections.defaultdict(list)
+        for stream_id, message_id in message_ids:
+            by_stream[stream_id].append(message_id)
+        for stream_id, ids in by_stream.items():
+            self.queues[stream_id].ack(ids)
+
+    def depth(self) -> int:
+        """Number of messages waiting across all streams."""
+        self._discover()
+        return sum(queue.depth() for queue in self.queues.values())
+
+
+def parse_priorities(spec: str) -> Dict[str, float]:
+    """
+    Parse stream priorities of the form "stream_0=3,stream_2=2".
+
+    Returns:
+        Weight per stream id
+    """
+    weights = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        stream_id, _, weight = entry.partition('=')
+        try:
+            weights[stream_id.strip()] = max(0.01, float(weight))
+        except ValueError:
+            logger.warning(f"Ignoring invalid stream priority '{entry}'")
+    return weights
+
+
+def stream_queue_name(name: str, stream_id: str) -> str:
+    """Name of a stream's own queue."""
+    return f"{name}:{stream_id}"
+
+
+def frames_queue_name(stream_id: str, per_stream: bool = PER_STREAM_QUEUES) -> str:
+    """Name of the queue a stream's frames are put on."""
+    return stream_queue_name(FRAMES_QUEUE, stream_id) if per_stream else FRAMES_QUEUE
+
+
+def stream_queue_ids(name: str, redis_client: Optional[redis.Redis], backend: str) -> List[str]:
+    """Stream ids that have their own queue under a base name."""
+    prefix = f"{name}:"
+    if backend == "inprocess":
+        with _inprocess_lock:
+            return [queue_name[len(prefix):] for queue_name in _inprocess_queues if queue_name.startswith(prefix)]
+    return [_key_name(stream_id) for stream_id in redis_client.smembers(FRAMES_STREAMS)]
+
+
+def _key_name(key: Any) -> str:
+    """Redis key as a string."""
+    return key.decode('utf-8') if isinstance(key, bytes) else key
+
+
+def _item_timestamp(item: Any, default: float) -> float:
+    """Capture timestamp of an (image, metadata) tuple or a result dict."""
+    metadata = item[1] if isinstance(item, tuple) else item
+    return metadata.get("timestamp", default)
+
+
+# In-process queues are shared by name across every service of the process
+_inprocess_queues: Dict[str, InProcessQueue] = {}
+_inprocess_lock = threading.Lock()
+
+
+def consumer_name(worker_id: int) -> str:
+    """Unique consumer name for a worker of this process."""
+    return f"{socket.gethostname()}-{os.getpid()}-{worker_id}"
+
+
+def get_queue(name: str, group: Optional[str] = None, consumer: Optional[str] = None,
+              redis_client: Optional[redis.Redis] = None, backend: str = QUEUE_BACKEND,
+              per_stream: bool = PER_STREAM_QUEUES):
+    """
+    Open a pipeline queue with the configured backend.
+
+    Items are (image, metadata) tuples on the frames and faces queues and
+    result dicts on the recognition queue; the Redis backends serialize
+    them, the in-process backend passes them by reference.
+
+    With per-stream frames queues, producers open their stream's queue
+    (see frames_queue_name) and FRAMES_QUEUE opens a FairQueue over all
+    of them.
+
+    Args:
+        name: Queue name
+        group: Consumer group of the reading stage, when reading
+        consumer: Unique consumer name within the group, when reading
+        redis_client: Redis connection to use, a new one by default
+        backend: "list", "stream" or "inprocess"
+        per_stream: Whether frames are queued per stream
+
+    Returns:
+        Queue object
+    """
+    if per_stream and name == FRAMES_QUEUE:
+        return FairQueue(name, group=group, consumer=consumer, redis_client=redis_client, backend=backend)
+
+    # Per-stream queues behave like their base queue
+    base_name, _, stream_id = name.partition(':')
+
+    if backend == "inprocess":
+        with _inprocess_lock:
+            if name not in _inprocess_queues:
+                _inprocess_queues[name] = InProcessQueue(name, drop_oldest=bool(QUEUE_MAXLEN.get(base_name)))
+            return _inprocess_queues[name]
+
+    redis_client = redis_client or get_redis_connection()
+    serializer = SERIALIZERS.get(base_name)
+    maxlen = QUEUE_MAXLEN.get(base_name, 0)
+
+    if stream_id and base_name == FRAMES_QUEUE:
+        # Announce the stream's queue to the readers
+        redis_client.sadd(FRAMES_STREAMS, stream_id)
+
+    if backend == "list":
+        return RedisListQueue(redis_client, name, serializer, maxlen=maxlen)
+    if backend == "stream":
+        return RedisStreamQueue(redis_client, name, serializer, group=group, consumer=consumer,
+                                maxlen=maxlen or STREAM_MAXLEN)
+
+    raise ValueError(f"Unknown queue backend '{backend}', expected 'list', 'stream' or 'inprocess'")
@@ -14,8 +14,13 @@ from prod.config import (
     REDIS_PASSWORD,
     RECOGNITION_QUEUE,
     RESULTS_STORE,
-    DATABASE_URL
+    DATABASE_URL,
+    AGGREGATION_GROUP,
+    QUEUE_BACKEND,
+    TRACK_PENDING_TIMEOUT,
+    TRACK_IDENTITY_TTL
 )
+from prod.queues import get_queue, consumer_name
 from prod.utils import (
     get_redis_connection,
     decode_recognition_result
@@ -31,20 +36,30 @@ logger = logging.getLogger('result_aggregator')
 class ResultAggregator:
     """Aggregates face recognition results and stores them."""
     
-    def __init__(self, workers: int = 1, result_ttl: int = 3600):
+    def __init__(self, workers: int = 1, result_ttl: int = 3600,
+                 queue_backend: str = QUEUE_BACKEND):
         """
         Initialize the result aggregator.
         
         Args:
             workers: Number of worker threads to process results
             result_ttl: Time-to-live for results in seconds
+            queue_backend: Queue backend used between the pipeline stages
         """
         self.workers = workers
         self.result_ttl = result_ttl
+        self.queue_backend = queue_backend
         self.redis_client = get_redis_connection()
         self.stop_event = threading.Event()
         self.worker_threads = []
         
+        # Identity of each face track, (stream_id, track_id) -> (face_id,
+        # confidence, last seen), and the results of tracked faces still
+        # waiting for the first recognition of their track
+        self.tracks_lock = threading.Lock()
+        self.track_identities: Dict[Tuple[str, int], Tuple[str, float, float]] = {}
+        self.pending_results: Dict[Tuple[str, int], List[Tuple[float, Dict[str, Any]]]] = {}
+        
         # Register signal handlers
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
@@ -96,27 +111,44 @@ class ResultAggregator:
         """
         logger.info(f"Worker {worker_id} starting to process results")
         
+        recognition_queue = get_queue(
+            RECOGNITION_QUEUE,
+            group=AGGREGATION_GROUP,
+            consumer=consumer_name(worker_id),
+            redis_client=self.redis_client,
+            backend=self.queue_backend
+        )
+        
         while not self.stop_event.is_set():
             try:
-                # BLPOP waits for items in the queue with a timeout
-                queue_item = self.redis_client.blpop(RECOGNITION_QUEUE, timeout=1)
-                
-                if not queue_item:
-                    continue
-                
-                # Extract the result data (queue name and data)
-                _, result_data = queue_item
-                
-                # Decode the result data
-                result = json.loads(result_data.decode('utf-8'))
+                # Wait for results and read whatever is already queued
+                batch = recognition_queue.get_batch(100, 0)
                 
-                # Store result in Redis
-                self._store_result(result)
+                # Each result is handled on its own, so a bad one is logged and
+                # skipped without losing the rest of the batch
+                results = []
+                for _, result in batch:
+                    try:
+                        results.extend(self._resolve_track(result))
+                    except Exception as e:
+                        logger.error(f"Worker {worker_id} skipped malformed result: {str(e)}")
+                results.extend(self._expire_tracks())
                 
-                # Store result in database
-                self._store_in_database(result)
+                for result in results:
+                    try:
+                        # Store result in Redis
+                        self._store_result(result)
+                        
+                        # Store result in database
+                        self._store_in_database(result)
+                        
+                        logger.debug(f"Worker {worker_id} processed result for {result.get('stream_id')}")
+                    except Exception as e:
+                        logger.error(f"Worker {worker_id} failed to store result for {result.get('stream_id')}: {str(e)}")
                 
-                logger.debug(f"Worker {worker_id} processed result for {result.get('stream_id')}")
+                # Every consumed message is acknowledged, stored or skipped, so
+                # stored results are not redelivered and bad ones do not loop
+                recognition_queue.ack([message_id for message_id, _ in batch])
                 
             except Exception as e:
                 logger.error(f"Worker {worker_id} error: {str(e)}")
@@ -124,6 +156,79 @@ class ResultAggregator:
         
         logger.info(f"Worker {worker_id} stopping")
     
+    def _resolve_track(self, result: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Propagate identities along face tracks.
+        
+        Recognized faces set the identity of their track. Faces the detector
+        followed by tracking arrive without one and get their track's; if
+        the track has not been recognized yet they are held until it is, or
+        until TRACK_PENDING_TIMEOUT passes.
+        
+        Args:
+            result: Recognition result, or tracked face without face_id
+            
+        Returns:
+            Results ready to be stored
+        """
+        track_id = result.get("track_id")
+        if track_id is None:
+            return [result]
+        
+        key = (result.get("stream_id"), track_id)
+        now = time.monotonic()
+        with self.tracks_lock:
+            if "face_id" in result:
+                self.track_identities[key] = (result["face_id"], result["confidence"], now)
+                ready = [result]
+                pending = [pending_result for _, pending_result in self.pending_results.pop(key, [])]
+            elif key in self.track_identities:
+                ready = []
+                pending = [result]
+            else:
+                self.pending_results.setdefault(key, []).append((now, result))
+                return []
+            
+            face_id, confidence, _ = self.track_identities[key]
+            self.track_identities[key] = (face_id, confidence, now)
+        
+        for pending_result in pending:
+            ready.append(self._with_identity(pending_result, face_id, confidence))
+        return ready
+    
+    def _expire_tracks(self) -> List[Dict[str, Any]]:
+        """
+        Forget idle tracks and give up waiting for the identity of others.
+        
+        Returns:
+            Held results whose track was never recognized in time, as unknown
+        """
+        now = time.monotonic()
+        expired = []
+        with self.tracks_lock:
+            for key, pending in list(self.pending_results.items()):
+                if now - pending[0][0] >= TRACK_PENDING_TIMEOUT:
+                    del self.pending_results[key]
+                    expired.extend(pending_result for _, pending_result in pending)
+            
+            for key, (_, _, last_seen) in list(self.track_identities.items()):
+                if now - last_seen >= TRACK_IDENTITY_TTL:
+                    del self.track_identities[key]
+        
+        if expired:
+            logger.warning(f"No recognition arrived for {len(expired)} tracked faces "
+                           f"within {TRACK_PENDING_TIMEOUT:g}s, storing them as unknown")
+        return [self._with_identity(result, "unknown", 0.0) for result in expired]
+    
+    def _with_identity(self, result: Dict[str, Any], face_id: str, confidence: float) -> Dict[str, Any]:
+        """Complete a tracked face with the identity of its track."""
+        result = result.copy()
+        result["face_id"] = face_id
+        result["confidence"] = confidence
+        result["processed_at"] = time.time()
+        result["identity_source"] = "track"
+        return result
+    
     def _store_result(self, result: Dict[str, Any]):
         """
         Store result in Redis.
@@ -0,0 +1,318 @@
+import os
+import logging
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+from typing import Dict, Any, Optional, Set, Tuple
+
+from prod.config import SHM_RING_SLOTS, SHM_PREFIX
+
+logger = logging.getLogger('shm_ring')
+
+# Segment layout: a small header (magic, slot count, bytes per slot), then
+# one sequence number per slot, one (height, width, channels) per slot, and
+# finally the pixel data of every slot, 64-byte aligned.
+SEGMENT_MAGIC = 0x46524d52494e4731  # "FRMRING1"
+HEADER_FIELDS = 3
+ALIGNMENT = 64
+
+# Segments created by this process, which its resource tracker already owns
+_created = set()
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to an existing segment without taking ownership of it.
+
+    Before Python 3.13 every attaching process registers the segment with
+    its resource tracker, which unlinks it when that process exits; readers
+    must not do that to the writer's segment.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        segment = shared_memory.SharedMemory(name=name)
+        if name not in _created:
+            resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class FrameRingBuffer:
+    """
+    Ring of frame slots in shared memory, written by a single producer.
+
+    Each slot carries the sequence number of the frame it holds. The writer
+    clears it before copying a new frame in and sets it once the copy is
+    complete; a reader copies the frame out and then checks that the
+    sequence number is still the one it was given, so frames overwritten
+    while (or before) being read are detected and never returned torn.
+    """
+
+    def __init__(self, segment: shared_memory.SharedMemory, owner: bool):
+        """
+        Wrap a shared memory segment. Use create() or attach() instead.
+
+        Args:
+            segment: Shared memory segment
+            owner: Whether this process created (and will unlink) the segment
+        """
+        self.segment = segment
+        self.owner = owner
+        self.name = segment.name
+
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=segment.buf)
+        if int(header[0]) != SEGMENT_MAGIC:
+            raise ValueError(f"Shared memory segment {segment.name} is not a frame ring")
+        self.slots = int(header[1])
+        self.slot_bytes = int(header[2])
+
+        offset = header.nbytes
+        self.seqs = np.ndarray((self.slots,), dtype=np.uint64, buffer=segment.buf, offset=offset)
+        offset += self.seqs.nbytes
+        self.shapes = np.ndarray((self.slots, 3), dtype=np.uint32, buffer=segment.buf, offset=offset)
+        offset = _align(offset + self.shapes.nbytes)
+        self.data = np.ndarray((self.slots, self.slot_bytes), dtype=np.uint8, buffer=segment.buf, offset=offset)
+
+        self.seq = 0
+
+    @classmethod
+    def create(cls, name: str, slot_bytes: int, slots: int = SHM_RING_SLOTS) -> "FrameRingBuffer":
+        """
+        Create a new ring.
+
+        Args:
+            name: Shared memory segment name
+            slot_bytes: Capacity of each slot in bytes
+            slots: Number of slots
+
+        Returns:
+            Ring owned by this process
+        """
+        header_bytes = HEADER_FIELDS * 8 + slots * 8 + slots * 3 * 4
+        segment = shared_memory.SharedMemory(name=name, create=True, size=_align(header_bytes) + slots * slot_bytes)
+        _created.add(segment.name)
+
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.uint64, buffer=segment.buf)
+        header[:] = (SEGMENT_MAGIC, slots, slot_bytes)
+        ring = cls(segment, owner=True)
+        ring.seqs[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name: str) -> "FrameRingBuffer":
+        """
+        Attach to a ring created by another process.
+
+        Args:
+            name: Shared memory segment name
+
+        Returns:
+            Ring for reading
+        """
+        return cls(_attach(name), owner=False)
+
+    def write(self, frame: np.ndarray) -> Tuple[int, int]:
+        """
+        Copy a frame into the next slot.
+
+        Args:
+            frame: uint8 image, at most slot_bytes large
+
+        Returns:
+            Tuple of (slot, seq) identifying the frame
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f"Frame of {frame.nbytes} bytes does not fit in {self.slot_bytes}-byte slots")
+
+        self.seq += 1
+        slot = self.seq % self.slots
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+
+        # Invalidate the slot while its contents are inconsistent
+        self.seqs[slot] = 0
+        self.shapes[slot] = (height, width, channels)
+        self.data[slot, :frame.nbytes] = frame.reshape(-1)
+        self.seqs[slot] = self.seq
+
+        return slot, self.seq
+
+    def read(self, slot: int, seq: int) -> Optional[np.ndarray]:
+        """
+        Copy a frame out of a slot.
+
+        Args:
+            slot: Slot returned by write
+            seq: Sequence number returned by write
+
+        Returns:
+            The frame, or None if it has been overwritten
+        """
+        if int(self.seqs[slot]) != seq:
+            return None
+
+        height, width, channels = (int(v) for v in self.shapes[slot])
+        frame = self.data[slot, :height * width * channels].copy()
+
+        # A writer may have lapped us during the copy
+        if int(self.seqs[slot]) != seq:
+            return None
+
+        if channels == 1:
+            return frame.reshape(height, width)
+        return frame.reshape(height, width, channels)
+
+    def close(self):
+        """Detach from the ring, removing it if this process created it."""
+        # Drop the numpy views first, the segment cannot close while exported
+        self.seqs = self.shapes = self.data = None
+        self.segment.close()
+        if self.owner:
+            _created.discard(self.name)
+            try:
+                self.segment.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class ShmFrameWriter:
+    """Producer side: writes one stream's frames and builds their descriptors."""
+
+    def __init__(self, stream_id: str, slots: int = SHM_RING_SLOTS):
+        """
+        Initialize the writer. The ring is created on the first frame.
+
+        Args:
+            stream_id: Stream the frames belong to
+            slots: Number of slots in the ring
+        """
+        self.stream_id = stream_id
+        self.slots = slots
+        self.generation = 0
+        self.ring = None
+
+    def write(self, frame: np.ndarray) -> Dict[str, Any]:
+        """
+        Put a frame into shared memory.
+
+        Args:
+            frame: uint8 image
+
+        Returns:
+            Descriptor fields to add to the frame metadata
+        """
+        if self.ring is None or frame.nbytes > self.ring.slot_bytes:
+            # First frame, or the stream resolution grew: start a new ring.
+            # Readers attach to the new name from the next descriptor on.
+            self.close()
+            self.generation += 1
+            name = f"{SHM_PREFIX}_{self.stream_id}_{os.getpid()}_{self.generation}"
+            self.ring = FrameRingBuffer.create(name, frame.nbytes, self.slots)
+            logger.info(f"Created shared memory ring {name}: {self.slots} slots of {frame.nbytes} bytes")
+
+        slot, seq = self.ring.write(frame)
+        return {"shm_name": self.ring.name, "shm_slot": slot, "shm_seq": seq}
+
+    def close(self):
+        """Remove the ring."""
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class ShmFrameReader:
+    """
+    Consumer side: resolves frame descriptors to frames.
+
+    Shared by the detector's worker threads. A stream's newest ring
+    replaces its previous one, whether it is a new generation (after a
+    resolution change) or comes from a restarted capture process; the
+    replaced ring is only closed once no thread is still reading from it.
+    """
+
+    def __init__(self):
+        """Initialize the reader with no rings attached."""
+        self.rings: Dict[str, FrameRingBuffer] = {}
+        # Newest ring of each stream, and the rings it replaced
+        self.current: Dict[str, str] = {}
+        self.superseded: Set[str] = set()
+        # Replaced rings still being read, and reads in progress per ring
+        self.retired: Dict[str, FrameRingBuffer] = {}
+        self.readers: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def read(self, metadata: Dict[str, Any]) -> Optional[np.ndarray]:
+        """
+        Read the frame a descriptor points to.
+
+        Args:
+            metadata: Frame metadata containing stream_id, shm_name, shm_slot
+                and shm_seq
+
+        Returns:
+            The frame, or None if it was overwritten or its ring is gone
+        """
+        name = metadata["shm_name"]
+        ring = self._acquire(name, metadata["stream_id"])
+        if ring is None:
+            return None
+        try:
+            return ring.read(metadata["shm_slot"], metadata["shm_seq"])
+        finally:
+            self._release(name)
+
+    def _acquire(self, name: str, stream_id: str) -> Optional[FrameRingBuffer]:
+        """Attach to a ring, once per name, and register a read in progress."""
+        with self.lock:
+            ring = self.rings.get(name) or self.retired.get(name)
+            if ring is None:
+                if name in self.superseded:
+                    # Late descriptor of a ring its stream has moved on from
+                    return None
+                try:
+                    ring = FrameRingBuffer.attach(name)
+                except FileNotFoundError:
+                    logger.warning(f"Shared memory ring {name} no longer exists")
+                    return None
+
+                # Keyed on the stream, not the ring name, as a restarted
+                # capture process writes rings named after its new pid
+                old_name = self.current.get(stream_id)
+                if old_name is not None:
+                    self.superseded.add(old_name)
+                    old_ring = self.rings.pop(old_name)
+                    if self.readers.get(old_name):
+                        self.retired[old_name] = old_ring
+                    else:
+                        old_ring.close()
+
+                self.current[stream_id] = name
+                self.rings[name] = ring
+
+            self.readers[name] = self.readers.get(name, 0) + 1
+            return ring
+
+    def _release(self, name: str):
+        """End a read, closing the ring if it was replaced meanwhile and this was its last read."""
+        with self.lock:
+            self.readers[name] -= 1
+            if self.readers[name]:
+                return
+            del self.readers[name]
+            if name in self.retired:
+                self.retired.pop(name).close()
+
+    def close(self):
+        """Detach from all rings."""
+        with self.lock:
+            for ring in list(self.rings.values()) + list(self.retired.values()):
+                ring.close()
+            self.rings.clear()
+            self.retired.clear()
+            self.current.clear()
@@ -141,8 +141,8 @@ start_service() {
 # Launch services
 RTSP_URLS=${RTSP_URLS:-"rtsp://example.com/stream1"}
 start_service "stream_processor" "prod.stream_processor.stream_processor" "--urls $RTSP_URLS"
-start_service "face_detection" "prod.face_detection.face_detection" "--model $MODEL_PATH --workers 2"
-start_service "face_recognition" "prod.face_recognition.face_recognition" "--workers 2 --threshold 0.7"
+start_service "face_detection" "prod.face_detection.face_detection" "--model $MODEL_PATH"
+start_service "face_recognition" "prod.face_recognition.face_recognition" "--threshold 0.7"
 start_service "result_aggregator" "prod.result_aggregator.result_aggregator" "--workers 2 --ttl 3600"
 start_service "web_interface" "prod.web_interface.app" ""
 
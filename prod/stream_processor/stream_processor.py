@@ -1,21 +1,41 @@
+import os
 import cv2
+import numpy as np
 import time
+import queue
 import threading
 import logging
+import multiprocessing
 import redis
 import signal
 import sys
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from prod.config import (
     REDIS_HOST,
-    REDIS_PORT, 
-    REDIS_DB, 
+    REDIS_PORT,
+    REDIS_DB,
     REDIS_PASSWORD,
-    FRAMES_QUEUE,
-    FRAME_SAMPLE_RATE
+    PIPELINE_STATS,
+    DETECTION_GROUP,
+    FRAME_SAMPLE_RATE,
+    FRAME_TRANSPORT,
+    FACE_TRANSPORT,
+    QUEUE_BACKEND,
+    PER_STREAM_QUEUES,
+    CAPTURE_MODE,
+    CAPTURE_PROCESSES,
+    MOTION_GATING,
+    DETECTION_FRAME_WIDTH,
+    BACKPRESSURE_INTERVAL,
+    STATS_LOG_INTERVAL
 )
-from prod.utils import get_redis_connection, encode_frame_data
+from prod.backpressure import AdaptiveSampleRate
+from prod.frame_store import FrameStore, frame_key
+from prod.motion import MotionGate
+from prod.queues import get_queue, frames_queue_name
+from prod.shm_ring import ShmFrameWriter
+from prod.utils import get_redis_connection
 
 # Configure logging
 logging.basicConfig(
@@ -27,23 +47,108 @@ logger = logging.getLogger('stream_processor')
 class RTSPStreamProcessor:
     """Processes RTSP streams and extracts frames for face detection."""
     
-    def __init__(self, rtsp_urls: List[str]):
+    def __init__(self, rtsp_urls: List[str], queue_backend: str = QUEUE_BACKEND,
+                 frame_transport: str = FRAME_TRANSPORT,
+                 capture_mode: str = CAPTURE_MODE,
+                 capture_processes: int = CAPTURE_PROCESSES,
+                 motion_gating: bool = MOTION_GATING,
+                 detection_width: int = DETECTION_FRAME_WIDTH,
+                 face_transport: str = FACE_TRANSPORT,
+                 stream_ids: Optional[List[str]] = None,
+                 stats_queue=None):
         """
         Initialize the RTSP stream processor.
         
         Args:
             rtsp_urls: List of RTSP stream URLs to process
+            queue_backend: Queue backend used to hand frames to detection
+            frame_transport: "queue" to send frames on the queue, "shm" to keep
+                them in shared memory and queue only a descriptor
+            capture_mode: "thread" to capture every stream in a thread of this
+                process, "process" to spread them over worker processes
+            capture_processes: Number of worker processes in process mode,
+                0 for one per CPU
+            motion_gating: Whether to only send frames with motion (and
+                periodic keyframes) to face detection
+            detection_width: Send detection a copy of wider frames downscaled
+                to this width and keep the original in the frame store, 0 to
+                send full frames
+            face_transport: "reference" to put every frame in the frame store
+                once and queue only its key, "crop" to queue the frame itself
+            stream_ids: Stream ids of the URLs, "stream_<index>" by default
+            stats_queue: Queue to send stream stats to instead of logging them,
+                used by capture worker processes
         """
+        if frame_transport == "shm" and queue_backend == "inprocess":
+            # In-process queues already pass frames by reference
+            frame_transport = "queue"
+        if capture_mode == "process" and queue_backend == "inprocess":
+            # In-process queues cannot cross process boundaries
+            logger.warning("Process capture mode needs a Redis queue backend, using threads")
+            capture_mode = "thread"
+        if detection_width and frame_transport == "shm":
+            # Shared memory frames cost no encoding, there is nothing to save
+            logger.warning("Detection frame width is ignored with the shm frame transport")
+            detection_width = 0
+        if face_transport == "reference" and queue_backend == "inprocess":
+            # In-process queues already pass frames by reference
+            face_transport = "crop"
+        
         self.rtsp_urls = rtsp_urls
-        self.redis_client = get_redis_connection()
+        self.stream_ids = stream_ids or [f"stream_{i}" for i in range(len(rtsp_urls))]
+        self.queue_backend = queue_backend
+        self.frame_transport = frame_transport
+        self.capture_mode = capture_mode
+        self.motion_gating = motion_gating
+        self.detection_width = detection_width
+        self.face_transport = face_transport
+        self.stats_queue = stats_queue
         self.capture_threads = {}
         self.stop_event = threading.Event()
         
+        # Cumulative per-stream counters, see _update_stats
+        self.stats_lock = threading.Lock()
+        self.stream_stats: Dict[str, Dict[str, float]] = {}
+        self.reported_stats: Dict[str, Dict[str, float]] = {}
+        
+        # Lowered while detection lags behind; with a shared frames queue all
+        # streams of the process follow the same rate
+        if PER_STREAM_QUEUES:
+            self.sample_rates = {stream_id: AdaptiveSampleRate(stream_id) for stream_id in self.stream_ids}
+        else:
+            self.sample_rates = dict.fromkeys(self.stream_ids, AdaptiveSampleRate())
+        
+        if capture_mode == "process":
+            # The supervisor only distributes streams, the workers capture them
+            processes = capture_processes or os.cpu_count() or 1
+            processes = max(1, min(processes, len(rtsp_urls)))
+            self.process_streams = [[] for _ in range(processes)]
+            for i, (stream_id, url) in enumerate(zip(self.stream_ids, rtsp_urls)):
+                self.process_streams[i % processes].append((stream_id, url))
+            self.mp_context = multiprocessing.get_context("spawn")
+            self.process_stop_event = self.mp_context.Event()
+            self.stats_queue = self.mp_context.Queue()
+            self.capture_processes: List[Optional[multiprocessing.Process]] = [None] * processes
+            self.process_restarts = [0] * processes
+        else:
+            self.redis_client = get_redis_connection()
+            # Opened with the detection group so the backlog can be measured
+            self.frames_queues = {
+                stream_id: get_queue(frames_queue_name(stream_id), group=DETECTION_GROUP,
+                                     redis_client=self.redis_client, backend=queue_backend)
+                for stream_id in self.stream_ids
+            }
+            store_frames = detection_width or (face_transport == "reference" and frame_transport == "queue")
+            self.frame_store = FrameStore(self.redis_client, backend=queue_backend) if store_frames else None
+        
         # Register signal handlers
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
         
-        logger.info(f"Stream processor initialized with {len(rtsp_urls)} streams")
+        logger.info(f"Stream processor initialized with {len(rtsp_urls)} streams, "
+                    f"frame transport: {frame_transport}, capture mode: {capture_mode}, "
+                    f"motion gating: {motion_gating}, detection width: {detection_width or 'full'}, "
+                    f"face transport: {face_transport}")
     
     def _signal_handler(self, sig, frame):
         """Handle termination signals gracefully."""
@@ -51,9 +156,12 @@ class RTSPStreamProcessor:
         self.stop_event.set()
     
     def start(self):
-        """Start processing all streams in separate threads."""
-        for i, url in enumerate(self.rtsp_urls):
-            stream_id = f"stream_{i}"
+        """Start processing all streams in separate threads or processes."""
+        if self.capture_mode == "process":
+            self._supervise()
+            return
+        
+        for stream_id, url in zip(self.stream_ids, self.rtsp_urls):
             thread = threading.Thread(
                 target=self._process_stream,
                 args=(url, stream_id),
@@ -63,15 +171,94 @@ class RTSPStreamProcessor:
             thread.start()
             logger.info(f"Started thread for {stream_id} - {url}")
         
-        # Keep the main thread alive
+        # Keep the main thread alive, adapt to backpressure and report stream stats periodically
+        last_report = time.monotonic()
+        last_check = time.monotonic()
         try:
             while not self.stop_event.is_set():
-                time.sleep(1)
+                time.sleep(min(1.0, BACKPRESSURE_INTERVAL))
+                if time.monotonic() - last_check >= BACKPRESSURE_INTERVAL:
+                    self._check_backpressure()
+                    last_check = time.monotonic()
+                
+                if self.stats_queue is not None:
+                    # Capture worker: the supervisor aggregates and logs
+                    with self.stats_lock:
+                        snapshot = {stream_id: dict(stats) for stream_id, stats in self.stream_stats.items()}
+                    self.stats_queue.put(snapshot)
+                elif time.monotonic() - last_report >= STATS_LOG_INTERVAL:
+                    self._log_stats(time.monotonic() - last_report)
+                    last_report = time.monotonic()
+        except KeyboardInterrupt:
+            logger.info("Keyboard interrupt received, shutting down...")
+        finally:
+            self._cleanup()
+    
+    def _supervise(self):
+        """
+        Run the capture worker processes, restarting any that die, and
+        collect their stream stats.
+        """
+        for index in range(len(self.capture_processes)):
+            self._start_capture_process(index)
+        
+        last_report = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                self._collect_stats(timeout=1)
+                
+                for index, process in enumerate(self.capture_processes):
+                    if process.is_alive() or self.stop_event.is_set():
+                        continue
+                    self.process_restarts[index] += 1
+                    logger.error(f"Capture process {index} exited with code {process.exitcode}, "
+                                 f"restarting (restart #{self.process_restarts[index]})")
+                    self._start_capture_process(index)
+                
+                if time.monotonic() - last_report >= STATS_LOG_INTERVAL:
+                    self._log_stats(time.monotonic() - last_report)
+                    last_report = time.monotonic()
         except KeyboardInterrupt:
             logger.info("Keyboard interrupt received, shutting down...")
         finally:
             self._cleanup()
     
+    def _start_capture_process(self, index: int):
+        """
+        Start (or restart) a capture worker process.
+        
+        Args:
+            index: Index of the worker, selecting the streams it captures
+        """
+        streams = self.process_streams[index]
+        process = self.mp_context.Process(
+            target=_run_capture_process,
+            args=(streams, self.queue_backend, self.frame_transport, self.motion_gating,
+                  self.detection_width, self.face_transport, self.process_stop_event, self.stats_queue),
+            name=f"capture_{index}",
+            daemon=True
+        )
+        process.start()
+        self.capture_processes[index] = process
+        logger.info(f"Started capture process {index} (pid {process.pid}) for "
+                    f"{', '.join(stream_id for stream_id, _ in streams)}")
+    
+    def _collect_stats(self, timeout: float):
+        """
+        Merge stats snapshots sent by the capture worker processes.
+        
+        Args:
+            timeout: Maximum time to wait for the first snapshot
+        """
+        try:
+            snapshot = self.stats_queue.get(timeout=timeout)
+            while True:
+                with self.stats_lock:
+                    self.stream_stats.update(snapshot)
+                snapshot = self.stats_queue.get_nowait()
+        except queue.Empty:
+            pass
+    
     def _process_stream(self, rtsp_url: str, stream_id: str):
         """
         Process a single RTSP stream.
@@ -88,51 +275,215 @@ class RTSPStreamProcessor:
             logger.error(f"Failed to open stream: {rtsp_url}")
             return
         
-        # Get FPS of stream to calculate frame skipping
+        # Sampling follows the wall clock; the reported FPS is only used to
+        # estimate lag, since many cameras report it wrongly or not at all
         fps = cap.get(cv2.CAP_PROP_FPS)
         if fps <= 0:
-            logger.warning(f"Could not determine FPS for {stream_id}, using default of 30")
-            fps = 30
+            logger.warning(f"Could not determine FPS for {stream_id}, lag will not be reported")
+        logger.info(f"Stream {stream_id} FPS: {fps}, sampling {FRAME_SAMPLE_RATE} frames/sec")
+        
+        next_sample = time.monotonic()
+        frame_seq = 0
+        
+        # Lag is how far the frames read trail the wall clock since connecting
+        connected_at = time.monotonic()
+        frames_since_connect = 0
+        lag = 0.0
+        
+        frames_queue = self.frames_queues[stream_id]
+        sample_rate = self.sample_rates[stream_id]
         
-        # Calculate frames to skip based on desired sample rate
-        frames_to_skip = max(1, int(fps / FRAME_SAMPLE_RATE))
-        logger.info(f"Stream {stream_id} FPS: {fps}, sampling every {frames_to_skip} frames")
+        # Frames without motion are dropped before they cost detection time
+        motion_gate = MotionGate() if self.motion_gating else None
         
-        frame_count = 0
+        # Same-host detectors read frames from this stream's shared memory ring
+        shm_writer = ShmFrameWriter(stream_id) if self.frame_transport == "shm" else None
         
         while not self.stop_event.is_set():
             try:
-                ret, frame = cap.read()
-                if not ret:
+                # Demux the next frame without decoding it
+                if not cap.grab():
                     logger.warning(f"Failed to read frame from {stream_id}, reconnecting...")
                     time.sleep(1)
                     cap.release()
                     cap = cv2.VideoCapture(rtsp_url)
+                    connected_at = time.monotonic()
+                    frames_since_connect = 0
                     continue
                 
-                frame_count += 1
+                now = time.monotonic()
+                frames_since_connect += 1
+                if fps > 0:
+                    lag = now - connected_at - frames_since_connect / fps
+                
+                # Only decode the frames that are due
+                if now < next_sample:
+                    self._update_stats(stream_id, lag)
+                    continue
                 
-                # Only process every nth frame
-                if frame_count % frames_to_skip != 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    logger.warning(f"Failed to decode frame from {stream_id}")
+                    self._update_stats(stream_id, lag)
+                    continue
+                
+                # Keep the schedule, but do not burst to catch up after a stall
+                sample_interval = 1.0 / sample_rate.rate
+                next_sample += sample_interval
+                if next_sample <= now:
+                    next_sample = now + sample_interval
+                
+                if motion_gate is not None and not motion_gate.check(frame, now):
+                    self._update_stats(stream_id, lag, suppressed=True)
                     continue
                 
                 # Current timestamp
                 timestamp = time.time()
                 
-                # Encode and queue the frame
-                encoded_data = encode_frame_data(frame, timestamp, stream_id)
-                self.redis_client.rpush(FRAMES_QUEUE, encoded_data)
+                # Queue the frame (encoded by the queue if it leaves the process)
+                frame_seq += 1
+                metadata = {
+                    "timestamp": timestamp,
+                    "stream_id": stream_id,
+                    "frame_seq": frame_seq,
+                }
+                if self.detection_width and frame.shape[1] > self.detection_width:
+                    frame = self._downscale_for_detection(frame, metadata)
+                elif self.face_transport == "reference" and shm_writer is None:
+                    # Detection reads the frame from the store too, so it is encoded once
+                    self._store_frame(frame, metadata)
+                    frame = None
+                if shm_writer is not None:
+                    metadata.update(shm_writer.write(frame))
+                    frame = None
+                frames_queue.put((frame, metadata))
+                self._update_stats(stream_id, lag, sampled=True)
                 
                 logger.debug(f"Queued frame from {stream_id} at {timestamp}")
-                
+            
             except Exception as e:
                 logger.error(f"Error processing stream {stream_id}: {str(e)}")
                 time.sleep(1)
         
         # Clean up resources
         cap.release()
+        if shm_writer is not None:
+            shm_writer.close()
         logger.info(f"Stopped processing stream: {stream_id}")
     
+    def _store_frame(self, frame: np.ndarray, metadata: Dict[str, Any]):
+        """
+        Put a frame in the frame store and add its key to the metadata.
+        
+        Args:
+            frame: Full-resolution frame
+            metadata: Frame metadata, updated in place
+        """
+        key = frame_key(metadata["stream_id"], metadata["timestamp"])
+        self.frame_store.put(key, frame, metadata["timestamp"], metadata["stream_id"], metadata["frame_seq"])
+        metadata["frame_key"] = key
+    
+    def _downscale_for_detection(self, frame: np.ndarray, metadata: Dict[str, Any]) -> np.ndarray:
+        """
+        Store a frame at full resolution and return a copy downscaled to the
+        detection width.
+        
+        Detection only needs the small copy; the metadata gets the frame
+        store key and the scale factors that map its detections back to
+        full-resolution coordinates.
+        
+        Args:
+            frame: Full-resolution frame
+            metadata: Frame metadata, updated in place
+            
+        Returns:
+            Downscaled frame
+        """
+        height, width = frame.shape[:2]
+        self._store_frame(frame, metadata)
+        
+        small_size = (self.detection_width, max(1, round(height * self.detection_width / width)))
+        small = cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA)
+        metadata["scale_x"] = width / small_size[0]
+        metadata["scale_y"] = height / small_size[1]
+        return small
+    
+    def _check_backpressure(self):
+        """Adapt the sample rates to the frames queue backlog and publish them."""
+        try:
+            # One depth check per queue, shared queues are only checked once
+            updated = set()
+            for stream_id, sample_rate in self.sample_rates.items():
+                if sample_rate not in updated:
+                    sample_rate.update(self.frames_queues[stream_id].depth())
+                    updated.add(sample_rate)
+            
+            rates = {stream_id: sample_rate.rate for stream_id, sample_rate in self.sample_rates.items()}
+            with self.stats_lock:
+                for stream_id, stats in self.stream_stats.items():
+                    stats["rate"] = rates[stream_id]
+            
+            if self.queue_backend != "inprocess":
+                self.redis_client.hset(
+                    PIPELINE_STATS,
+                    mapping={f"sample_rate:{stream_id}": rate for stream_id, rate in rates.items()}
+                )
+        except Exception as e:
+            logger.error(f"Error checking frames queue depth: {str(e)}")
+    
+    def _update_stats(self, stream_id: str, lag: float, sampled: bool = False, suppressed: bool = False):
+        """
+        Count a frame read from a stream.
+        
+        Args:
+            stream_id: Stream the frame was read from
+            lag: Seconds the stream is behind real time
+            sampled: Whether the frame was queued for detection
+            suppressed: Whether the frame was due but dropped for lack of motion
+        """
+        with self.stats_lock:
+            stats = self.stream_stats.setdefault(stream_id, {"read": 0, "sampled": 0, "suppressed": 0, "lag": 0.0,
+                                                             "rate": self.sample_rates[stream_id].rate})
+            stats["read"] += 1
+            stats["sampled"] += sampled
+            stats["suppressed"] += suppressed
+            stats["lag"] = max(0.0, lag)
+    
+    def _log_stats(self, elapsed: float):
+        """
+        Log per-stream frame rates and lag since the last report.
+        
+        Args:
+            elapsed: Seconds covered by this report
+        """
+        with self.stats_lock:
+            current = {stream_id: dict(stats) for stream_id, stats in self.stream_stats.items()}
+        
+        for stream_id in self.stream_ids:
+            stats = current.get(stream_id)
+            if stats is None:
+                logger.warning(f"{stream_id}: no frames read yet")
+                continue
+            
+            # Counters restart from zero when a capture process is restarted
+            previous = self.reported_stats.get(stream_id, {})
+            delta = {}
+            for key in ("read", "sampled", "suppressed"):
+                last = previous.get(key, 0)
+                delta[key] = stats[key] - last if stats[key] >= last else stats[key]
+            self.reported_stats[stream_id] = stats
+            
+            message = (f"{stream_id}: read {delta['read'] / elapsed:.1f} frames/sec, "
+                       f"sampled {delta['sampled'] / elapsed:.1f}/{stats['rate']:.1f} frames/sec, "
+                       f"lag {stats['lag']:.1f}s")
+            if stats["rate"] < FRAME_SAMPLE_RATE:
+                message += f", backpressure (target {FRAME_SAMPLE_RATE} frames/sec)"
+            if self.motion_gating:
+                due = delta["sampled"] + delta["suppressed"]
+                share = delta["suppressed"] / due if due else 0.0
+                message += f", suppressed {delta['suppressed']} still frames ({share:.0%})"
+            logger.info(message)
+    
     def _cleanup(self):
         """Clean up resources before shutdown."""
         logger.info("Cleaning up resources...")
@@ -143,21 +494,87 @@ class RTSPStreamProcessor:
             thread.join(timeout=2)
             logger.info(f"Thread for {stream_id} joined")
         
+        # Stop the capture processes, forcibly if they do not exit in time
+        if self.capture_mode == "process":
+            self.process_stop_event.set()
+            for index, process in enumerate(self.capture_processes):
+                if process is None:
+                    continue
+                process.join(timeout=5)
+                if process.is_alive():
+                    logger.warning(f"Capture process {index} did not stop, terminating")
+                    process.terminate()
+                    process.join(timeout=2)
+                logger.info(f"Capture process {index} joined")
+        
         logger.info("Stream processor shutdown complete")
 
 
+def _run_capture_process(streams: List[Tuple[str, str]], queue_backend: str, frame_transport: str,
+                         motion_gating: bool, detection_width: int, face_transport: str,
+                         stop_event, stats_queue):
+    """
+    Entry point of a capture worker process.
+    
+    Args:
+        streams: (stream_id, url) pairs to capture
+        queue_backend: Queue backend used to hand frames to detection
+        frame_transport: "queue" or "shm"
+        motion_gating: Whether to drop frames without motion
+        detection_width: Width frames are downscaled to for detection, 0 for full frames
+        face_transport: "crop" or "reference"
+        stop_event: Event set by the supervisor to stop all workers
+        stats_queue: Queue to send stream stats to the supervisor
+    """
+    processor = RTSPStreamProcessor(
+        [url for _, url in streams],
+        queue_backend=queue_backend,
+        frame_transport=frame_transport,
+        capture_mode="thread",
+        motion_gating=motion_gating,
+        detection_width=detection_width,
+        face_transport=face_transport,
+        stream_ids=[stream_id for stream_id, _ in streams],
+        stats_queue=stats_queue
+    )
+    processor.stop_event = stop_event
+    
+    # The supervisor handles Ctrl+C; a worker killed on its own is restarted
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    
+    processor.start()
+
+
 def main():
     """Main entry point for the stream processor service."""
     import argparse
     
     parser = argparse.ArgumentParser(description='RTSP Stream Processor')
     parser.add_argument('--urls', nargs='+', required=True, help='RTSP stream URLs')
+    parser.add_argument('--frame-transport', choices=['queue', 'shm'], default=FRAME_TRANSPORT,
+                        help='Send frames on the queue, or through shared memory to detectors on this host')
+    parser.add_argument('--capture-mode', choices=['thread', 'process'], default=CAPTURE_MODE,
+                        help='Capture streams in threads of one process, or spread them over worker processes')
+    parser.add_argument('--processes', type=int, default=CAPTURE_PROCESSES,
+                        help='Number of capture processes in process mode, 0 for one per CPU')
+    parser.add_argument('--motion-gating', action='store_true', default=MOTION_GATING,
+                        help='Only send frames with motion (and periodic keyframes) to face detection')
+    parser.add_argument('--detection-width', type=int, default=DETECTION_FRAME_WIDTH,
+                        help='Send detection frames downscaled to this width, 0 for full frames')
     
     args = parser.parse_args()
     
-    processor = RTSPStreamProcessor(args.urls)
+    processor = RTSPStreamProcessor(
+        args.urls,
+        frame_transport=args.frame_transport,
+        capture_mode=args.capture_mode,
+        capture_processes=args.processes,
+        motion_gating=args.motion_gating,
+        detection_width=args.detection_width
+    )
     processor.start()
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
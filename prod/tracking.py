@@ -0,0 +1,192 @@
+import time
+import itertools
+import logging
+import numpy as np
+from typing import List, Tuple
+
+from prod.config import (
+    TRACK_IOU_THRESHOLD,
+    TRACK_MAX_AGE,
+    TRACK_REVERIFY_INTERVAL
+)
+
+logger = logging.getLogger('tracking')
+
+# Track ids start from the current time in milliseconds, so ids handed out
+# after a detector restart do not collide with those of the previous run
+_track_ids = itertools.count(int(time.time() * 1000))
+
+
+def _bbox_to_state(bbox: np.ndarray) -> np.ndarray:
+    """(x1, y1, x2, y2) to (center x, center y, area, aspect ratio)."""
+    width = bbox[2] - bbox[0]
+    height = bbox[3] - bbox[1]
+    return np.array([bbox[0] + width / 2, bbox[1] + height / 2, width * height, width / max(height, 1e-6)])
+
+
+def _state_to_bbox(state: np.ndarray) -> np.ndarray:
+    """(center x, center y, area, aspect ratio) to (x1, y1, x2, y2)."""
+    width = np.sqrt(max(state[2] * state[3], 0.0))
+    height = state[2] / max(width, 1e-6)
+    return np.array([state[0] - width / 2, state[1] - height / 2, state[0] + width / 2, state[1] + height / 2])
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    Intersection over union of every pair of boxes.
+
+    Args:
+        boxes_a: Array of shape (n, 4) of (x1, y1, x2, y2)
+        boxes_b: Array of shape (m, 4) of (x1, y1, x2, y2)
+
+    Returns:
+        Array of shape (n, m)
+    """
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-6)
+
+
+class KalmanBoxTracker:
+    """
+    Constant velocity Kalman filter over a box, as in SORT.
+
+    The state is the box center, area and aspect ratio plus the velocity of
+    the first three. Frames are sampled at a varying rate, so velocities are
+    per second and every prediction covers the time since the last one.
+    """
+
+    def __init__(self, bbox: np.ndarray, timestamp: float):
+        """
+        Start a track at a detection.
+
+        Args:
+            bbox: Detected box (x1, y1, x2, y2)
+            timestamp: Capture time of the frame
+        """
+        self.track_id = next(_track_ids)
+        self.x = np.zeros(7)
+        self.x[:4] = _bbox_to_state(bbox)
+        # Position is known, velocity is not
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1e4, 1e4, 1e4])
+        self.H = np.eye(4, 7)
+        self.R = np.diag([1.0, 1.0, 10.0, 10.0])
+        self.timestamp = timestamp
+        self.last_seen = timestamp
+        self.hits = 1
+        self.last_recognized = float('-inf')
+
+    def predict(self, timestamp: float) -> np.ndarray:
+        """
+        Advance the state to a frame's capture time.
+
+        Args:
+            timestamp: Capture time of the frame; older frames (read out of
+                order by another worker) do not move the state back
+
+        Returns:
+            Predicted box (x1, y1, x2, y2)
+        """
+        dt = max(0.0, timestamp - self.timestamp)
+        if dt > 0:
+            F = np.eye(7)
+            F[0, 4] = F[1, 5] = F[2, 6] = dt
+            Q = np.diag([1.0, 1.0, 1.0, 1e-2, 1e-2, 1e-2, 1e-4]) * dt
+            # Keep the area from going negative
+            if self.x[2] + self.x[6] * dt <= 0:
+                self.x[6] = 0.0
+            self.x = F @ self.x
+            self.P = F @ self.P @ F.T + Q
+            self.timestamp = timestamp
+        return _state_to_bbox(self.x)
+
+    def update(self, bbox: np.ndarray, timestamp: float):
+        """
+        Correct the state with a matched detection.
+
+        Args:
+            bbox: Detected box (x1, y1, x2, y2)
+            timestamp: Capture time of the frame
+        """
+        residual = _bbox_to_state(bbox) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ residual
+        self.P = (np.eye(7) - K @ self.H) @ self.P
+        self.last_seen = max(self.last_seen, timestamp)
+        self.hits += 1
+
+
+class FaceTracker:
+    """
+    SORT-style tracker of the faces of one stream.
+
+    Detections are matched to the predicted boxes of the live tracks by IoU
+    (greedily, best overlap first, which for the handful of faces in a frame
+    gives the same pairs as an optimal assignment); unmatched detections
+    start new tracks, and tracks without a detection for max_age seconds
+    end. A detection is due for recognition when its track is new or was
+    last recognized reverify_interval seconds ago.
+    """
+
+    def __init__(self, iou_threshold: float = TRACK_IOU_THRESHOLD,
+                 max_age: float = TRACK_MAX_AGE,
+                 reverify_interval: float = TRACK_REVERIFY_INTERVAL):
+        """
+        Initialize the tracker.
+
+        Args:
+            iou_threshold: Minimum IoU between a track and a detection to match
+            max_age: Seconds a track survives without detections
+            reverify_interval: Seconds between recognitions of a track
+        """
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.reverify_interval = reverify_interval
+        self.tracks: List[KalmanBoxTracker] = []
+
+    def update(self, bboxes: List[List[int]], timestamp: float) -> List[Tuple[int, bool]]:
+        """
+        Match the detections of a frame to the tracks.
+
+        Args:
+            bboxes: Detected boxes (x1, y1, x2, y2) of the frame
+            timestamp: Capture time of the frame
+
+        Returns:
+            One (track_id, recognize) tuple per box, recognize True when the
+            face should be sent to recognition
+        """
+        self.tracks = [track for track in self.tracks if timestamp - track.last_seen <= self.max_age]
+
+        detections = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        matched_tracks = [None] * len(detections)
+        if self.tracks and len(detections):
+            predicted = np.stack([track.predict(timestamp) for track in self.tracks])
+            ious = iou_matrix(detections, predicted)
+            for flat in np.argsort(-ious, axis=None):
+                detection, track = np.unravel_index(flat, ious.shape)
+                if ious[detection, track] < self.iou_threshold:
+                    break
+                if matched_tracks[detection] is None and self.tracks[track] not in matched_tracks:
+                    matched_tracks[detection] = self.tracks[track]
+
+        decisions = []
+        for detection, track in zip(detections, matched_tracks):
+            if track is None:
+                track = KalmanBoxTracker(detection, timestamp)
+                self.tracks.append(track)
+            else:
+                track.update(detection, timestamp)
+
+            recognize = timestamp - track.last_recognized >= self.reverify_interval
+            if recognize:
+                track.last_recognized = timestamp
+            decisions.append((track.track_id, recognize))
+
+        return decisions
@@ -1,17 +1,48 @@
 import json
+import hashlib
+import re
+import struct
 import redis
 import numpy as np
 import base64
 import cv2
 import time
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Union
 
 from prod.config import (
     REDIS_HOST, 
     REDIS_PORT, 
     REDIS_PASSWORD, 
-    REDIS_DB
+    REDIS_DB,
+    FRAME_ENVELOPE_VERSION,
+    FRAME_CODEC,
+    FACE_CODEC
 )
+from prod.image_codecs import ImageCodec, JpegCodec, RawCodec, get_codec, decode_with
+
+# Binary envelope used for frame and face messages:
+#   magic, version, flags, capture timestamp, stream index, frame sequence,
+#   bbox (x1, y1, x2, y2), detection timestamp, length of the extras JSON,
+# followed by the extras JSON (metadata fields not covered by the header,
+# usually empty) and the encoded image. The high nibble of the flags holds
+# the image codec id (0 = let cv2.imdecode detect the format). Legacy
+# messages start with a big-endian JSON length whose first byte is always
+# 0, so the magic below can never be mistaken for one.
+ENVELOPE_MAGIC = b'\xcf\xfe'
+ENVELOPE_VERSION = 2
+ENVELOPE_HEADER = struct.Struct('<2sBBdIQ4idI')
+ENVELOPE_FLAG_BBOX = 0x01
+ENVELOPE_FLAG_DETECTED_AT = 0x02
+ENVELOPE_CODEC_SHIFT = 4
+ENVELOPE_FIELDS = ("timestamp", "stream_id", "frame_seq", "bbox", "detected_at")
+STREAM_ID_PATTERN = re.compile(r'stream_(0|[1-9]\d{0,8})')
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+# Codecs selected by configuration for frames and face crops
+frame_codec = get_codec(FRAME_CODEC)
+face_codec = get_codec(FACE_CODEC)
+default_codec = JpegCodec()
 
 def get_redis_connection() -> redis.Redis:
     """Create and return a Redis connection using configuration settings."""
@@ -23,89 +54,197 @@ def get_redis_connection() -> redis.Redis:
         decode_responses=False  # Keep as bytes for binary data
     )
 
-def encode_image(image: np.ndarray) -> bytes:
+def encode_image(image: np.ndarray, codec: Optional[ImageCodec] = None) -> bytes:
     """Encode an OpenCV image to a compressed bytes format."""
-    success, encoded_img = cv2.imencode('.jpg', image)
-    if not success:
-        raise ValueError("Failed to encode image")
-    return encoded_img.tobytes()
+    return (codec or default_codec).encode(image)
 
-def decode_image(encoded_image: bytes) -> np.ndarray:
+def decode_image(encoded_image: Buffer, codec_id: int = ImageCodec.codec_id) -> np.ndarray:
     """Decode a compressed bytes format back to an OpenCV image."""
-    np_arr = np.frombuffer(encoded_image, np.uint8)
-    return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    return decode_with(codec_id, encoded_image)
 
-def encode_frame_data(frame: np.ndarray, timestamp: float, stream_id: str) -> bytes:
-    """Encode frame data for queue storage."""
-    encoded_image = encode_image(frame)
+def encode_message(metadata: Dict[str, Any], payload: bytes,
+                   codec_id: int = ImageCodec.codec_id,
+                   version: int = FRAME_ENVELOPE_VERSION) -> bytes:
+    """
+    Frame metadata and an encoded image into a single queue message.
+    
+    Args:
+        metadata: Message metadata
+        payload: Encoded image bytes
+        codec_id: Id of the codec that produced the payload
+        version: Envelope version, 1 for the legacy JSON framing
+        
+    Returns:
+        Message bytes
+    """
+    if version < ENVELOPE_VERSION:
+        if codec_id == RawCodec.codec_id:
+            raise ValueError("Raw images cannot be sent with the legacy JSON framing")
+        
+        # Legacy framing: length prefix, JSON metadata, image data
+        metadata_bytes = json.dumps(metadata).encode('utf-8')
+        metadata_length = len(metadata_bytes).to_bytes(4, byteorder='big')
+        return b''.join((metadata_length, metadata_bytes, payload))
+    
+    extras = {key: value for key, value in metadata.items() if key not in ENVELOPE_FIELDS}
+    
+    # Stream ids are "stream_<index>"; anything else travels in the extras
+    stream_id = metadata.get("stream_id", "")
+    stream_match = STREAM_ID_PATTERN.fullmatch(stream_id)
+    if stream_match:
+        stream_index = int(stream_match.group(1))
+    else:
+        stream_index = 0
+        extras["stream_id"] = stream_id
+    
+    flags = codec_id << ENVELOPE_CODEC_SHIFT
+    bbox = metadata.get("bbox")
+    if bbox is not None:
+        flags |= ENVELOPE_FLAG_BBOX
+    else:
+        bbox = (0, 0, 0, 0)
+    detected_at = metadata.get("detected_at")
+    if detected_at is not None:
+        flags |= ENVELOPE_FLAG_DETECTED_AT
+    
+    extras_bytes = json.dumps(extras).encode('utf-8') if extras else b''
+    header = ENVELOPE_HEADER.pack(
+        ENVELOPE_MAGIC,
+        ENVELOPE_VERSION,
+        flags,
+        metadata.get("timestamp", 0.0),
+        stream_index,
+        metadata.get("frame_seq", 0),
+        *bbox,
+        detected_at or 0.0,
+        len(extras_bytes)
+    )
+    return b''.join((header, extras_bytes, payload))
+
+def decode_message(message: Buffer) -> Tuple[Dict[str, Any], memoryview, int]:
+    """
+    Split a queue message into its metadata and encoded image.
+    
+    Accepts both the binary envelope and the legacy JSON framing.
+    
+    Args:
+        message: Message bytes
+        
+    Returns:
+        Tuple of (metadata, payload, codec_id); the payload is a view
+        into message
+    """
+    view = memoryview(message)
+    
+    if view[:2] != ENVELOPE_MAGIC:
+        # Legacy framing: first 4 bytes represent metadata length
+        metadata_length = int.from_bytes(view[:4], byteorder='big')
+        metadata = json.loads(bytes(view[4:4+metadata_length]).decode('utf-8'))
+        return metadata, view[4+metadata_length:], ImageCodec.codec_id
+    
+    (_, version, flags, timestamp, stream_index, frame_seq,
+     x1, y1, x2, y2, detected_at, extras_length) = ENVELOPE_HEADER.unpack_from(view)
+    if version > ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported envelope version {version}")
+    
     metadata = {
         "timestamp": timestamp,
-        "stream_id": stream_id,
+        "stream_id": f"stream_{stream_index}",
+        "frame_seq": frame_seq,
     }
+    if flags & ENVELOPE_FLAG_BBOX:
+        metadata["bbox"] = [x1, y1, x2, y2]
+    if flags & ENVELOPE_FLAG_DETECTED_AT:
+        metadata["detected_at"] = detected_at
     
-    # Convert metadata to JSON string then to bytes
-    metadata_bytes = json.dumps(metadata).encode('utf-8')
+    offset = ENVELOPE_HEADER.size
+    if extras_length:
+        metadata.update(json.loads(bytes(view[offset:offset+extras_length]).decode('utf-8')))
+        offset += extras_length
     
-    # Combine length prefix, metadata and image data
-    metadata_length = len(metadata_bytes).to_bytes(4, byteorder='big')
-    return metadata_length + metadata_bytes + encoded_image
+    return metadata, view[offset:], flags >> ENVELOPE_CODEC_SHIFT
+
+def peek_timestamp(message: Buffer) -> Optional[float]:
+    """
+    Read the capture timestamp of a queue message without decoding it.
+
+    Args:
+        message: Message bytes
+
+    Returns:
+        Capture timestamp, or None if the message has none
+    """
+    view = memoryview(message)
+
+    if view[:2] == ENVELOPE_MAGIC:
+        return ENVELOPE_HEADER.unpack_from(view)[3]
 
-def decode_frame_data(frame_data: bytes) -> Tuple[np.ndarray, Dict[str, Any]]:
+    # Legacy framing: only the metadata JSON has to be parsed
+    metadata_length = int.from_bytes(view[:4], byteorder='big')
+    metadata = json.loads(bytes(view[4:4+metadata_length]).decode('utf-8'))
+    return metadata.get("timestamp")
+
+def encode_frame_data(frame: np.ndarray, timestamp: float, stream_id: str,
+                      frame_seq: int = 0) -> bytes:
+    """Encode frame data for queue storage."""
+    encoded_image = encode_image(frame, frame_codec)
+    metadata = {
+        "timestamp": timestamp,
+        "stream_id": stream_id,
+        "frame_seq": frame_seq,
+    }
+    return encode_message(metadata, encoded_image, frame_codec.codec_id)
+
+def decode_frame_data(frame_data: Buffer) -> Tuple[np.ndarray, Dict[str, Any]]:
     """Decode frame data from queue storage."""
-    # First 4 bytes represent metadata length
-    metadata_length = int.from_bytes(frame_data[:4], byteorder='big')
-    
-    # Extract and parse metadata
-    metadata_bytes = frame_data[4:4+metadata_length]
-    metadata = json.loads(metadata_bytes.decode('utf-8'))
-    
-    # Extract and decode image
-    image_bytes = frame_data[4+metadata_length:]
-    frame = decode_image(image_bytes)
+    metadata, image_bytes, codec_id = decode_message(frame_data)
+    frame = decode_image(image_bytes, codec_id)
     
     return frame, metadata
 
 def encode_face_data(face_image: np.ndarray, bbox: List[int], 
                     metadata: Dict[str, Any]) -> bytes:
     """Encode detected face data for queue storage."""
-    encoded_face = encode_image(face_image)
+    encoded_face = encode_image(face_image, face_codec)
     
     # Add bbox to metadata
     metadata_with_bbox = metadata.copy()
     metadata_with_bbox["bbox"] = bbox
     
-    # Convert metadata to JSON string then to bytes
-    metadata_bytes = json.dumps(metadata_with_bbox).encode('utf-8')
-    
-    # Combine length prefix, metadata and image data
-    metadata_length = len(metadata_bytes).to_bytes(4, byteorder='big')
-    return metadata_length + metadata_bytes + encoded_face
+    return encode_message(metadata_with_bbox, encoded_face, face_codec.codec_id)
 
-def decode_face_data(face_data: bytes) -> Tuple[np.ndarray, Dict[str, Any]]:
+def decode_face_data(face_data: Buffer) -> Tuple[np.ndarray, Dict[str, Any]]:
     """Decode face data from queue storage."""
-    # First 4 bytes represent metadata length
-    metadata_length = int.from_bytes(face_data[:4], byteorder='big')
-    
-    # Extract and parse metadata
-    metadata_bytes = face_data[4:4+metadata_length]
-    metadata = json.loads(metadata_bytes.decode('utf-8'))
-    
-    # Extract and decode image
-    image_bytes = face_data[4+metadata_length:]
-    face_image = decode_image(image_bytes)
+    metadata, image_bytes, codec_id = decode_message(face_data)
+    face_image = decode_image(image_bytes, codec_id)
     
     return face_image, metadata
 
-def encode_recognition_result(face_id: str, confidence: float, 
-                           metadata: Dict[str, Any]) -> bytes:
-    """Encode face recognition result for queue storage."""
+def build_recognition_result(face_id: str, confidence: float,
+                             metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a face recognition result from the face metadata."""
     result = metadata.copy()
     result["face_id"] = face_id
     result["confidence"] = confidence
     result["processed_at"] = time.time()
     
+    return result
+
+def encode_recognition_result(face_id: str, confidence: float, 
+                           metadata: Dict[str, Any]) -> bytes:
+    """Encode face recognition result for queue storage."""
+    result = build_recognition_result(face_id, confidence, metadata)
+    
     return json.dumps(result).encode('utf-8')
 
 def decode_recognition_result(result_data: bytes) -> Dict[str, Any]:
     """Decode recognition result from queue storage."""
-    return json.loads(result_data.decode('utf-8')) 
\ No newline at end of file
+    return json.loads(result_data.decode('utf-8')) 
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
\ No newline at end of file
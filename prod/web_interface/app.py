@@ -17,12 +17,21 @@ from prod.config import (
     FRAMES_QUEUE,
     FACES_QUEUE,
     RECOGNITION_QUEUE,
-    DATABASE_URL
+    PIPELINE_STATS,
+    DATABASE_URL,
+    DETECTION_GROUP,
+    RECOGNITION_GROUP,
+    AGGREGATION_GROUP
 )
+from prod.queues import get_queue
 from prod.utils import get_redis_connection, decode_image
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 redis_client = get_redis_connection()
+# Opened with the consuming stage's group so stream backlogs are reported
+frames_queue = get_queue(FRAMES_QUEUE, group=DETECTION_GROUP, redis_client=redis_client)
+faces_queue = get_queue(FACES_QUEUE, group=RECOGNITION_GROUP, redis_client=redis_client)
+recognition_queue = get_queue(RECOGNITION_QUEUE, group=AGGREGATION_GROUP, redis_client=redis_client)
 
 # Cache for the latest processed frame from each stream
 latest_frames = {}
@@ -79,13 +88,33 @@ def get_stats():
     """Get system statistics"""
     try:
         # Get queue lengths
-        frames_queue_len = redis_client.llen(FRAMES_QUEUE)
-        faces_queue_len = redis_client.llen(FACES_QUEUE)
-        recognition_queue_len = redis_client.llen(RECOGNITION_QUEUE)
+        frames_queue_len = frames_queue.depth()
+        faces_queue_len = faces_queue.depth()
+        recognition_queue_len = recognition_queue.depth()
         
         # Get active streams
         streams = list(latest_frames.keys())
         
+        # Get load shedding: messages dropped or expired per queue (per-stream
+        # queues are named "<queue>:<stream>"), adaptive rate and detection
+        # wait per stream
+        dropped = {}
+        expired = {}
+        sample_rates = {}
+        detection_waits = {}
+        for key, value in redis_client.hgetall(PIPELINE_STATS).items():
+            key = key.decode('utf-8')
+            kind, _, stream_id = key.partition(':')
+            queue, _, counter = key.rpartition(':')
+            if kind == 'sample_rate':
+                sample_rates[stream_id] = float(value)
+            elif kind == 'detection_wait_ms':
+                detection_waits[stream_id] = float(value)
+            elif counter == 'dropped':
+                dropped[queue] = int(value)
+            elif counter == 'expired':
+                expired[queue] = int(value)
+        
         # Get detection counts
         results_count = len(redis_client.hgetall(RESULTS_STORE))
         
@@ -96,6 +125,10 @@ def get_stats():
                 'faces': faces_queue_len,
                 'recognition': recognition_queue_len
             },
+            'dropped': dropped,
+            'expired': expired,
+            'sample_rates': sample_rates,
+            'detection_waits': detection_waits,
             'streams': streams,
             'results_count': results_count,
             'timestamp': datetime.datetime.now().isoformat()